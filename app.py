@@ -7,13 +7,13 @@ import traceback
 import sys
 import time
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, jsonify, flash, session, send_from_directory
+from flask import (Flask, Response, render_template, request, redirect, url_for, jsonify, flash, session,
+                   send_from_directory, stream_with_context)
 import pandas as pd
+import numpy as np
 import sqlite3
-import yfinance as yf
 import time
 from init_db import init_db
-from openai import OpenAI
 import openai
 from dotenv import load_dotenv
 import threading
@@ -24,6 +24,28 @@ from dateutil.relativedelta import relativedelta
 import shutil
 from concurrent.futures import ThreadPoolExecutor, TimeoutError
 import re
+from utils.price_store import init_price_store, get_daily_bars, uncovered_symbols
+from utils.symbol_metadata import (init_symbol_metadata, refresh_symbol_metadata,
+                                   get_stale_symbols, get_categorized_symbols)
+from utils.ticker_info import init_ticker_info, get_ticker_info, prefetch_ticker_info
+from utils.split_index import compile_split_index
+from utils.singleflight import SingleFlight
+from utils.cache import BoundedCache, cache_stats, flush_caches
+from utils.market_data import endpoint_concurrency, get_market_data_provider
+from utils.resilience import ProviderUnavailableError
+from utils.db import connect as db_connect, pool_stats
+from utils.schema import create_transactions_table, migrate
+from utils.positions import init_positions, get_open_positions, get_position, MIN_OPEN_SHARES
+from utils.data_version import init_data_versions, get_data_version, get_symbol_version
+from utils.pagination import decode_cursor, encode_cursor, fetch_transaction_page, transaction_summary
+from utils.ingest import APPEND, INGEST_MODES, REPLACE, ingest_csv, load_transactions_snapshot
+from utils.cost_basis import COST_BASIS_METHODS, DEFAULT_METHOD as DEFAULT_COST_BASIS_METHOD, get_lot_book
+from utils.nav import build_nav
+from utils.llm import LONG_REQUEST_TIMEOUT, get_llm_client, get_llm_registry
+from utils.ai_executor import CancelledTaskError, SaturatedError, ai_executor, current_cancel_token
+from utils.llm_cache import init_llm_cache, llm_response_cache, response_key
+from utils.chat_context import chat_context
+from utils.prompt_budget import ContextItem, assemble, budget_for
 
 # Configure logging
 logging.basicConfig(
@@ -79,26 +101,26 @@ INVESTMENT_THESES = [
 # Set default model
 DEFAULT_PERPLEXITY_MODEL = 'sonar'
 
+# Words in a question that make the user's transaction rows relevant context
+TRADE_KEYWORDS = ['trade', 'trades', 'trading', 'buy', 'bought', 'sell', 'sold', 'transaction', 'transactions',
+                  'history', 'recent', 'last', 'when', 'entry', 'exit', 'timing']
+
 # Load environment variables from .env file
 load_dotenv()
 
-# Get OpenAI API key
-openai_api_key = os.getenv('OPENAI_API_KEY')
-
-# Initialize OpenAI client
-openai_client = OpenAI(api_key=openai_api_key)
+# OpenAI and Perplexity clients are long-lived and pooled; get them with
+# get_llm_client('openai') / get_llm_client('perplexity') (None without an API key)
 
-# Initialize Perplexity client (fallback)
-perplexity_client = None
-if os.getenv('PERPLEXITY_API_KEY'):
-    perplexity_client = OpenAI(
-        api_key=os.getenv('PERPLEXITY_API_KEY'),
-        base_url="https://api.perplexity.ai"
-    )
+# Coalesces identical concurrent completion requests into one provider call
+llm_flight = SingleFlight()
 
 # Cache for stock splits
-split_cache = {}
 SPLIT_CACHE_TIMEOUT = 86400  # 24 hours
+split_cache = BoundedCache('splits', max_bytes=4 * 1024 * 1024, ttl=SPLIT_CACHE_TIMEOUT,
+                           stale_ttl=7 * SPLIT_CACHE_TIMEOUT)  # Fallback while the provider is down
+
+# Coalesces concurrent market-data fetches for the same key into one provider call
+market_data_flight = SingleFlight()
 
 # Set default settings
 DEFAULT_SETTINGS = {
@@ -118,42 +140,76 @@ def get_settings():
         logger.warning("No request context available for settings, using defaults")
         return DEFAULT_SETTINGS.copy()
 
-def get_stock_splits(symbol, start_date=None):
+def get_stock_splits(symbol, start_date=None, strict=False):
     """
     Fetch stock split history for a given symbol.
     Returns a list of tuples (date, ratio) sorted by date.
+    If the lookup fails with no last known history to fall back to, returns
+    an empty list, or raises ProviderUnavailableError when strict is set.
     """
     cache_key = f"{symbol}:{start_date}"
     
     # Check cache
-    if cache_key in split_cache:
-        cached_data = split_cache[cache_key]
-        if time.time() - cached_data['timestamp'] < SPLIT_CACHE_TIMEOUT:
-            return cached_data['data']
+    cached_data = split_cache.get(cache_key)
+    if cached_data is not None:
+        return cached_data
     
     try:
-        stock = yf.Ticker(symbol)
+        return market_data_flight.do(('splits', cache_key), fetch_stock_splits, symbol, start_date, cache_key)
+    except ProviderUnavailableError:
+        if strict:
+            raise
+        return []
+
+def fetch_stock_splits(symbol, start_date, cache_key):
+    """Fetch stock split history from the market data provider and store it in split_cache"""
+    try:
+        splits = get_market_data_provider().splits(symbol)
         
         # Get stock split data
         if start_date:
-            splits = stock.splits[start_date:]
-        else:
-            splits = stock.splits
+            splits = splits[start_date:]
         
         # Convert to list of tuples (date, ratio)
         split_data = [(date.strftime('%Y-%m-%d'), ratio) for date, ratio in splits.items()]
         split_data.sort(key=lambda x: x[0])  # Sort by date
         
         # Cache the result
-        split_cache[cache_key] = {
-            'data': split_data,
-            'timestamp': time.time()
-        }
+        split_cache.set(cache_key, split_data)
         
         return split_data
     except Exception as e:
-        print(f"Error fetching stock splits for {symbol}: {e}")
-        return []
+        logger.warning(f"Error fetching stock splits for {symbol}: {e}")
+        # Fall back to the last known split history, if any
+        stale = split_cache.get_stale(cache_key)
+        if stale is None:
+            raise ProviderUnavailableError(f"Stock splits for {symbol} unavailable: {e}") from e
+        return stale
+
+def get_split_index(symbol, strict=False):
+    """
+    Get the compiled SplitIndex for a symbol (sorted split dates with
+    precomputed cumulative ratios), reusing it while the split list is cached.
+    With strict set, a failed split lookup raises ProviderUnavailableError
+    instead of returning an empty index.
+    """
+    return compile_split_index(tuple(get_stock_splits(symbol, strict=strict)))
+
+def get_strict_split_index(symbol):
+    """get_split_index() that raises rather than returning an unadjusted index"""
+    return get_split_index(symbol, strict=True)
+
+def get_cost_basis(conn, symbols=None, method=DEFAULT_COST_BASIS_METHOD, prices=None, include_lots=False):
+    """
+    Get lot-based cost basis, realized/unrealized P&L and holding periods per symbol.
+    Lots are kept per accounting method and updated incrementally as fills arrive;
+    fills are split-adjusted with the same SplitIndex as adjust_for_splits.
+    Returns a dict of symbol -> summary plus '_totals' for the whole portfolio.
+    """
+    report = get_lot_book(conn, get_strict_split_index, method).report(prices, symbols, include_lots)
+    summaries = {position['symbol']: position for position in report['positions']}
+    summaries['_totals'] = report['totals']
+    return summaries
 
 def adjust_for_splits(price, quantity, transaction_date, splits):
     """
@@ -166,17 +222,8 @@ def adjust_for_splits(price, quantity, transaction_date, splits):
     if not splits:
         return price, quantity
     
-    transaction_date = datetime.strptime(transaction_date, '%Y-%m-%d').date()
-    adjustment_ratio = 1.0
-    
-    # Sort splits by date to process them in chronological order
-    splits.sort(key=lambda x: datetime.strptime(x[0], '%Y-%m-%d').date())
-    
     # Only adjust for splits that happened before the transaction
-    for split_date, split_ratio in splits:
-        split_date = datetime.strptime(split_date, '%Y-%m-%d').date()
-        if split_date < transaction_date:
-            adjustment_ratio *= split_ratio
+    adjustment_ratio = float(compile_split_index(tuple(splits)).ratio_before([transaction_date])[0])
     
     if adjustment_ratio != 1.0:
         # For transactions after splits:
@@ -189,32 +236,23 @@ def adjust_for_splits(price, quantity, transaction_date, splits):
     return price, quantity
 
 def categorize_stock(symbol, name):
-    try:
-        # Check if it's a MAG7 stock first (no API call needed)
-        if symbol in MAG7_STOCKS:
-            return 'mag7'
-        
-        # Check if stock is still trading
-        stock = yf.Ticker(symbol)
-        info = stock.info
-        
-        # Check if we can get any price data
-        try:
-            # Try multiple price fields as different stocks might use different fields
-            price_fields = ['regularMarketPrice', 'currentPrice', 'previousClose', 'open']
-            has_price = any(info.get(field) is not None for field in price_fields)
-            
-            if not has_price:
-                return 'unlisted'
-            
-            return 'other'
-        except (KeyError, AttributeError, TypeError):
-            return 'unlisted'
-            
-    except Exception as e:
-        print(f"Error categorizing stock {symbol}: {e}")
-        # If we can't determine the status, assume it's unlisted
+    """
+    Categorize a symbol as 'mag7', 'other' or 'unlisted'. Only a successful
+    lookup without a price counts as unlisted; if the provider can't be
+    reached this raises, so refresh_symbol_metadata records an error and retries.
+    """
+    # Check if it's a MAG7 stock first (no API call needed)
+    if symbol in MAG7_STOCKS:
+        return 'mag7'
+    
+    # Check if stock is still trading using the shared metadata cache
+    info = get_ticker_info(symbol)
+    if info['status'] != 'ok':
+        raise ProviderUnavailableError(f"Ticker info for {symbol} unavailable: {info['error']}")
+    if not info['has_price']:
         return 'unlisted'
+    
+    return 'other'
 
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'dev_secret_key_change_in_production')
@@ -268,11 +306,37 @@ def markdown_filter(text):
         return text.replace('\n', '<br>')
 
 # Add more aggressive caching
-chart_cache = {}
-price_cache = {}
-stock_category_cache = {}
 CACHE_TIMEOUT = 300  # 5 minutes
 
+# Stale-while-revalidate for price_cache: expired quotes are served (marked
+# stale) for up to STALE_MAX_AGE while a background worker refreshes them
+STALE_MAX_AGE = 3600  # 1 hour past expiry
+
+# Bounded LRU caches; entries are dropped once stale quotes can no longer be served
+chart_cache = BoundedCache('charts', max_bytes=32 * 1024 * 1024, ttl=CACHE_TIMEOUT)
+price_cache = BoundedCache('prices', max_bytes=8 * 1024 * 1024, ttl=CACHE_TIMEOUT + STALE_MAX_AGE)
+# Counts and stats per transactions filter, keyed by data version so uploads invalidate them
+summary_cache = BoundedCache('transaction_summaries', max_bytes=1024 * 1024, max_entries=1024)
+# Daily NAV/TWR series per (data version, start, end)
+nav_cache = BoundedCache('nav', max_bytes=16 * 1024 * 1024, ttl=CACHE_TIMEOUT)
+REFRESH_AHEAD_FRACTION = 0.8  # Refresh hot quotes once 80% of CACHE_TIMEOUT has passed
+HOT_KEY_HITS = 3  # Hits on one cached quote before it counts as hot
+quote_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='quote-refresh')
+quote_refresh_lock = threading.Lock()
+quote_refresh_pending = set()
+
+# Background refresh of the symbol_metadata table
+METADATA_REFRESH_INTERVAL = 3600  # Check for stale categories at most hourly
+metadata_refresh_lock = threading.Lock()
+metadata_refresh_due_at = 0
+
+# Report of the most recent CSV upload (see /api/admin/ingest)
+last_ingest_report = None
+
+# Schema migrations run once per process (see ensure_schema)
+schema_lock = threading.Lock()
+schema_ready = False
+
 # Load the CSV data
 def load_data():
     transactions = []
@@ -304,123 +368,346 @@ def get_unique_stocks(transactions):
     return stock_list
 
 def get_db_connection():
-    conn = sqlite3.connect('stock_transactions.db')
-    conn.row_factory = sqlite3.Row
-    
-    # Add custom converter functions to handle TEXT to numeric conversions
-    def convert_to_float(value):
-        if value is None or value == "null" or value == "":
-            return None
+    """Get a pooled, tuned connection (WAL, cached statements); close() returns it to the pool"""
+    conn = db_connect()
+    ensure_schema(conn)
+    return conn
+
+def ensure_schema(conn):
+    """Run pending schema migrations once per process, on the first connection"""
+    global schema_ready
+    if schema_ready:
+        return
+    with schema_lock:
+        if not schema_ready:
+            migrate(conn)
+            schema_ready = True
+
+def get_categorized_stocks(conn):
+    """
+    Get portfolio symbols grouped into mag7/other/unlisted from the
+    symbol_metadata table, scheduling a background refresh if one is due.
+    """
+    categorized_stocks = get_categorized_symbols(
+        conn,
+        default_category=lambda symbol: 'mag7' if symbol in MAG7_STOCKS else 'other'
+    )
+    schedule_metadata_refresh()
+    return categorized_stocks
+
+def refresh_stale_symbol_metadata():
+    """Background job to re-categorize symbols whose metadata is missing or stale"""
+    if not metadata_refresh_lock.acquire(blocking=False):
+        return  # A refresh is already running
+    try:
+        conn = get_db_connection()
         try:
-            return float(value)
-        except (ValueError, TypeError):
-            return None
+            stale_symbols = get_stale_symbols(conn)
+            if stale_symbols:
+                refresh_symbol_metadata(conn, stale_symbols, categorize_stock)
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"Error refreshing symbol metadata: {e}")
+    finally:
+        metadata_refresh_lock.release()
+
+def schedule_metadata_refresh():
+    """Start a background symbol metadata refresh if the refresh interval has passed"""
+    global metadata_refresh_due_at
+    now = time.time()
+    if now < metadata_refresh_due_at:
+        return
+    metadata_refresh_due_at = now + METADATA_REFRESH_INTERVAL
     
-    # Register adapter and converter for REAL type
-    sqlite3.register_adapter(float, lambda val: str(val))
-    sqlite3.register_converter("REAL", convert_to_float)
+    thread = threading.Thread(target=refresh_stale_symbol_metadata)
+    thread.daemon = True
+    thread.start()
+
+def get_stock_price(symbol, start_date=None, end_date=None):
+    # Generate cache key
+    cache_key = f"{symbol}:{start_date}:{end_date}"
     
-    return conn
+    def refresh():
+        return market_data_flight.do(('price', cache_key), fetch_stock_price, symbol, start_date, end_date, cache_key)
+    
+    # Check cache (expired quotes are served stale and refreshed in the background)
+    cached, needs_refresh = lookup_price_cache(cache_key)
+    if needs_refresh:
+        schedule_quote_refresh(cache_key, refresh)
+    if cached is not None:
+        return cached
+    
+    return refresh()
 
-def get_categorized_stocks(cursor):
-    # Check if we have cached results
-    if 'categorized_stocks' in stock_category_cache:
-        return stock_category_cache['categorized_stocks']
+def lookup_price_cache(cache_key):
+    """
+    Look up a quote in price_cache with stale-while-revalidate semantics.
+    Returns (data, needs_refresh): fresh quotes are returned as-is, expired
+    quotes still within STALE_MAX_AGE are returned marked 'stale': True, and
+    data is None when the caller must fetch synchronously. needs_refresh is
+    set for stale quotes and for hot quotes that are about to expire.
+    """
+    cached_data = price_cache.get(cache_key)
+    if cached_data is None:
+        return None, False
     
-    cursor.execute('SELECT DISTINCT Symbol, Name FROM transactions ORDER BY Symbol')
-    all_stocks = cursor.fetchall()
+    age = time.time() - cached_data['timestamp']
+    cached_data['hits'] = cached_data.get('hits', 0) + 1
     
-    categorized_stocks = {
-        'mag7': [],
-        'other': [],
-        'unlisted': []
-    }
+    if age < CACHE_TIMEOUT:
+        # Refresh-ahead keeps frequently viewed quotes from ever expiring
+        hot = cached_data['hits'] >= HOT_KEY_HITS
+        return cached_data['data'], hot and age >= CACHE_TIMEOUT * REFRESH_AHEAD_FRACTION
     
-    for stock in all_stocks:
-        category = categorize_stock(stock['Symbol'], stock['Name'])
-        categorized_stocks[category].append({
-            'symbol': stock['Symbol'],
-            'name': stock['Name']
-        })
+    if age < CACHE_TIMEOUT + STALE_MAX_AGE:
+        return dict(cached_data['data'], stale=True), True
     
-    # Cache the results
-    stock_category_cache['categorized_stocks'] = categorized_stocks
-    return categorized_stocks
+    return None, False
 
-def get_stock_price(symbol, start_date=None, end_date=None):
-    # Generate cache key
-    cache_key = f"{symbol}:{start_date}:{end_date}"
+def schedule_quote_refresh(refresh_key, refresh):
+    """Run `refresh` on the quote refresh worker unless one for this key is already queued"""
+    with quote_refresh_lock:
+        if refresh_key in quote_refresh_pending:
+            return
+        quote_refresh_pending.add(refresh_key)
     
-    # Check cache
-    if cache_key in price_cache:
-        cached_data = price_cache[cache_key]
-        if time.time() - cached_data['timestamp'] < CACHE_TIMEOUT:
-            return cached_data['data']
+    def run():
+        try:
+            refresh()
+        except Exception as e:
+            logger.error(f"Error refreshing quote {refresh_key}: {e}")
+        finally:
+            with quote_refresh_lock:
+                quote_refresh_pending.discard(refresh_key)
     
+    quote_refresh_executor.submit(run)
+
+def store_price_result(cache_key, result, fetched_at):
+    """
+    Cache a fetched quote and return the data callers should see. A failed
+    fetch does not overwrite a good quote that can still be served stale, so
+    a provider hiccup or throttling episode returns the stale quote instead
+    of replacing a price with an error.
+    """
+    previous = price_cache.get(cache_key)
+    if (result['error'] and previous and not previous['data']['error']
+            and fetched_at - previous['timestamp'] < CACHE_TIMEOUT + STALE_MAX_AGE):
+        return dict(previous['data'], stale=True)
+    
+    price_cache.set(cache_key, {
+        'data': result,
+        'timestamp': fetched_at,
+        'hits': 0
+    })
+    return result
+
+def fetch_stock_price(symbol, start_date, end_date, cache_key):
+    """Fetch price data from the provider (or price store) and store it in price_cache"""
     try:
-        stock = yf.Ticker(symbol)
-        if start_date and end_date:
-            # Get historical data for specific date range
-            hist = stock.history(start=start_date, end=end_date)
-        elif start_date:
-            # Get historical data from start date to now
-            hist = stock.history(start=start_date)
+        if start_date:
+            # Historical windows are served from the local daily-bar store
+            hist = get_price_history(symbol, start_date, end_date or datetime.today() + timedelta(days=1))
         else:
             # Get current price data
-            hist = stock.history(period="1d")
+            hist = get_market_data_provider().history(symbol, period="1d")
         
         if not hist.empty:
-            current_price = hist['Close'].iloc[-1]
-            previous_close = hist['Close'].iloc[0]
-            change = current_price - previous_close
-            change_percent = (change / previous_close * 100)
-            result = {
-                'current_price': current_price,
-                'change': change,
-                'change_percent': change_percent,
-                'previous_close': previous_close,
-                'error': None
-            }
+            result = build_price_result(hist['Close'])
         else:
-            result = {
-                'current_price': None,
-                'change': None,
-                'change_percent': None,
-                'previous_close': None,
-                'error': 'No price data available'
-            }
+            result = empty_price_result('No price data available')
     except Exception as e:
-        print(f"Error fetching stock price: {e}")
-        result = {
-            'current_price': None,
-            'change': None,
-            'change_percent': None,
-            'previous_close': None,
-            'error': str(e)
-        }
+        logger.warning(f"Error fetching stock price for {symbol}: {e}")
+        result = empty_price_result(str(e))
     
-    # Cache the result
-    price_cache[cache_key] = {
-        'data': result,
-        'timestamp': time.time()
+    # Cache the result (a failed fetch falls back to the stale quote, if any)
+    return store_price_result(cache_key, result, time.time())
+
+def empty_price_result(error):
+    """Price data result used when no price could be determined"""
+    return {
+        'current_price': None,
+        'change': None,
+        'change_percent': None,
+        'previous_close': None,
+        'error': error
+    }
+
+def build_price_result(closes):
+    """Build the price data dict from a series of closing prices"""
+    closes = closes.dropna()
+    if closes.empty:
+        return empty_price_result('No price data available')
+    
+    current_price = closes.iloc[-1]
+    previous_close = closes.iloc[0]
+    change = current_price - previous_close
+    change_percent = (change / previous_close * 100)
+    return {
+        'current_price': current_price,
+        'change': change,
+        'change_percent': change_percent,
+        'previous_close': previous_close,
+        'error': None
     }
+
+def get_stock_prices(symbols):
+    """
+    Get current price data for several symbols at once.
+    Symbols already in price_cache are served from it (stale ones marked and
+    refreshed together in the background); the rest are fetched in a single
+    batched provider download and cached per symbol.
+    Returns a dict mapping each symbol to the same shape as get_stock_price().
+    """
+    results = {}
+    missing = []
+    refresh_symbols = []
+    
+    for symbol in dict.fromkeys(symbols):
+        cached, needs_refresh = lookup_price_cache(f"{symbol}:None:None")
+        if needs_refresh:
+            refresh_symbols.append(symbol)
+        if cached is not None:
+            results[symbol] = cached
+        else:
+            missing.append(symbol)
+    
+    if refresh_symbols:
+        refresh_key = ('prices', tuple(sorted(refresh_symbols)))
+        schedule_quote_refresh(refresh_key, lambda: market_data_flight.do(refresh_key, fetch_stock_prices, refresh_symbols))
     
+    if not missing:
+        return results
+    
+    # Pages showing the same holdings share one batched download
+    results.update(market_data_flight.do(('prices', tuple(sorted(missing))), fetch_stock_prices, missing))
+    return results
+
+def fetch_stock_prices(symbols):
+    """Fetch current prices for several symbols in one provider download and cache each one"""
+    results = {}
+    try:
+        frames = get_market_data_provider().download(symbols, period="1d")
+    except Exception as e:
+        logger.error(f"Error fetching batched stock prices for {len(symbols)} symbols: {e}")
+        frames = {}
+    
+    fetched_at = time.time()
+    for symbol in symbols:
+        try:
+            hist = frames.get(symbol)
+            if hist is None or hist.empty:
+                result = empty_price_result('No price data available')
+            else:
+                result = build_price_result(hist['Close'])
+        except Exception as e:
+            logger.warning(f"Error reading batched price for {symbol}: {e}")
+            result = empty_price_result(str(e))
+        
+        results[symbol] = store_price_result(f"{symbol}:None:None", result, fetched_at)
+    
+    return results
+
+def fetch_price_history(symbol, start_date, end_date):
+    """Fetch split-adjusted daily bars for [start_date, end_date) from the market data provider"""
+    return get_market_data_provider().history(symbol, start=start_date, end=end_date)
+
+def get_price_history(symbol, start_date, end_date, last_split=None):
+    """
+    Get daily bars for [start_date, end_date), reading from the persistent
+    price store and only fetching missing ranges from the provider.
+    """
+    conn = get_db_connection()
+    try:
+        return get_daily_bars(conn, symbol, start_date, end_date,
+                              fetch_price_history, last_split=last_split)
+    finally:
+        conn.close()
+
+def fill_price_store(windows):
+    """
+    Make sure the price store holds closes for every symbol's [start, end)
+    window, fetching only the symbols whose stored bars don't cover it.
+    """
+    symbols = list(windows)
+    with ThreadPoolExecutor(max_workers=endpoint_concurrency('splits'), thread_name_prefix='nav-splits') as executor:
+        all_splits = dict(zip(symbols, executor.map(get_stock_splits, symbols)))
+    last_splits = {symbol: splits[-1][0] for symbol, splits in all_splits.items() if splits}
+    
+    conn = get_db_connection()
+    try:
+        missing = uncovered_symbols(conn, windows, last_splits)
+    finally:
+        conn.close()
+    if not missing:
+        return
+    
+    logger.info(f"Fetching price history for {len(missing)} symbols for the NAV series")
+    with ThreadPoolExecutor(max_workers=4, thread_name_prefix='nav-prices') as executor:
+        futures = [executor.submit(get_price_history, symbol, windows[symbol][0], windows[symbol][1],
+                                   last_split=last_splits.get(symbol))
+                   for symbol in missing]
+        for symbol, future in zip(missing, futures):
+            try:
+                future.result()
+            except Exception as e:
+                # Valued at its fill prices instead
+                logger.warning(f"Error fetching price history for {symbol}: {e}")
+
+def get_portfolio_nav(conn, start=None, end=None):
+    """
+    Get the portfolio's daily NAV and time-weighted return series, computed
+    over all symbols at once from the local price store. Results are cached
+    per data version, so uploads invalidate them. Symbols whose splits can't
+    be fetched are left out and listed as degraded, and such a result is not
+    cached so the next request retries them.
+    """
+    end = end or datetime.now().date()
+    cache_key = (get_data_version(conn), start, end)
+    cached = nav_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    def build():
+        return build_nav(conn, load_transactions_snapshot(conn), get_strict_split_index, start, end,
+                         ensure_prices=fill_price_store)
+    
+    result = market_data_flight.do(('nav',) + cache_key, build)
+    if not result['degraded']:
+        nav_cache.set(cache_key, result)
     return result
 
 def get_stock_chart(symbol, start_date, end_date):
     """
     Get stock chart data and adjust prices to show historical prices.
+    Concurrent requests for the same symbol and date range share one build.
+    """
+    cache_key = (symbol, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+    cached_data = chart_cache.get(cache_key)
+    if cached_data is not None:
+        return cached_data
+    
+    chart_data = market_data_flight.do(('chart',) + cache_key, build_stock_chart, symbol, start_date, end_date)
+    if not chart_data.get('error'):
+        chart_cache.set(cache_key, chart_data)
+    return chart_data
+
+def build_stock_chart(symbol, start_date, end_date):
+    """
+    Build stock chart data and adjust prices to show historical prices.
     yfinance returns split-adjusted prices, so we need to unadjust older prices
     to show the actual historical prices that were seen at the time.
     """
     try:
-        stock = yf.Ticker(symbol)
+        # Get splits first so the price store can detect a new split
+        all_splits = get_stock_splits(symbol)
         
-        # Get historical data
-        hist = stock.history(
-            start=start_date,
-            end=end_date,
-            auto_adjust=True  # This gives us split-adjusted prices
+        # Get historical data (split-adjusted) from the local store
+        hist = get_price_history(
+            symbol,
+            start_date,
+            end_date,
+            last_split=all_splits[-1][0] if all_splits else None
         )
         
         if hist.empty:
@@ -436,29 +723,20 @@ def get_stock_chart(symbol, start_date, end_date):
         prices = hist['Close'].tolist()
         
         # Get splits that occurred in our date range
-        splits = get_stock_splits(symbol, start_date.strftime('%Y-%m-%d'))
+        start_str = start_date.strftime('%Y-%m-%d')
+        splits = [(d, r) for d, r in all_splits if d >= start_str]
         print(f"Found splits for {symbol}: {splits}")
         
         if splits:
             # Calculate cumulative split ratio for each date
             # For dates before a split, we need to multiply the price by the split ratio
             # to show the actual historical price
-            cumulative_ratios = []
-            
-            for date in dates:
-                date_dt = datetime.strptime(date, '%Y-%m-%d').date()
-                # Start with ratio 1
-                current_ratio = 1.0
-                # For each split that happened after this date,
-                # multiply by the split ratio to get the historical price
-                for split_date, ratio in splits:
-                    split_dt = datetime.strptime(split_date, '%Y-%m-%d').date()
-                    if date_dt < split_dt:
-                        current_ratio *= ratio
-                cumulative_ratios.append(current_ratio)
+            split_index = compile_split_index(tuple(splits))
+            date_arr = np.array(dates, dtype='datetime64[D]')
+            cumulative_ratios = split_index.ratio_after(date_arr)
             
             # Multiply prices by their cumulative ratios to get historical prices
-            prices = [price * ratio for price, ratio in zip(prices, cumulative_ratios)]
+            prices = (np.asarray(prices, dtype=float) * cumulative_ratios).tolist()
             
             # Debug output
             print("Sample of price adjustments:")
@@ -480,16 +758,23 @@ def get_stock_chart(symbol, start_date, end_date):
         print(f"Price range: ${min(prices):.2f} to ${max(prices):.2f}")
         print(f"Number of points: {len(dates)}")
         
+        # Price on the split date itself, if it was a trading day
+        split_events = []
+        if splits:
+            split_positions = np.searchsorted(date_arr, split_index.dates)
+            for (split_date, ratio), pos in zip(splits, split_positions):
+                on_trading_day = pos < len(dates) and dates[pos] == split_date
+                split_events.append({
+                    'date': split_date,
+                    'ratio': ratio,
+                    'price': prices[pos] if on_trading_day else None
+                })
+        
         return {
             'dates': dates,
             'prices': prices,
             'error': None,
-            'split_events': [{
-                'date': split_date,
-                'ratio': ratio,
-                'price': next((p for d, p in zip(dates, prices) 
-                             if d == split_date), None)
-            } for split_date, ratio in splits]
+            'split_events': split_events
         }
     except Exception as e:
         print(f"Error fetching stock chart for {symbol}: {e}")
@@ -501,6 +786,22 @@ def get_stock_chart(symbol, start_date, end_date):
             'error': str(e)
         }
 
+def find_closest_date_indices(dates, targets):
+    """
+    For each target date, find the index of the closest entry in the sorted
+    `dates` list (YYYY-MM-DD strings) with a binary search. Ties go to the
+    earlier date.
+    """
+    date_arr = np.array(dates, dtype='datetime64[D]')
+    target_arr = np.array(targets, dtype='datetime64[D]')
+    if len(date_arr) == 1:
+        return np.zeros(len(target_arr), dtype=int)
+    
+    right = np.clip(np.searchsorted(date_arr, target_arr), 1, len(date_arr) - 1)
+    left = right - 1
+    choose_right = (date_arr[right] - target_arr) < (target_arr - date_arr[left])
+    return np.where(choose_right, right, left)
+
 def process_transactions(transactions):
     """Process transactions without any split adjustments"""
     processed = []
@@ -564,46 +865,53 @@ def process_transactions(transactions):
     
     return processed
 
-def calculate_transaction_stats(transactions):
-    stats = {
-        'total_stocks_bought': 0,
-        'total_stocks_sold': 0,
-        'total_amount_bought': 0,
-        'total_amount_sold': 0
-    }
+def get_transaction_summary(conn, filters, params, symbol=None):
+    """Get the count, date span and stats for a transactions filter, cached until the data changes.
     
-    for tx in transactions:
-        try:
-            # Safely convert text values to float
-            try:
-                qty = float(tx['Qty']) if tx['Qty'] and str(tx['Qty']).lower() != 'null' else 0
-            except (ValueError, TypeError):
-                qty = 0
-                
-            try:
-                price = float(tx['AveragePrice']) if tx['AveragePrice'] and str(tx['AveragePrice']).lower() != 'null' else 0
-            except (ValueError, TypeError):
-                price = 0
-                
-            amount = price * qty
-            
-            if tx['Side'].lower() == 'buy':
-                stats['total_stocks_bought'] += qty
-                stats['total_amount_bought'] += amount
-            elif tx['Side'].lower() == 'sell':
-                stats['total_stocks_sold'] += qty
-                stats['total_amount_sold'] += amount
-        except (ValueError, TypeError) as e:
-            print(f"Error processing transaction stats: {tx}, Error: {e}")
-            continue
+    Pass the symbol when the filter selects a single symbol, so the cached summary
+    survives uploads that only touch other symbols.
+    """
+    version = get_data_version(conn) if symbol is None else get_symbol_version(conn, symbol)
+    cache_key = (tuple(filters), tuple(params), symbol, version)
+    summary = summary_cache.get(cache_key)
+    if summary is None:
+        summary = transaction_summary(conn, filters, params)
+        summary_cache.set(cache_key, summary)
+    return summary
+
+def get_transaction_page(conn, filters, params, per_page, total_transactions):
+    """Fetch the page of transactions requested by the after/before/page query arguments.
     
-    # Round the values for display
-    stats['total_stocks_bought'] = round(stats['total_stocks_bought'], 2)
-    stats['total_stocks_sold'] = round(stats['total_stocks_sold'], 2)
-    stats['total_amount_bought'] = round(stats['total_amount_bought'], 2)
-    stats['total_amount_sold'] = round(stats['total_amount_sold'], 2)
+    Pages are addressed by keyset cursors rather than offsets; the page number
+    in the URL is only used for display and for jumping to the last page.
+    """
+    total_pages = (total_transactions + per_page - 1) // per_page
+    page = request.args.get('page', 1, type=int)
+    after = decode_cursor(request.args.get('after'))
+    before = decode_cursor(request.args.get('before'))
     
-    return stats
+    if total_pages == 0:
+        page = 1
+        transactions = []
+    elif after is not None or before is not None:
+        page = min(max(page, 1), total_pages)
+        transactions = fetch_transaction_page(conn, filters, params, per_page, after=after, before=before)
+    elif page >= total_pages and total_pages > 1:
+        # Last page: seek from the oldest end instead of skipping every newer row
+        page = total_pages
+        last_page_size = total_transactions - (total_pages - 1) * per_page
+        transactions = fetch_transaction_page(conn, filters, params, per_page, last_page_size=last_page_size)
+    else:
+        page = 1
+        transactions = fetch_transaction_page(conn, filters, params, per_page)
+    
+    return {
+        'transactions': transactions,
+        'page': page,
+        'total_pages': total_pages,
+        'prev_cursor': encode_cursor(transactions[0]) if transactions and page > 1 else None,
+        'next_cursor': encode_cursor(transactions[-1]) if transactions and page < total_pages else None
+    }
 
 @app.route('/api/stock_chart/<symbol>')
 def api_stock_chart(symbol):
@@ -694,28 +1002,24 @@ def api_stock_chart(symbol):
             print(f"Error processing transaction: {tx}, Error: {e}")
             continue
     
-    # Get chart data for the specified date range
-    chart_data = get_stock_chart(symbol, start_date, end_date)
+    # Get chart data for the specified date range (copied, as the cached dict is shared)
+    chart_data = dict(get_stock_chart(symbol, start_date, end_date))
     
-    # Get split data
-    splits = get_stock_splits(symbol, start_date.strftime('%Y-%m-%d'))
+    # Place split annotations within the requested range at the closest charted price
+    start_str = start_date.strftime('%Y-%m-%d')
+    end_str = end_date.strftime('%Y-%m-%d')
+    splits = [(event['date'], event['ratio']) for event in chart_data.get('split_events', [])
+              if start_str <= event['date'] <= end_str]
     split_events = []
     
-    # Process splits for chart annotations
-    for split_date, split_ratio in splits:
-        split_date_obj = datetime.strptime(split_date, '%Y-%m-%d')
-        if start_date <= split_date_obj <= end_date:
-            # Find the closest price to the split date
-            closest_date_index = min(range(len(chart_data['dates'])), 
-                                   key=lambda i: abs(datetime.strptime(chart_data['dates'][i], '%Y-%m-%d') - split_date_obj))
-            
-            if closest_date_index < len(chart_data['prices']):
-                price = chart_data['prices'][closest_date_index]
-                split_events.append({
-                    'date': split_date,
-                    'ratio': split_ratio,
-                    'price': price
-                })
+    if splits and chart_data['dates']:
+        closest_indices = find_closest_date_indices(chart_data['dates'], [split_date for split_date, _ in splits])
+        for (split_date, split_ratio), closest_date_index in zip(splits, closest_indices):
+            split_events.append({
+                'date': split_date,
+                'ratio': split_ratio,
+                'price': chart_data['prices'][closest_date_index]
+            })
     
     # Add split events to chart data
     chart_data['split_events'] = split_events
@@ -724,70 +1028,37 @@ def api_stock_chart(symbol):
     chart_data['buy_transactions'] = buy_transactions
     chart_data['sell_transactions'] = sell_transactions
     
-    # Cache the data
-    cache_key = f"{symbol}:{range_}"
-    now = time.time()
-    chart_cache[cache_key] = {'data': {
-        'dates': chart_data['dates'],
-        'prices': chart_data['prices'],
-        'error': chart_data['error']
-    }, 'timestamp': now}
-    
     return jsonify(chart_data)
 
 @app.route('/')
 def index():
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     active_tab = request.args.get('tab', 'mag7')
     
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM transactions')
-    total_transactions = cursor.fetchone()[0]
-    total_pages = (total_transactions + per_page - 1) // per_page
-    offset = (page - 1) * per_page
-    cursor.execute('''
-        SELECT * FROM transactions 
-        ORDER BY Date DESC, Time DESC 
-        LIMIT ? OFFSET ?
-    ''', (per_page, offset))
-    transactions = cursor.fetchall()
-    cursor.execute('''
-        SELECT DISTINCT Symbol, Name 
-        FROM transactions 
-        ORDER BY Symbol
-    ''')
-    stocks = cursor.fetchall()
-    conn.close()
-    
-    # Categorize stocks
-    categorized_stocks = {
-        'mag7': [],
-        'other': [],
-        'unlisted': []
-    }
+    summary = get_transaction_summary(conn, [], [])
+    total_transactions = summary['total']
+    page_info = get_transaction_page(conn, [], [], per_page, total_transactions)
     
-    for stock in stocks:
-        category = categorize_stock(stock['Symbol'], stock['Name'])
-        categorized_stocks[category].append({
-            'symbol': stock['Symbol'],
-            'name': stock['Name']
-        })
+    # Categorized stocks come from the precomputed symbol_metadata table
+    categorized_stocks = get_categorized_stocks(conn)
+    conn.close()
     
-    processed_transactions = process_transactions(transactions)
+    processed_transactions = process_transactions(page_info['transactions'])
     return render_template('index.html', 
                          transactions=processed_transactions,
                          stocks=categorized_stocks,
-                         page=page,
-                         total_pages=total_pages,
+                         page=page_info['page'],
+                         total_pages=page_info['total_pages'],
+                         prev_cursor=page_info['prev_cursor'],
+                         next_cursor=page_info['next_cursor'],
+                         total_transactions=total_transactions,
                          per_page=per_page,
                          current_filter=None,
                          active_tab=active_tab)
 
 @app.route('/stock/<symbol>')
 def stock_detail(symbol):
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     side = request.args.get('side', 'all')
     range_ = request.args.get('range', 'ytd')
@@ -797,32 +1068,26 @@ def stock_detail(symbol):
     start_date = None
     
     conn = get_db_connection()
-    cursor = conn.cursor()
     
-    # Get the stock name and transactions in a single query
-    cursor.execute('''
-        SELECT t.*, 
-               (SELECT DISTINCT Name FROM transactions WHERE Symbol = ? LIMIT 1) as stock_name
-        FROM transactions t
-        WHERE t.Symbol = ?
-    ''', (symbol, symbol))
-    result = cursor.fetchone()
+    # Name and first trade come from the positions table
+    position = get_position(conn, symbol)
     
     # Handle case where no transactions are found for this symbol
-    if result is None:
+    if position is None:
+        conn.close()
         flash(f"No transactions found for symbol {symbol}", "warning")
         return redirect(url_for('index'))
         
     # Get stock name with a fallback if not found
-    stock_name = result['stock_name'] if result and result['stock_name'] else symbol
+    stock_name = position['Name'] or symbol
     
-    # Build the base query for transactions
-    base_query = 'SELECT * FROM transactions WHERE Symbol = ?'
+    # Build the filters for transactions
+    filters = ['Symbol = ?']
     params = [symbol]
     
     # Handle side filter
     if side in ['buy', 'sell']:
-        base_query += ' AND LOWER(Side) = ?'
+        filters.append('LOWER(Side) = ?')
         params.append(side)
     
     # Handle date range
@@ -830,12 +1095,8 @@ def stock_detail(symbol):
         # For 'all' filter, we want all transactions without date filtering
         pass
     elif range_ == 'max':
-        # For 'max' filter, we want the entire stock history
-        # Get the earliest transaction date
-        cursor.execute('SELECT MIN(Date) FROM transactions WHERE Symbol = ?', (symbol,))
-        earliest_date = cursor.fetchone()[0]
-        if earliest_date:
-            start_date = datetime.strptime(earliest_date, '%Y-%m-%d')
+        # For 'max' filter, we want the entire stock history from the earliest transaction
+        start_date = datetime.strptime(position['FirstTrade'][:10], '%Y-%m-%d')
     elif range_ == 'ytd':
         start_date = datetime(today.year, 1, 1)
     elif range_ == '1y':
@@ -847,43 +1108,19 @@ def stock_detail(symbol):
     elif range_ == '1mo':
         start_date = today - timedelta(days=30)
     
-    # Add date filter if needed
+    # Add date filter if needed (Timestamp starts with the date, so this matches Date >= start)
     if start_date and range_ != 'all':
-        base_query += ' AND Date >= ?'
+        filters.append('Timestamp >= ?')
         params.append(start_date.strftime('%Y-%m-%d'))
     
-    # Get total count for pagination
-    count_query = f'SELECT COUNT(*) FROM ({base_query})'
-    cursor.execute(count_query, params)
-    total_transactions = cursor.fetchone()[0]
-    total_pages = (total_transactions + per_page - 1) // per_page
+    # Count and stats in one aggregate, cached until the transactions change
+    summary = get_transaction_summary(conn, filters, params, symbol=symbol)
+    transaction_stats = summary['stats']
+    page_info = get_transaction_page(conn, filters, params, per_page, summary['total'])
+    transactions = page_info['transactions']
     
-    # Ensure page is within valid range
-    if page < 1:
-        page = 1
-    elif page > total_pages and total_pages > 0:
-        page = total_pages
-    
-    # Calculate offset for pagination
-    offset = (page - 1) * per_page
-    
-    # First get all transactions for stats (without pagination)
-    cursor.execute(base_query, params)
-    all_transactions = cursor.fetchall()
-    
-    # Calculate stats from all transactions
-    transaction_stats = calculate_transaction_stats(all_transactions)
-    
-    # Add pagination to the query for display
-    final_query = f'{base_query} ORDER BY Date DESC, Time DESC LIMIT ? OFFSET ?'
-    params += [per_page, offset]
-    
-    # Execute the final query
-    cursor.execute(final_query, params)
-    transactions = cursor.fetchall()
-    
-    # Get categorized stocks from cache
-    categorized_stocks = get_categorized_stocks(cursor)
+    # Get categorized stocks from the symbol_metadata table
+    categorized_stocks = get_categorized_stocks(conn)
     
     conn.close()
     
@@ -891,12 +1128,10 @@ def stock_detail(symbol):
     
     # Get price data with appropriate date range
     if range_ == 'all':
-        # For 'all' filter, we want to show price data for transaction dates only
-        # Get unique transaction dates
-        transaction_dates = sorted(set(t['Date'] for t in all_transactions))
-        if transaction_dates:
-            start_date = datetime.strptime(transaction_dates[0], '%Y-%m-%d')
-            end_date = datetime.strptime(transaction_dates[-1], '%Y-%m-%d')
+        # For 'all' filter, we want to show price data for the span of transaction dates only
+        if summary['first_date']:
+            start_date = datetime.strptime(summary['first_date'], '%Y-%m-%d')
+            end_date = datetime.strptime(summary['last_date'], '%Y-%m-%d')
             price_data = get_stock_price(symbol, start_date=start_date, end_date=end_date)
         else:
             price_data = get_stock_price(symbol)
@@ -908,8 +1143,11 @@ def stock_detail(symbol):
                          stocks=categorized_stocks,
                          current_filter=symbol,
                          stock_name=stock_name,
-                         page=page,
-                         total_pages=total_pages,
+                         page=page_info['page'],
+                         total_pages=page_info['total_pages'],
+                         prev_cursor=page_info['prev_cursor'],
+                         next_cursor=page_info['next_cursor'],
+                         total_transactions=summary['total'],
                          per_page=per_page,
                          price_data=price_data,
                          selected_side=side,
@@ -932,26 +1170,49 @@ def upload_file():
         flash('Please upload a CSV file', 'error')
         return redirect(url_for('index'))
     
-    # Save the file
-    file.save('stock_orders.csv')
+    mode = request.form.get('mode', REPLACE)
+    if mode not in INGEST_MODES:
+        flash('Unknown upload mode', 'error')
+        return redirect(url_for('index'))
+    
+    # A full export replaces stock_orders.csv; a delta is merged from its own file
+    # so stock_orders.csv keeps the last full export
+    source = 'stock_orders.csv' if mode == REPLACE else f'stock_orders.append-{uuid.uuid4().hex}.csv'
+    file.save(source)
     
     try:
-        # Reinitialize the database with the new file
-        init_db()
+        global last_ingest_report
+        report = init_db(mode=mode, source=source)
+        last_ingest_report = report.to_dict()
+        if report.error_count or report.warning_count:
+            flash(f'{report.summary()}. See /api/admin/ingest for the rows affected.', 'warning')
         
-        # Populate earnings calendar data to ensure it's not empty
+        # Categorize any symbols we don't have fresh metadata for yet (new symbols in a delta)
+        conn = get_db_connection()
         try:
-            from populate_earnings_data import populate_sample_earnings_data
-            populate_sample_earnings_data()
-            flash('File uploaded and database processed successfully! Earnings calendar has been refreshed.', 'success')
-        except Exception as e:
-            flash(f'File uploaded, but error refreshing earnings data: {str(e)}', 'warning')
+            refresh_symbol_metadata(conn, get_stale_symbols(conn), categorize_stock)
+        finally:
+            conn.close()
+        
+        if mode == APPEND:
+            flash(f'File merged successfully! {report.summary()}.', 'success')
+        else:
+            # Populate earnings calendar data to ensure it's not empty
+            try:
+                from populate_earnings_data import populate_sample_earnings_data
+                populate_sample_earnings_data()
+                flash('File uploaded and database processed successfully! Earnings calendar has been refreshed.', 'success')
+            except Exception as e:
+                flash(f'File uploaded, but error refreshing earnings data: {str(e)}', 'warning')
             
     except Exception as e:
         flash(f'Error processing file: {str(e)}', 'error')
         # Clean up the uploaded file
-        if os.path.exists('stock_orders.csv'):
-            os.remove('stock_orders.csv')
+        if mode == REPLACE and os.path.exists(source):
+            os.remove(source)
+    finally:
+        if mode == APPEND and os.path.exists(source):
+            os.remove(source)
     
     return redirect(url_for('index'))
 
@@ -995,29 +1256,9 @@ def settings():
 def risk_review():
     """Portfolio risk review page that analyzes tariff and other risks for current holdings."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get current portfolio positions by aggregating buy/sell transactions
-    cursor.execute('''
-        SELECT 
-            Symbol, 
-            Name,
-            SUM(CASE WHEN Side = 'buy' THEN Qty ELSE -Qty END) as CurrentShares,
-            SUM(CASE WHEN Side = 'buy' THEN Qty * AveragePrice ELSE -Qty * AveragePrice END) as TotalInvestment
-        FROM 
-            transactions
-        GROUP BY 
-            Symbol
-        HAVING 
-            CurrentShares > 0
-        ORDER BY 
-            CurrentShares * 
-            (SELECT AveragePrice FROM transactions 
-             WHERE Symbol = transactions.Symbol 
-             ORDER BY Date DESC, Time DESC LIMIT 1) DESC
-    ''')
     
-    portfolio = cursor.fetchall()
+    # Current holdings from the materialized positions table, largest position first
+    portfolio = get_open_positions(conn)
     
     # Get the latest stock prices and calculate portfolio metrics
     current_prices = {}
@@ -1036,6 +1277,17 @@ def risk_review():
         'total_stocks': len(portfolio)
     }
     
+    # Fetch quotes for all holdings in one batched call and warm the sector metadata cache
+    price_map = get_stock_prices([stock['Symbol'] for stock in portfolio])
+    prefetch_ticker_info([stock['Symbol'] for stock in portfolio])
+    
+    # Cost basis of the shares still held, from the lots left after sells; share
+    # counts are split-adjusted so they can be valued at today's quotes
+    cost_basis = get_cost_basis(conn, [stock['Symbol'] for stock in portfolio])
+    portfolio = [dict(stock, CurrentShares=cost_basis[stock['Symbol']]['shares'],
+                      TotalInvestment=cost_basis[stock['Symbol']]['cost_basis'])
+                 if stock['Symbol'] in cost_basis else dict(stock) for stock in portfolio]
+    
     for stock in portfolio:
         symbol = stock['Symbol']
         current_shares = stock['CurrentShares']
@@ -1051,7 +1303,7 @@ def risk_review():
         
         try:
             # Get latest price
-            price_data = get_stock_price(symbol)
+            price_data = price_map.get(symbol)
             if price_data and 'current_price' in price_data and price_data['current_price'] is not None:
                 current_price = price_data['current_price']
                 current_prices[symbol] = current_price
@@ -1152,42 +1404,19 @@ def strategy_backtesting():
     
     # Get current portfolio data to show relevant stocks
     conn = get_db_connection()
-    cursor = conn.cursor()
     
-    # Get current portfolio positions by aggregating buy/sell transactions
-    cursor.execute('''
-        SELECT 
-            Symbol, 
-            Name,
-            SUM(CASE WHEN Side = 'buy' THEN Qty ELSE -Qty END) as CurrentShares,
-            SUM(CASE WHEN Side = 'buy' THEN Qty * AveragePrice ELSE -Qty * AveragePrice END) as TotalInvestment
-        FROM 
-            transactions
-        GROUP BY 
-            Symbol
-        HAVING 
-            CurrentShares > 0
-        ORDER BY 
-            CurrentShares * 
-            (SELECT AveragePrice FROM transactions 
-             WHERE Symbol = transactions.Symbol 
-             ORDER BY Date DESC, Time DESC LIMIT 1) DESC
-    ''')
-    
-    portfolio = cursor.fetchall()
+    # Current holdings from the materialized positions table, largest position first
+    portfolio = get_open_positions(conn)
     
-    # Get current prices for portfolio holdings
+    # Get current prices for portfolio holdings in one batched call
     current_prices = {}
+    price_map = get_stock_prices([stock['Symbol'] for stock in portfolio])
     for stock in portfolio:
         symbol = stock['Symbol']
-        try:
-            price_data = get_stock_price(symbol)
-            if price_data and 'current_price' in price_data and price_data['current_price'] is not None:
-                current_prices[symbol] = price_data['current_price']
-            else:
-                current_prices[symbol] = None
-        except Exception as e:
-            print(f"Error getting price for {symbol}: {e}")
+        price_data = price_map.get(symbol)
+        if price_data and 'current_price' in price_data and price_data['current_price'] is not None:
+            current_prices[symbol] = price_data['current_price']
+        else:
             current_prices[symbol] = None
     
     # Close connection
@@ -1203,28 +1432,9 @@ def strategy_backtesting():
 def analyze_tariff_risk(current_stock=None):
     """Analyze tariff risks for stocks in the portfolio to support AI assistant responses."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get current portfolio positions
-    cursor.execute('''
-        SELECT 
-            Symbol, 
-            Name,
-            SUM(CASE WHEN Side = 'buy' THEN Qty ELSE -Qty END) as CurrentShares
-        FROM 
-            transactions
-        GROUP BY 
-            Symbol
-        HAVING 
-            CurrentShares > 0
-        ORDER BY 
-            CurrentShares * 
-            (SELECT AveragePrice FROM transactions 
-             WHERE Symbol = transactions.Symbol 
-             ORDER BY Date DESC, Time DESC LIMIT 1) DESC
-    ''')
     
-    portfolio = cursor.fetchall()
+    # Current holdings from the materialized positions table, largest position first
+    portfolio = get_open_positions(conn)
     
     # Define high-risk tariff stocks
     high_risk_stocks = ['AAPL', 'NVDA', 'TSLA', 'NIO', 'BABA', 'JD', 'PDD', 'XPEV']
@@ -1283,6 +1493,202 @@ def analyze_tariff_risk(current_stock=None):
     conn.close()
     return risk_analysis
 
+def create_chat_completion(client, provider, model, messages, feature, data_version=None, **params):
+    """
+    Create a chat completion, serving repeated prompts from the persistent
+    response cache (keyed by provider, model, normalized prompt and data
+    version, with a TTL per feature). Identical concurrent requests share one call.
+    Returns a dict with content, model, usage and cached.
+    """
+    key = response_key(provider, model, messages, data_version, params)
+    cached = llm_response_cache.get(key)
+    if cached is not None:
+        return {'content': cached['content'], 'model': cached['model'], 'usage': cached['usage'], 'cached': True}
+    # A chat request falling back to another provider counts against its cap too
+    with ai_executor.provider_slot(provider):
+        return llm_flight.do(('completion', key), fetch_chat_completion,
+                             key, client, provider, model, messages, feature, params)
+
+def fetch_chat_completion(key, client, provider, model, messages, feature, params):
+    """Call the provider and store the response in llm_response_cache"""
+    token = current_cancel_token()
+    if token is not None:
+        # Give the call only the time left before the request's deadline;
+        # a retry would outlive it
+        token.check()
+        if token.remaining() is not None:
+            client = client.with_options(timeout=token.remaining(), max_retries=0)
+    response = client.chat.completions.create(model=model, messages=messages, **params)
+    content = response.choices[0].message.content if response and response.choices else None
+    usage = response.usage.model_dump() if getattr(response, 'usage', None) is not None else None
+    llm_response_cache.set(key, feature, provider, model, content, usage)
+    return {'content': content, 'model': model, 'usage': usage, 'cached': False}
+
+def stream_chat_completion(client, provider, model, messages, feature, data_version=None, **params):
+    """
+    Stream a chat completion as ('token', text) items followed by one
+    ('done', {'usage': ..., 'cached': ...}) item. Shares the response cache
+    with create_chat_completion(): a cached answer is replayed as a single
+    token and a completed stream is stored.
+    """
+    key = response_key(provider, model, messages, data_version, params)
+    cached = llm_response_cache.get(key)
+    if cached is not None:
+        yield 'token', cached['content']
+        yield 'done', {'usage': cached['usage'], 'cached': True}
+        return
+    
+    # OpenAI only reports usage on a stream when asked; Perplexity includes it in every chunk
+    extra = {'stream_options': {'include_usage': True}} if provider == 'openai' else {}
+    parts = []
+    usage = None
+    with ai_executor.provider_slot(provider):
+        stream = client.chat.completions.create(model=model, messages=messages, stream=True, **extra, **params)
+        try:
+            for chunk in stream:
+                if getattr(chunk, 'usage', None) is not None:
+                    usage = chunk.usage.model_dump()
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield 'token', parts[-1]
+        finally:
+            # Closing the stream releases its pooled connection if the client disconnects early
+            stream.close()
+    llm_response_cache.set(key, feature, provider, model, ''.join(parts), usage)
+    yield 'done', {'usage': usage, 'cached': False}
+
+def admission_provider(ai_provider):
+    """The provider a chat request will call first, for ai_executor's per-provider caps"""
+    if ai_provider == 'perplexity' and get_llm_registry().available('perplexity'):
+        return 'perplexity'
+    return 'openai'
+
+def saturated_response(request_id, error):
+    """Fast 429/503 response with Retry-After for a request ai_executor turned away"""
+    logger.warning(f"[{request_id}] Rejected AI request: {error} (retry after {error.retry_after}s)")
+    response = jsonify({
+        "response": "The assistant is handling too many requests right now. Please try again in a moment.",
+        "provider": "busy",
+        "error": str(error),
+        "retry_after": error.retry_after
+    })
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def sse_event(event, data):
+    """Format one Server-Sent Events frame with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def build_chat_context(current_stock, request_id, message='', model=None):
+    """
+    Build the system prompt for a chat turn: the portfolio summary plus, on a
+    stock page, the user's history with that stock. Returns (context, data_version).
+    The portfolio snippets come precomputed from chat_context; only the live
+    quote is looked up per turn. The context is fitted to the model's token
+    budget, keeping what is most relevant to the message and current stock.
+    """
+    conn = get_db_connection()
+    portfolio = chat_context.portfolio(conn)
+    logger.debug(f"[{request_id}] Portfolio context loaded: {portfolio['total_transactions']} transactions, "
+                 f"{len(portfolio['symbols'])} symbols")
+
+    items = [ContextItem(
+        'portfolio',
+        header=f"{portfolio['summary']} Stocks by number of trades:",
+        lines=portfolio['symbol_lines'],
+        line_symbols=portfolio['symbols'],
+        compact=portfolio['text'],
+        priority=1.0,
+        symbols=portfolio['symbols'],
+        required=True,
+        joiner=', '
+    )]
+
+    # Stock-specific context if the user is viewing a stock page
+    if current_stock:
+        logger.info(f"[{request_id}] Preparing stock-specific context for {current_stock}")
+        history = chat_context.symbol(conn, current_stock)
+
+        # Get current stock price and recent performance
+        price_data = get_stock_price(current_stock)
+        current_price = price_data.get('current_price', 'Unknown')
+        change_percent = price_data.get('change_percent', 'Unknown')
+
+        # Format the change percentage correctly
+        if isinstance(change_percent, (int, float)):
+            change_percent_display = f"{change_percent:.2f}%"
+        else:
+            change_percent_display = "Unknown"
+
+        page = f"The user is currently viewing the {current_stock} stock page."
+        quote = f"- Current price: ${current_price}\n- Today's change: {change_percent_display}"
+        items.append(ContextItem(
+            'stock',
+            header=f"""{page}
+
+Stock details:
+{quote}
+{history['text']}
+
+The user may want recommendations about:
+1. Is it the right time to buy {current_stock} based on their transaction history and current price
+2. Whether they have made impulse buys or panic sells with this stock
+3. Analysis of their trading pattern with {current_stock}""",
+            compact=(f"{page}\n{quote}\n- User's average buy price: ${history['avg_buy_price']:.2f}\n"
+                     f"- Net shares: {history['net_shares']}"),
+            priority=3.0,
+            symbols=[current_stock],
+            required=True
+        ))
+
+    conn.close()
+    # The context embeds portfolio data, so cached answers are tied to this version
+    data_version = portfolio['data_version']
+
+    instructions = """You are a helpful assistant for a stock transactions analyzer application.
+The app allows users to analyze their stock portfolio and transactions.
+
+Key application features:
+- View stock transactions with filtering options (buy/sell, date ranges)
+- Charts showing stock price history and transaction points
+- MAG7 stocks section (Apple, Microsoft, Google, Amazon, Meta, NVIDIA, Tesla)
+- Other stocks section
+- Unlisted stocks section"""
+    closing = """Keep your responses concise, focused on stocks and the application features.
+If the user asks about buy timing or trading patterns for the current stock, provide personalized insights based on their transaction history."""
+
+    prompt = assemble(items, budget_for(model), message, current_stock, reserved=instructions + closing)
+    logger.debug(f"[{request_id}] Context for {model}: ~{prompt['tokens']} of {prompt['budget']} tokens, "
+                 f"forms {prompt['forms']}, dropped {prompt['dropped']}")
+
+    context = f"{instructions}\n\n{prompt['text']}\n\n{closing}"
+    return context, data_version
+
+def select_perplexity_model(settings, source_page, request_id):
+    """Pick the Perplexity model for a chat turn from settings. Returns (model key, model ID)."""
+    # Get the selected model from settings
+    selected_model = settings.get('perplexity_model', 'sonar')
+
+    # If the request is from strategy backtesting, override to sonar-pro
+    if source_page == 'strategy_backtesting':
+        selected_model = 'sonar-pro'
+        logger.info(f"[{request_id}] Overriding Perplexity model to 'sonar-pro' for strategy backtesting.")
+
+    # Use the global PERPLEXITY_MODELS definition
+    model_id = PERPLEXITY_MODELS.get(selected_model) 
+
+    if not model_id:
+        logger.warning(f"[{request_id}] Model '{selected_model}' not found in PERPLEXITY_MODELS. Falling back to default.")
+        # Fallback to a default model key that exists in PERPLEXITY_MODELS
+        # Or handle error appropriately
+        default_model_key = next(iter(PERPLEXITY_MODELS)) # get first key as a default
+        model_id = PERPLEXITY_MODELS.get(default_model_key, 'sonar') # Default to 'sonar' if even that fails
+        selected_model = default_model_key if PERPLEXITY_MODELS.get(default_model_key) else 'sonar'
+
+    logger.info(f"[{request_id}] Using Perplexity model: {selected_model} (ID: {model_id})")
+    return selected_model, model_id
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """API endpoint to process chat messages and return responses using ChatGPT API"""
@@ -1336,183 +1742,52 @@ def chat():
             """Wrapper function for API processing with timeout"""
             with ctx_app:  # Establish app context within the thread
                 try:
-                    # Get application context to provide to AI models
-                    conn = get_db_connection()
-                    cursor = conn.cursor()
-                    cursor.execute('SELECT COUNT(*) FROM transactions')
-                    total_transactions = cursor.fetchone()[0]
-                    cursor.execute('SELECT DISTINCT Symbol FROM transactions')
-                    symbols = [row['Symbol'] for row in cursor.fetchall()]
-                    logger.debug(f"[{request_id}] Portfolio context loaded: {total_transactions} transactions, {len(symbols)} symbols")
-                    
-                    # Stock-specific context if the user is viewing a stock page
-                    stock_specific_context = ""
-                    if current_stock:
-                        logger.info(f"[{request_id}] Preparing stock-specific context for {current_stock}")
-                        # Get current stock price and recent performance
-                        price_data = get_stock_price(current_stock)
-                        
-                        # Get transactions for this specific stock
-                        cursor.execute('''
-                            SELECT * FROM transactions 
-                            WHERE Symbol = ? 
-                            ORDER BY Date DESC, Time DESC
-                        ''', (current_stock,))
-                        stock_transactions = cursor.fetchall()
-                        
-                        # Calculate stats for this stock
-                        stats = calculate_transaction_stats(stock_transactions)
-                        
-                        # Calculate average buy/sell prices
-                        total_buy_amount = 0
-                        total_buy_qty = 0
-                        total_sell_amount = 0
-                        total_sell_qty = 0
-                        
-                        for tx in stock_transactions:
-                            try:
-                                qty = float(tx['Qty'])
-                                price = float(tx['AveragePrice'])
-                                amount = price * qty
-                                
-                                if tx['Side'].lower() == 'buy':
-                                    total_buy_amount += amount
-                                    total_buy_qty += qty
-                                elif tx['Side'].lower() == 'sell':
-                                    total_sell_amount += amount
-                                    total_sell_qty += qty
-                            except (ValueError, TypeError):
-                                continue
-                        
-                        avg_buy_price = total_buy_amount / total_buy_qty if total_buy_qty > 0 else 0
-                        avg_sell_price = total_sell_amount / total_sell_qty if total_sell_qty > 0 else 0
-                        
-                        # Get the first and last transaction dates
-                        cursor.execute('''
-                            SELECT MIN(Date), MAX(Date) FROM transactions 
-                            WHERE Symbol = ?
-                        ''', (current_stock,))
-                        first_date, last_date = cursor.fetchone()
-                        
-                        # Create stock-specific context
-                        current_price = price_data.get('current_price', 'Unknown')
-                        change_percent = price_data.get('change_percent', 'Unknown')
-                        
-                        # Format the change percentage correctly
-                        if isinstance(change_percent, (int, float)):
-                            change_percent_display = f"{change_percent:.2f}%"
-                        else:
-                            change_percent_display = "Unknown"
-                        
-                        stock_specific_context = f"""
-                        The user is currently viewing the {current_stock} stock page.
-                        
-                        Stock details:
-                        - Current price: ${current_price if current_price != 'Unknown' else 'Unknown'}
-                        - Today's change: {change_percent_display}
-                        - User's average buy price: ${avg_buy_price:.2f}
-                        - User's average sell price: ${avg_sell_price:.2f}
-                        - First transaction: {first_date}
-                        - Most recent transaction: {last_date}
-                        - Total shares bought: {stats['total_stocks_bought']}
-                        - Total shares sold: {stats['total_stocks_sold']}
-                        - Net shares: {stats['total_stocks_bought'] - stats['total_stocks_sold']}
-                        
-                        The user may want recommendations about:
-                        1. Is it the right time to buy {current_stock} based on their transaction history and current price
-                        2. Whether they have made impulse buys or panic sells with this stock
-                        3. Analysis of their trading pattern with {current_stock}
-                        """
-                    
-                    conn.close()
-                    
-                    context = f"""
-                    You are a helpful assistant for a stock transactions analyzer application.
-                    The app allows users to analyze their stock portfolio and transactions.
-                    
-                    Key application features:
-                    - View stock transactions with filtering options (buy/sell, date ranges)
-                    - Charts showing stock price history and transaction points
-                    - MAG7 stocks section (Apple, Microsoft, Google, Amazon, Meta, NVIDIA, Tesla)
-                    - Other stocks section
-                    - Unlisted stocks section
-                    
-                    The user has {total_transactions} total stock transactions in their portfolio.
-                    Their portfolio includes stocks like: {', '.join(symbols[:10])}
+                    # Determine AI provider based on settings
+                    ai_provider = settings.get('ai_provider', 'perplexity')
                     
-                    {stock_specific_context}
+                    # Try Perplexity first if available and selected
+                    perplexity_client = get_llm_client('perplexity') if ai_provider == 'perplexity' else None
+                    if perplexity_client:
+                        selected_model, model_id = select_perplexity_model(settings, source_page, request_id)
                     
-                    Keep your responses concise, focused on stocks and the application features.
-                    If the user asks about buy timing or trading patterns for the current stock, provide personalized insights based on their transaction history.
-                    """
+                    # Get application context to provide to AI models, sized for the first model tried
+                    context, data_version = build_chat_context(current_stock, request_id, message,
+                                                               model_id if perplexity_client else 'gpt-3.5-turbo')
                     
                     # Log the context size for debugging
                     context_size = len(context)
                     logger.debug(f"[{request_id}] Context size: {context_size} characters")
                     
-                    # Determine AI provider based on settings
-                    ai_provider = settings.get('ai_provider', 'perplexity')
-                    
-                    # Try Perplexity first if available and selected
-                    perplexity_client = None
-                    if os.getenv('PERPLEXITY_API_KEY') and ai_provider == 'perplexity':
-                        try:
-                            import openai
-                            perplexity_client = openai.OpenAI(
-                                api_key=os.getenv('PERPLEXITY_API_KEY'),
-                                base_url="https://api.perplexity.ai",
-                            )
-                        except ImportError:
-                            logger.error(f"[{request_id}] OpenAI SDK not installed for Perplexity API")
-                        except Exception as e:
-                            logger.error(f"[{request_id}] Error initializing Perplexity client: {e}")
-                    
                     if perplexity_client:
                         logger.info(f"[{request_id}] Attempting to use Perplexity API")
                         try:
-                            # Get the selected model from settings
-                            selected_model = settings.get('perplexity_model', 'sonar')
-                            
-                            # If the request is from strategy backtesting, override to sonar-pro
-                            if source_page == 'strategy_backtesting':
-                                selected_model = 'sonar-pro'
-                                logger.info(f"[{request_id}] Overriding Perplexity model to 'sonar-pro' for strategy backtesting.")
-                            
-                            # Use the global PERPLEXITY_MODELS definition
-                            model_id = PERPLEXITY_MODELS.get(selected_model) 
-
-                            if not model_id:
-                                logger.warning(f"[{request_id}] Model '{selected_model}' not found in PERPLEXITY_MODELS. Falling back to default.")
-                                # Fallback to a default model key that exists in PERPLEXITY_MODELS
-                                # Or handle error appropriately
-                                default_model_key = next(iter(PERPLEXITY_MODELS)) # get first key as a default
-                                model_id = PERPLEXITY_MODELS.get(default_model_key, 'sonar') # Default to 'sonar' if even that fails
-                                selected_model = default_model_key if PERPLEXITY_MODELS.get(default_model_key) else 'sonar'
-
-                            logger.info(f"[{request_id}] Using Perplexity model: {selected_model} (ID: {model_id})")
-
                             perplexity_start = time.time()
                             # Call Perplexity API using the OpenAI client interface
-                            response = perplexity_client.chat.completions.create(
+                            completion = create_chat_completion(
+                                perplexity_client, 'perplexity',
                                 model=model_id,  # Use the model ID from the mapping
                                 messages=[
                                     {"role": "system", "content": context},
                                     {"role": "user", "content": message}
                                 ],
+                                feature=source_page or 'chat',
+                                data_version=data_version,
                                 max_tokens=1000
                             )
                             perplexity_time = time.time() - perplexity_start
-                            logger.info(f"[{request_id}] Perplexity API call successful in {perplexity_time:.2f}s")
+                            logger.info(f"[{request_id}] Perplexity API call successful in {perplexity_time:.2f}s"
+                                        f"{' (cached)' if completion['cached'] else ''}")
                             
                             # Extract the response text
-                            chat_response = response.choices[0].message.content.strip()
+                            chat_response = completion['content'].strip()
                             total_time = time.time() - start_time
                             logger.info(f"[{request_id}] Total request time: {total_time:.2f}s")
                             
                             response_data = {
                                 "response": chat_response, 
                                 "provider": "perplexity",
-                                "model": selected_model
+                                "model": selected_model,
+                                "cached": completion['cached']
                             }
                             return response_data
                             
@@ -1524,14 +1799,8 @@ def chat():
                     
                     # Try OpenAI if Perplexity failed or isn't available or OpenAI is selected
                     openai_client = None
-                    if os.getenv('OPENAI_API_KEY') and (ai_provider == 'openai' or not perplexity_client):
-                        try:
-                            import openai
-                            openai_client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-                        except ImportError:
-                            logger.error(f"[{request_id}] OpenAI SDK not installed")
-                        except Exception as e:
-                            logger.error(f"[{request_id}] Error initializing OpenAI client: {e}")
+                    if ai_provider == 'openai' or not perplexity_client:
+                        openai_client = get_llm_client('openai')
                     
                     if openai_client:
                         logger.info(f"[{request_id}] Attempting to use OpenAI API")
@@ -1541,44 +1810,45 @@ def chat():
                             logger.debug(f"[{request_id}] OpenAI API request: model=gpt-3.5-turbo, message_length={len(message)}")
                             
                             # Call OpenAI API
-                            response = openai_client.chat.completions.create(
+                            completion = create_chat_completion(
+                                openai_client, 'openai',
                                 model="gpt-3.5-turbo",
                                 messages=[
                                     {"role": "system", "content": context},
                                     {"role": "user", "content": message}
                                 ],
+                                feature=source_page or 'chat',
+                                data_version=data_version,
                                 max_tokens=1000,
                                 temperature=0.7,
                                 presence_penalty=0.6,
-                                frequency_penalty=0.2,
-                                stream=False
+                                frequency_penalty=0.2
                             )
                             
                             openai_time = time.time() - openai_start
-                            logger.info(f"[{request_id}] OpenAI API call successful in {openai_time:.2f}s")
+                            logger.info(f"[{request_id}] OpenAI API call successful in {openai_time:.2f}s"
+                                        f"{' (cached)' if completion['cached'] else ''}")
                             
                             # Log response details
-                            response_id = getattr(response, 'id', 'unknown')
-                            model = getattr(response, 'model', 'gpt-3.5-turbo')
-                            usage = getattr(response, 'usage', {})
-                            logger.debug(f"[{request_id}] OpenAI response ID: {response_id}, model: {model}")
-                            logger.debug(f"[{request_id}] Token usage: {usage}")
+                            logger.debug(f"[{request_id}] Token usage: {completion['usage']}")
                             
                             # Extract the response text
-                            chat_response = response.choices[0].message.content.strip()
+                            chat_response = completion['content'].strip()
                             total_time = time.time() - start_time
                             logger.info(f"[{request_id}] Total request time: {total_time:.2f}s")
                             
                             response_data = {
                                 "response": chat_response, 
                                 "provider": "openai",
-                                "model": "gpt-3.5-turbo"
+                                "model": "gpt-3.5-turbo",
+                                "cached": completion['cached']
                             }
                             return response_data
                             
                         except Exception as e:
                             logger.error(f"[{request_id}] Unexpected error calling OpenAI API: {str(e)}")
                             logger.error(f"[{request_id}] Error details: {traceback.format_exc()}")
+                            current_cancel_token().check()
                             logger.info(f"[{request_id}] Falling back to simple chat due to unexpected error")
                             chat_response = handle_simple_chat(message, current_stock)
                             if isinstance(chat_response, dict):
@@ -1590,6 +1860,7 @@ def chat():
                             }
                     
                     # If both fail, use simple chat fallback
+                    current_cancel_token().check()
                     logger.warning(f"[{request_id}] No AI provider available, using simple chat fallback")
                     chat_response = handle_simple_chat(message, current_stock)
                     if isinstance(chat_response, dict):
@@ -1598,6 +1869,9 @@ def chat():
                         "response": str(chat_response),
                         "provider": "fallback"
                     }
+                except CancelledTaskError:
+                    logger.info(f"[{request_id}] API processing cancelled after the request timed out")
+                    return {"response": "", "provider": "timeout", "error": "API processing timeout"}
                 except Exception as e:
                     logger.error(f"[{request_id}] Error in API processing: {str(e)}")
                     logger.error(f"[{request_id}] API processing error details: {traceback.format_exc()}")
@@ -1607,19 +1881,25 @@ def chat():
                         "error": str(e)
                     }
         
-        # Use a thread with timeout to prevent hanging the server
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(process_api_request_with_timeout)
-            try:
-                result = future.result(timeout=request_timeout)
-                return jsonify(result)
-            except TimeoutError:
-                logger.error(f"[{request_id}] API processing timed out after {request_timeout} seconds")
-                return jsonify({
-                    "response": "Sorry, the request took too long to process. Please try again with a simpler query.",
-                    "provider": "timeout",
-                    "error": "API processing timeout"
-                }), 500
+        # Run on the shared AI pool, turning the request away if it is saturated
+        try:
+            future = ai_executor.submit(process_api_request_with_timeout,
+                                        provider=admission_provider(settings.get('ai_provider', 'perplexity')),
+                                        timeout=request_timeout)
+        except SaturatedError as e:
+            return saturated_response(request_id, e)
+        try:
+            result = future.result(timeout=request_timeout)
+            return jsonify(result)
+        except TimeoutError:
+            # Drop the task if it is still queued, otherwise stop it at its next check
+            ai_executor.cancel(future)
+            logger.error(f"[{request_id}] API processing timed out after {request_timeout} seconds")
+            return jsonify({
+                "response": "Sorry, the request took too long to process. Please try again with a simpler query.",
+                "provider": "timeout",
+                "error": "API processing timeout"
+            }), 500
     except Exception as e:
         logger.error(f"[{request_id}] Critical error in chat endpoint: {str(e)}")
         logger.error(f"[{request_id}] Critical error details: {traceback.format_exc()}")
@@ -1632,13 +1912,123 @@ def chat():
             "error": str(e)
         }), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    API endpoint streaming chat responses as Server-Sent Events: 'token'
+    events carry text as it is generated and a final 'done' event carries the
+    provider, model, latency and token usage. Uses the same provider fallback
+    chain as /api/chat.
+    """
+    request_id = str(uuid.uuid4())[:8]
+    start_time = time.time()
+    data = request.get_json(silent=True) or {}
+    message = data.get('message', '')
+    current_stock = data.get('stock', None)
+    source_page = data.get('source', None)
+    if not message:
+        return jsonify({"error": "Please enter a message."}), 400
+    
+    logger.info(f"[{request_id}] New streaming chat request for stock: {current_stock}, source: {source_page}")
+    settings = get_settings()
+    ai_provider = settings.get('ai_provider', 'perplexity')
+    
+    # Streams are served on the request thread but count against the shared AI capacity
+    slot_provider = admission_provider(ai_provider)
+    try:
+        ai_executor.acquire(slot_provider)
+    except SaturatedError as e:
+        return saturated_response(request_id, e)
+    
+    def done_event(provider, model, first_token_time, usage=None, cached=False):
+        total_time = time.time() - start_time
+        logger.info(f"[{request_id}] Streaming request completed in {total_time:.2f}s via {provider}")
+        return sse_event('done', {
+            'provider': provider,
+            'model': model,
+            'cached': cached,
+            'latency_ms': round(total_time * 1000),
+            'first_token_ms': round((first_token_time - start_time) * 1000) if first_token_time else None,
+            'usage': usage,
+        })
+    
+    def generate():
+        # Same order as /api/chat: the selected provider, then OpenAI if Perplexity isn't used
+        attempts = []
+        perplexity_client = get_llm_client('perplexity') if ai_provider == 'perplexity' else None
+        if perplexity_client:
+            selected_model, model_id = select_perplexity_model(settings, source_page, request_id)
+            attempts.append(('perplexity', perplexity_client, selected_model, model_id, {'max_tokens': 1000}))
+        openai_client = get_llm_client('openai') if ai_provider == 'openai' or not perplexity_client else None
+        if openai_client:
+            attempts.append(('openai', openai_client, 'gpt-3.5-turbo', 'gpt-3.5-turbo',
+                             {'max_tokens': 1000, 'temperature': 0.7, 'presence_penalty': 0.6,
+                              'frequency_penalty': 0.2}))
+        
+        try:
+            # Sized for the first model tried
+            context, data_version = build_chat_context(current_stock, request_id, message,
+                                                       attempts[0][3] if attempts else None)
+        except Exception as e:
+            logger.error(f"[{request_id}] Error building chat context: {str(e)}")
+            yield sse_event('error', {'error': str(e)})
+            return
+        messages = [
+            {"role": "system", "content": context},
+            {"role": "user", "content": message}
+        ]
+        
+        for provider, client, model_name, model_id, params in attempts:
+            first_token_time = None
+            try:
+                for kind, payload in stream_chat_completion(client, provider, model_id, messages,
+                                                            source_page or 'chat', data_version, **params):
+                    if kind == 'token':
+                        if first_token_time is None:
+                            first_token_time = time.time()
+                            logger.info(f"[{request_id}] First token from {provider} after "
+                                        f"{first_token_time - start_time:.2f}s")
+                        yield sse_event('token', {'text': payload})
+                    else:
+                        yield done_event(provider, model_name, first_token_time, payload['usage'], payload['cached'])
+                return
+            except Exception as e:
+                logger.error(f"[{request_id}] Error streaming from {provider}: {str(e)}")
+                if first_token_time is not None:
+                    # Part of the answer was already sent, so another provider can't take over
+                    yield sse_event('error', {'error': str(e), 'provider': provider, 'model': model_name})
+                    return
+        
+        logger.warning(f"[{request_id}] No AI provider streamed a response, using simple chat fallback")
+        result = handle_simple_chat(message, current_stock)
+        if not isinstance(result, dict):
+            result = {"response": str(result), "provider": "fallback"}
+        first_token_time = time.time()
+        yield sse_event('token', {'text': result.get('response', '')})
+        yield done_event(result.get('provider'), result.get('model'), first_token_time, cached=result.get('cached', False))
+    
+    def admitted_generate():
+        # Calls to a provider other than slot_provider take a slot of their own
+        with ai_executor.admitted(slot_provider):
+            yield from generate()
+    
+    response = Response(stream_with_context(admitted_generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the stream finishes or the client disconnects
+    response.call_on_close(lambda: ai_executor.release(slot_provider, time.time() - start_time))
+    return response
+
 @app.route('/api/risk/tariff', methods=['GET'])
 def api_tariff_risk():
     """API endpoint to get tariff risk analysis for the portfolio."""
     try:
         # Get symbol parameter if provided
         symbol = request.args.get('symbol', None)
-        risk_data = analyze_tariff_risk(symbol)
+        conn = get_db_connection()
+        try:
+            risk_data = chat_context.tariff_risk(conn, analyze_tariff_risk, symbol)['analysis']
+        finally:
+            conn.close()
         
         return jsonify({
             "success": True,
@@ -1679,81 +2069,27 @@ def handle_simple_chat(message, current_stock=None):
             logger.info(f"[{request_id}] Risk keyword detected: '{keyword}'")
             break
     
-    # Get risk analysis data if needed
-    risk_data = None
-    if need_risk_data:
-        logger.info(f"[{request_id}] Gathering risk analysis data for {current_stock if current_stock else 'portfolio'}")
-        try:
-            risk_data = analyze_tariff_risk(current_stock)
-            logger.debug(f"[{request_id}] Risk data gathered successfully")
-        except Exception as e:
-            logger.error(f"[{request_id}] Error gathering risk data: {str(e)}")
-            logger.error(f"[{request_id}] Risk data error details: {traceback.format_exc()}")
-    
-    # Format transactions for context
+    # Precomputed context snippets: recent transactions, plus the risk summary if needed
+    recent = None
+    risk = None
+    data_version = None
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        if current_stock:
-            logger.info(f"[{request_id}] Fetching transactions for {current_stock}")
-            # Get transactions for the current stock
-            cursor.execute('SELECT * FROM transactions WHERE Symbol = ? ORDER BY Date DESC, Time DESC LIMIT 20', (current_stock,))
-        else:
-            logger.info(f"[{request_id}] Fetching recent transactions for portfolio")
-            # Get recent transactions
-            cursor.execute('SELECT * FROM transactions ORDER BY Date DESC, Time DESC LIMIT 10')
-        
-        transactions = cursor.fetchall()
+        logger.info(f"[{request_id}] Loading recent transactions for {current_stock if current_stock else 'portfolio'}")
+        recent = chat_context.recent_transactions(conn, current_stock)
+        data_version = get_data_version(conn)
+        if need_risk_data:
+            logger.info(f"[{request_id}] Gathering risk analysis data for {current_stock if current_stock else 'portfolio'}")
+            try:
+                risk = chat_context.tariff_risk(conn, analyze_tariff_risk, current_stock)
+                logger.debug(f"[{request_id}] Risk data gathered successfully")
+            except Exception as e:
+                logger.error(f"[{request_id}] Error gathering risk data: {str(e)}")
+                logger.error(f"[{request_id}] Risk data error details: {traceback.format_exc()}")
         conn.close()
-        logger.debug(f"[{request_id}] Retrieved {len(transactions)} transactions for context")
     except Exception as e:
         logger.error(f"[{request_id}] Error retrieving transactions: {str(e)}")
         logger.error(f"[{request_id}] Transaction retrieval error details: {traceback.format_exc()}")
-        transactions = []
-    
-    # Format transactions for context
-    transaction_context = ""
-    if transactions:
-        transaction_context = "Recent transactions:\n"
-        for t in transactions:
-            try:
-                # Convert AveragePrice to float if it's a string
-                avg_price = float(t['AveragePrice']) if isinstance(t['AveragePrice'], str) else t['AveragePrice']
-                transaction_context += f"- {t['Date']} {t['Symbol']} {t['Side'].upper()} {t['Qty']} shares at ${avg_price:.2f}\n"
-            except (ValueError, TypeError) as e:
-                logger.warning(f"[{request_id}] Error formatting transaction {t.get('Id', 'unknown')}: {str(e)}")
-                # Fallback to string format if conversion fails
-                transaction_context += f"- {t['Date']} {t['Symbol']} {t['Side'].upper()} {t['Qty']} shares at ${t['AveragePrice']}\n"
-    
-    # Include risk analysis if available
-    risk_context = ""
-    if risk_data:
-        logger.debug(f"[{request_id}] Adding risk context to prompt")
-        # Add general tariff context
-        risk_context += "\nTariff Risk Context:\n"
-        risk_context += f"- Recent Developments: {risk_data['tariff_context']['recent_developments']}\n"
-        risk_context += f"- Potential Impacts: {risk_data['tariff_context']['potential_impacts']}\n"
-        risk_context += f"- Most Affected Sectors: {risk_data['tariff_context']['sectors_most_affected']}\n\n"
-        
-        # Add portfolio risk exposure
-        risk_context += f"Portfolio Tariff Risk Exposure:\n"
-        risk_context += f"- High Risk Holdings: {len(risk_data['high_risk'])} stocks\n"
-        if risk_data['high_risk']:
-            risk_context += "  " + ", ".join([f"{s['Symbol']} ({s['Name']})" for s in risk_data['high_risk']]) + "\n"
-        
-        risk_context += f"- Medium Risk Holdings: {len(risk_data['medium_risk'])} stocks\n"
-        if risk_data['medium_risk']:
-            risk_context += "  " + ", ".join([f"{s['Symbol']} ({s['Name']})" for s in risk_data['medium_risk']]) + "\n"
-        
-        # Add specific stock risk if viewing a stock
-        if current_stock and risk_data['current_stock_risk']:
-            stock_risk = risk_data['current_stock_risk']
-            risk_context += f"\nRisk Profile for {current_stock} ({stock_risk['Name']}):\n"
-            risk_context += f"- Risk Level: {stock_risk['risk_level'].upper()}\n"
-            risk_context += f"- Risk Factors:\n"
-            for factor in stock_risk['risk_factors']:
-                risk_context += f"  * {factor}\n"
     
     # Get settings in a way that doesn't require request context
     try:
@@ -1788,17 +2124,40 @@ def handle_simple_chat(message, current_stock=None):
             "Use the tariff risk data provided to give targeted recommendations. "
         )
     
+    # Fit the transaction and risk context to the model's token budget, most relevant first
+    items = []
+    if recent and recent['lines']:
+        items.append(ContextItem('transactions', header="Recent transactions:", lines=recent['lines'],
+                                 line_symbols=recent['symbols'], compact=recent['summary'], priority=1.0,
+                                 symbols=recent['symbols'], keywords=TRADE_KEYWORDS))
+    if is_risk_question and risk:
+        items.append(ContextItem('risk_background', header=risk['background'], priority=0.5))
+        items.append(ContextItem('risk_exposure', header=risk['exposure'], lines=risk['lines'],
+                                 line_symbols=risk['symbols'], compact=risk['exposure'], priority=1.5,
+                                 symbols=risk['symbols'], required=True))
+        if risk['profile']:
+            items.append(ContextItem('risk_profile', header=risk['profile'], priority=1.0, symbols=[current_stock]))
+    model = settings.get('perplexity_model', DEFAULT_PERPLEXITY_MODEL) if ai_provider == 'perplexity' else 'gpt-3.5-turbo'
+    prompt = assemble(items, budget_for(model), message, current_stock, reserved=system_prompt)
+    transaction_context = prompt['blocks'].get('transactions', '')
+    risk_context = '\n\n'.join(text for name, text in prompt['blocks'].items() if name.startswith('risk_'))
+    logger.debug(f"[{request_id}] Context for {model}: ~{prompt['tokens']} of {prompt['budget']} tokens, "
+                 f"forms {prompt['forms']}, dropped {prompt['dropped']}")
+    
     # Build user prompt with appropriate context
     user_prompt = f"User question: {message}\n\n"
     
     if transaction_context:
         user_prompt = f"Transaction context:\n{transaction_context}\n\n" + user_prompt
     
-    if is_risk_question and risk_context:
+    if risk_context:
         user_prompt = f"Risk analysis context:\n{risk_context}\n\n" + user_prompt
     
     logger.debug(f"[{request_id}] Prompt size - System: {len(system_prompt)} chars, User: {len(user_prompt)} chars")
     
+    perplexity_client = get_llm_client('perplexity')
+    openai_client = get_llm_client('openai')
+    
     # Try to use Perplexity first if configured
     if ai_provider == 'perplexity' and perplexity_client:
         logger.info(f"[{request_id}] Attempting to use Perplexity API in fallback mode")
@@ -1807,21 +2166,25 @@ def handle_simple_chat(message, current_stock=None):
             logger.debug(f"[{request_id}] Using Perplexity model: {model}")
             
             start_time = time.time()
-            response = perplexity_client.chat.completions.create(
+            completion = create_chat_completion(
+                perplexity_client, 'perplexity',
                 model=model,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
                 ],
+                feature='chat',
+                data_version=data_version,
                 temperature=0.7
             )
             elapsed_time = time.time() - start_time
             logger.info(f"[{request_id}] Perplexity API call in fallback mode successful in {elapsed_time:.2f}s")
             
             return {
-                "response": response.choices[0].message.content,
+                "response": completion['content'],
                 "provider": "Perplexity",
-                "model": model
+                "model": model,
+                "cached": completion['cached']
             }
         except Exception as e:
             logger.error(f"[{request_id}] Error with Perplexity API in fallback mode: {str(e)}")
@@ -1833,21 +2196,25 @@ def handle_simple_chat(message, current_stock=None):
         logger.info(f"[{request_id}] Attempting to use OpenAI API in fallback mode")
         try:
             start_time = time.time()
-            response = openai_client.chat.completions.create(
+            completion = create_chat_completion(
+                openai_client, 'openai',
                 model="gpt-3.5-turbo",
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
                 ],
+                feature='chat',
+                data_version=data_version,
                 temperature=0.7
             )
             elapsed_time = time.time() - start_time
             logger.info(f"[{request_id}] OpenAI API call in fallback mode successful in {elapsed_time:.2f}s")
             
             return {
-                "response": response.choices[0].message.content,
+                "response": completion['content'],
                 "provider": "OpenAI",
-                "model": "gpt-3.5-turbo"
+                "model": "gpt-3.5-turbo",
+                "cached": completion['cached']
             }
         except Exception as e:
             logger.error(f"[{request_id}] Error with OpenAI API in fallback mode: {str(e)}")
@@ -1868,20 +2235,14 @@ def handle_simple_chat(message, current_stock=None):
 
 def get_stock_sector(symbol):
     """
-    Get the sector information for a given stock symbol using yfinance.
+    Get the sector information for a given stock symbol from the shared ticker metadata cache.
     Returns the sector string or "Unknown" if not available.
     """
     try:
-        stock = yf.Ticker(symbol)
-        info = stock.info
+        info = get_ticker_info(symbol)
         
         # Check for sector information in different possible fields
-        sector = info.get('sector') or info.get('industryDisp')
-        
-        if not sector and 'info' in dir(stock) and callable(getattr(stock, 'info')):
-            # Try refreshing info
-            refreshed_info = stock.info
-            sector = refreshed_info.get('sector') or refreshed_info.get('industryDisp')
+        sector = info['sector'] or info['industry_disp']
         
         return sector or "Unknown"
     except Exception as e:
@@ -1942,34 +2303,24 @@ def assess_tariff_risk(symbol, sector):
         "assessment": assessment
     }
 
-def init_db():
-    """Initialize the database with transactions table and thesis_jobs table"""
-    # First drop existing tables to ensure a clean start
-    conn = sqlite3.connect('stock_transactions.db')
+def init_db(mode=REPLACE, source='stock_orders.csv'):
+    """Initialize the database with transactions table and thesis_jobs table, returning the ingest report.
+    
+    mode is REPLACE (source is the full history; job tables start clean) or APPEND
+    (source is a delta merged into the existing transactions; job history is kept).
+    Pass mode=None to only create missing tables, loading source if there are no
+    transactions yet; the report is None if nothing was loaded.
+    """
+    conn = db_connect()
     c = conn.cursor()
     
-    # Drop tables if they exist to ensure clean schema
-    c.execute('DROP TABLE IF EXISTS transactions')
-    c.execute('DROP TABLE IF EXISTS thesis_jobs')
-    c.execute('DROP TABLE IF EXISTS earnings_jobs')
-    c.execute('DROP TABLE IF EXISTS earnings_calendar')
+    # Bring an existing database to the current schema before anything touches it
+    migrate(conn)
     
-    # Create transactions table if it doesn't exist - using TEXT for all fields to prevent type issues
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS transactions (
-        Id TEXT,
-        Date TEXT,
-        Time TEXT,
-        Symbol TEXT,
-        Name TEXT,
-        Type TEXT,
-        Side TEXT,
-        AveragePrice TEXT,  -- Store as TEXT to avoid type conversion issues
-        Qty TEXT,           -- Store as TEXT to avoid type conversion issues
-        State TEXT,
-        Fees TEXT
-    )
-    ''')
+    # Create the canonical transactions table (typed numeric columns, Timestamp and indexes)
+    create_transactions_table(c)
+    init_positions(c)
+    init_data_versions(c)
     
     # Create thesis_jobs table if it doesn't exist
     c.execute('''
@@ -2009,46 +2360,36 @@ def init_db():
     )
     ''')
     
+    # Daily price bars and symbol metadata are kept across uploads since they don't depend on the CSV
+    init_price_store(conn)
+    init_symbol_metadata(conn)
+    init_ticker_info(conn)
+    init_llm_cache(conn)
+    
     conn.commit()
     
-    # Load data from CSV if the table is empty
-    c.execute('SELECT COUNT(*) FROM transactions')
-    if c.fetchone()[0] == 0:
-        with open('stock_orders.csv', 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                try:
-                    # Convert date format from MM/DD/YYYY to YYYY-MM-DD
-                    date_obj = datetime.strptime(row['Date'], '%m/%d/%Y')
-                    date_str = date_obj.strftime('%Y-%m-%d')
-                    
-                    # Generate a unique ID if not present in the CSV
-                    transaction_id = row.get('Id', str(uuid.uuid4()))
-                    
-                    # Store all values as strings in the database to avoid type issues
-                    c.execute('''
-                    INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        transaction_id,
-                        date_str,
-                        row['Time'],
-                        row['Symbol'],
-                        row['Name'],
-                        row['Type'],
-                        row['Side'],
-                        row['AveragePrice'],  # Store as text
-                        row['Qty'],           # Store as text
-                        row['State'],
-                        row['Fees']
-                    ))
-                except Exception as e:
-                    print(f"Error processing row: {row}")
-                    print(f"Error: {e}")
-                    continue
-            conn.commit()
+    if mode is None:
+        if c.execute('SELECT 1 FROM transactions LIMIT 1').fetchone() or not os.path.exists(source):
+            conn.close()
+            print("Database initialized successfully!")
+            return None
+        mode = REPLACE
     
-    conn.close()
-    print("Database initialized successfully!")
+    if mode == REPLACE:
+        # Clear job tables to start clean; left uncommitted so they are only
+        # cleared together with the ingest and survive a failed upload
+        c.execute('DELETE FROM thesis_jobs')
+        c.execute('DELETE FROM earnings_jobs')
+        c.execute('DELETE FROM earnings_calendar')
+    
+    # Stream the CSV into the transactions table in one transaction
+    try:
+        report = ingest_csv(conn, source, mode=mode)
+    finally:
+        conn.close()
+    
+    print(f"Database initialized successfully! {report.summary()}")
+    return report
 
 def create_thesis_job(thesis):
     """Create a new thesis validation job in the database"""
@@ -2119,17 +2460,12 @@ def process_thesis_validation(job_id, thesis):
         # Get settings
         settings = DEFAULT_SETTINGS
         
-        # Get Perplexity client
-        perplexity_api_key = os.getenv('PERPLEXITY_API_KEY')
-        if not perplexity_api_key:
+        # Get the shared Perplexity client, with a timeout long enough for deep research
+        perplexity_client = get_llm_client('perplexity', timeout=LONG_REQUEST_TIMEOUT)
+        if not perplexity_client:
             update_thesis_job(job_id, 'failed', "Perplexity API key not configured")
             return
         
-        perplexity_client = OpenAI(
-            api_key=perplexity_api_key,
-            base_url="https://api.perplexity.ai"
-        )
-        
         # Use sonar-deep-research model specifically for thesis validation
         model = 'sonar-deep-research'
         
@@ -2157,19 +2493,24 @@ def process_thesis_validation(job_id, thesis):
         Be balanced in your analysis, considering both supporting and contradicting evidence.
         """
         
-        # Call Perplexity API using the OpenAI client interface
-        response = perplexity_client.chat.completions.create(
+        # Call Perplexity API using the OpenAI client interface; the prompt doesn't
+        # depend on portfolio data, so repeated theses are served from the cache
+        completion = create_chat_completion(
+            perplexity_client, 'perplexity',
             model=model,
             messages=[
                 {"role": "system", "content": "You are an expert financial advisor who provides comprehensive, well-researched investment thesis validations with specific citations and references. Format your response with clear Markdown syntax including proper headers, lists, links, and citations."},
                 {"role": "user", "content": prompt}
             ],
+            feature='thesis_validation',
             temperature=0.2,
             max_tokens=4000
         )
         
-        if response and response.choices and len(response.choices) > 0:
-            result = response.choices[0].message.content
+        if completion['content']:
+            result = completion['content']
+            if completion['cached']:
+                logger.info(f"Thesis validation job {job_id} served from the response cache")
             
             # Ensure the result contains proper markdown formatting
             # Add a main heading if not present
@@ -2201,44 +2542,29 @@ def thesis_validation():
     
     # Get connection to database
     conn = get_db_connection()
-    cursor = conn.cursor()
     
     # Get user's portfolio (stocks with positive current shares)
-    cursor.execute('''
-        SELECT 
-            Symbol, 
-            Name,
-            SUM(CASE WHEN Side = 'buy' THEN Qty ELSE -Qty END) as CurrentShares,
-            SUM(CASE WHEN Side = 'buy' THEN Qty * AveragePrice ELSE 0 END) / 
-            NULLIF(SUM(CASE WHEN Side = 'buy' THEN Qty ELSE 0 END), 0) as AverageCost
-        FROM 
-            transactions
-        GROUP BY 
-            Symbol
-        HAVING 
-            SUM(CASE WHEN Side = 'buy' THEN Qty ELSE -Qty END) > 0
-        ORDER BY 
-            Symbol
-    ''')
+    portfolio = get_open_positions(conn, order='symbol')
     
-    portfolio = cursor.fetchall()
-    
-    # Get current prices
+    # Get current prices in one batched call
     current_prices = {}
+    price_map = get_stock_prices([stock['Symbol'] for stock in portfolio])
     for stock in portfolio:
         symbol = stock['Symbol']
-        if symbol not in current_prices:
-            price_data = get_stock_price(symbol)
-            if price_data and 'current_price' in price_data and price_data['current_price'] is not None:
-                current_prices[symbol] = price_data['current_price']
-            else:
-                current_prices[symbol] = 0
+        price_data = price_map.get(symbol)
+        if price_data and 'current_price' in price_data and price_data['current_price'] is not None:
+            current_prices[symbol] = price_data['current_price']
+        else:
+            current_prices[symbol] = 0
     
-    # Portfolio summary
+    # Portfolio summary, valued from the open lots (split-adjusted shares and their cost basis)
+    cost_basis = get_cost_basis(conn, [stock['Symbol'] for stock in portfolio], prices=current_prices)
+    portfolio = [dict(stock, CurrentShares=cost_basis[stock['Symbol']]['shares'])
+                 if stock['Symbol'] in cost_basis else dict(stock) for stock in portfolio]
     portfolio_summary = {
         'total_stocks': len(portfolio),
-        'total_value': sum(stock['CurrentShares'] * current_prices.get(stock['Symbol'], 0) for stock in portfolio),
-        'total_investment': sum(stock['CurrentShares'] * stock['AverageCost'] for stock in portfolio if stock['AverageCost'] is not None),
+        'total_value': cost_basis['_totals']['market_value'],
+        'total_investment': cost_basis['_totals']['cost_basis'],
     }
     
     portfolio_summary['total_gain_loss'] = portfolio_summary['total_value'] - portfolio_summary['total_investment']
@@ -2373,6 +2699,44 @@ def get_earnings_calendar(start_date=None, end_date=None, symbol=None):
     conn.close()
     return processed_earnings
 
+def fetch_earnings_entry(symbol):
+    """
+    Get the next earnings date for a symbol from the market data provider's calendar.
+    Returns a (earnings_date, time_of_day, eps_estimate) tuple, or None if no
+    earnings date is scheduled.
+    """
+    calendar = get_market_data_provider().calendar(symbol)
+    
+    # Newer calendars list the candidate dates; take the first one
+    earnings_date = calendar.get('Earnings Date')
+    if isinstance(earnings_date, (list, tuple)):
+        earnings_date = earnings_date[0] if earnings_date else None
+    if earnings_date is None or pd.isna(earnings_date):
+        return None
+    earnings_date = pd.Timestamp(earnings_date).strftime('%Y-%m-%d')
+    
+    # Get time of day (BMO = Before Market Open, AMC = After Market Close)
+    time_of_day = 'Unknown'
+    earnings_time = calendar.get('Earnings Time')
+    if earnings_time:
+        if 'bmo' in str(earnings_time).lower():
+            time_of_day = 'BMO'
+        elif 'amc' in str(earnings_time).lower():
+            time_of_day = 'AMC'
+    
+    # Get EPS estimate
+    eps_estimate = calendar.get('EPS Estimate', calendar.get('Earnings Average'))
+    # Safely handle various types of EPS estimate values
+    if eps_estimate is None or pd.isna(eps_estimate):
+        eps_estimate = None
+    elif isinstance(eps_estimate, (int, float)):
+        eps_estimate = str(round(eps_estimate, 2))
+    else:
+        # Convert any other type to string
+        eps_estimate = str(eps_estimate)
+    
+    return earnings_date, time_of_day, eps_estimate
+
 def update_earnings_calendar():
     """
     Update the earnings calendar with latest data using Yahoo Finance API.
@@ -2392,18 +2756,7 @@ def update_earnings_calendar():
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT DISTINCT Symbol, Name
-            FROM transactions
-            WHERE Symbol IN (
-                SELECT Symbol
-                FROM transactions
-                GROUP BY Symbol
-                HAVING SUM(CASE WHEN Side = 'buy' THEN Qty ELSE -Qty END) > 0
-            )
-        ''')
-        
-        portfolio_stocks = cursor.fetchall()
+        portfolio_stocks = get_open_positions(conn, order='symbol')
         
         # Also get some major indices and popular stocks to add to the calendar
         major_stocks = [
@@ -2463,40 +2816,10 @@ def update_earnings_calendar():
                     # Already have fresh data, skip
                     continue
                 
-                # Get earnings data using yfinance
-                stock_data = yf.Ticker(symbol)
-                earnings_dates = stock_data.calendar
-                
-                if earnings_dates and hasattr(earnings_dates, 'loc') and 'Earnings Date' in earnings_dates:
-                    earnings_date = earnings_dates.loc['Earnings Date']
-                    
-                    # Convert to datetime if it's a timestamp
-                    if isinstance(earnings_date, pd.Timestamp):
-                        earnings_date = earnings_date.date().strftime('%Y-%m-%d')
-                    else:
-                        earnings_date = str(earnings_date)
-                    
-                    # Get time of day (BMO = Before Market Open, AMC = After Market Close)
-                    time_of_day = 'Unknown'
-                    earnings_time = stock_data.calendar.loc['Earnings Time'] if 'Earnings Time' in stock_data.calendar else None
-                    if earnings_time:
-                        if 'bmo' in str(earnings_time).lower():
-                            time_of_day = 'BMO'
-                        elif 'amc' in str(earnings_time).lower():
-                            time_of_day = 'AMC'
-                    
-                    # Get EPS estimate
-                    eps_estimate = None
-                    if 'EPS Estimate' in stock_data.calendar:
-                        eps_estimate = stock_data.calendar.loc['EPS Estimate']
-                        # Safely handle various types of EPS estimate values
-                        if pd.isna(eps_estimate):
-                            eps_estimate = None
-                        elif isinstance(eps_estimate, (int, float)):
-                            eps_estimate = str(round(eps_estimate, 2))
-                        else:
-                            # Convert any other type to string
-                            eps_estimate = str(eps_estimate)
+                # Get earnings data from the market data provider
+                entry = fetch_earnings_entry(symbol)
+                if entry:
+                    earnings_date, time_of_day, eps_estimate = entry
                     
                     # Upsert into database
                     cursor.execute('''
@@ -2512,8 +2835,12 @@ def update_earnings_calendar():
                         today_str
                     ))
                 
+            except ProviderUnavailableError as e:
+                # Provider is throttling us; keep the existing calendar entries
+                logger.warning(f"Stopping earnings calendar update: {e}")
+                break
             except Exception as e:
-                print(f"Error fetching earnings for {symbol}: {e}")
+                logger.warning(f"Error fetching earnings for {symbol}: {e}")
                 continue
         
         # Now process major stocks that aren't in the portfolio
@@ -2536,40 +2863,10 @@ def update_earnings_calendar():
                     # Already have fresh data, skip
                     continue
                 
-                # Get earnings data using yfinance
-                stock_data = yf.Ticker(symbol)
-                earnings_dates = stock_data.calendar
-                
-                if earnings_dates and hasattr(earnings_dates, 'loc') and 'Earnings Date' in earnings_dates:
-                    earnings_date = earnings_dates.loc['Earnings Date']
-                    
-                    # Convert to datetime if it's a timestamp
-                    if isinstance(earnings_date, pd.Timestamp):
-                        earnings_date = earnings_date.date().strftime('%Y-%m-%d')
-                    else:
-                        earnings_date = str(earnings_date)
-                    
-                    # Get time of day (BMO = Before Market Open, AMC = After Market Close)
-                    time_of_day = 'Unknown'
-                    earnings_time = stock_data.calendar.loc['Earnings Time'] if 'Earnings Time' in stock_data.calendar else None
-                    if earnings_time:
-                        if 'bmo' in str(earnings_time).lower():
-                            time_of_day = 'BMO'
-                        elif 'amc' in str(earnings_time).lower():
-                            time_of_day = 'AMC'
-                    
-                    # Get EPS estimate
-                    eps_estimate = None
-                    if 'EPS Estimate' in stock_data.calendar:
-                        eps_estimate = stock_data.calendar.loc['EPS Estimate']
-                        # Safely handle various types of EPS estimate values
-                        if pd.isna(eps_estimate):
-                            eps_estimate = None
-                        elif isinstance(eps_estimate, (int, float)):
-                            eps_estimate = str(round(eps_estimate, 2))
-                        else:
-                            # Convert any other type to string
-                            eps_estimate = str(eps_estimate)
+                # Get earnings data from the market data provider
+                entry = fetch_earnings_entry(symbol)
+                if entry:
+                    earnings_date, time_of_day, eps_estimate = entry
                     
                     # Upsert into database
                     cursor.execute('''
@@ -2585,8 +2882,12 @@ def update_earnings_calendar():
                         today_str
                     ))
                 
+            except ProviderUnavailableError as e:
+                # Provider is throttling us; keep the existing calendar entries
+                logger.warning(f"Stopping earnings calendar update: {e}")
+                break
             except Exception as e:
-                print(f"Error fetching earnings for {symbol}: {e}")
+                logger.warning(f"Error fetching earnings for {symbol}: {e}")
                 continue
         
         # Clean up old entries
@@ -2626,13 +2927,12 @@ def is_etf(symbol, name=None):
             
     # Check if typical ETF pattern (3-4 letters, often ends with specific letters)
     if len(symbol) <= 4 and any(symbol.endswith(suffix) for suffix in ['X', 'Q', 'S']):
-        # Additional verification with yfinance if needed
+        # Additional verification with the shared ticker metadata cache
         try:
-            stock = yf.Ticker(symbol)
-            info = stock.info
-            if 'quoteType' in info and info['quoteType'] in ['ETF', 'MUTUALFUND', 'INDEX']:
+            info = get_ticker_info(symbol)
+            if info['quote_type'] in ['ETF', 'MUTUALFUND', 'INDEX']:
                 return True
-        except:
+        except Exception:
             # If we can't verify, just continue with other checks
             pass
             
@@ -2711,24 +3011,12 @@ def process_earnings_research(job_id, symbol, earnings_date, perplexity_model):
         # Get company name and any position info from user's portfolio
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT Name FROM transactions WHERE Symbol = ? LIMIT 1', (symbol,))
-        result = cursor.fetchone()
-        company_name = result['Name'] if result else symbol
+        position = get_position(conn, symbol)
+        company_name = position['Name'] if position and position['Name'] else symbol
         
         # Get user's position in this stock if any
-        cursor.execute('''
-            SELECT 
-                SUM(CASE WHEN Side = 'buy' THEN Qty ELSE -Qty END) as CurrentShares,
-                SUM(CASE WHEN Side = 'buy' THEN Qty * AveragePrice ELSE 0 END) / 
-                NULLIF(SUM(CASE WHEN Side = 'buy' THEN Qty ELSE 0 END), 0) as AverageCost
-            FROM 
-                transactions
-            WHERE 
-                Symbol = ?
-        ''', (symbol,))
-        
-        position = cursor.fetchone()
-        has_position = position and position['CurrentShares'] is not None and position['CurrentShares'] > 0
+        has_position = position is not None and position['CurrentShares'] > MIN_OPEN_SHARES
+        lots = get_cost_basis(conn, [symbol]).get(symbol) if has_position else None
         
         # Get earnings history for this stock
         cursor.execute('''
@@ -2741,17 +3029,12 @@ def process_earnings_research(job_id, symbol, earnings_date, perplexity_model):
         past_earnings = cursor.fetchall()
         conn.close()
         
-        # Get Perplexity client
-        perplexity_api_key = os.getenv('PERPLEXITY_API_KEY')
-        if not perplexity_api_key:
+        # Get the shared Perplexity client, with a timeout long enough for deep research
+        perplexity_client = get_llm_client('perplexity', timeout=LONG_REQUEST_TIMEOUT)
+        if not perplexity_client:
             update_earnings_job(job_id, 'failed', "Perplexity API key not configured")
             return
         
-        perplexity_client = OpenAI(
-            api_key=perplexity_api_key,
-            base_url="https://api.perplexity.ai"
-        )
-        
         # Always use sonar-deep-research for earnings analysis
         model = 'sonar-deep-research'
         
@@ -2761,8 +3044,9 @@ def process_earnings_research(job_id, symbol, earnings_date, perplexity_model):
         # Build investor context based on portfolio position
         investor_context = ""
         if has_position:
-            avg_cost = position['AverageCost'] if position['AverageCost'] is not None else 0
-            current_shares = position['CurrentShares'] if position['CurrentShares'] is not None else 0
+            # Cost basis of the lots still held, rather than the average of every buy
+            avg_cost = lots['average_cost'] if lots and lots['average_cost'] is not None else 0
+            current_shares = lots['shares'] if lots else position['CurrentShares']
             
             # Get current price
             price_data = get_stock_price(symbol)
@@ -2843,19 +3127,24 @@ Format your response using proper Markdown syntax with clear section headings, b
 When providing sources, DO NOT include them inline like [1] or [1,2,3]. Instead, collect all sources at the end under the Sources section with proper URLs.
 """
         
-        # Call Perplexity API using the OpenAI client interface
-        response = perplexity_client.chat.completions.create(
+        # Call Perplexity API using the OpenAI client interface; the prompt embeds
+        # today's date and the position, so cached reports never outlive either
+        completion = create_chat_completion(
+            perplexity_client, 'perplexity',
             model=model,
             messages=[
                 {"role": "system", "content": "You are an expert financial analyst specializing in earnings previews. You provide comprehensive, well-researched analysis with specific data points, clear insights for investors, and properly sourced information. Always include extensive sources that are properly formatted and provide visualization-friendly data for interactive charts."},
                 {"role": "user", "content": prompt}
             ],
+            feature='earnings_research',
             temperature=0.2,
             max_tokens=4000
         )
         
-        if response and response.choices and len(response.choices) > 0:
-            content = response.choices[0].message.content
+        if completion['content']:
+            content = completion['content']
+            if completion['cached']:
+                logger.info(f"Earnings research job {job_id} served from the response cache")
             
             try:
                 # Process the content to enhance with chart HTML
@@ -3022,21 +3311,7 @@ def earnings_companion():
     
     # Get user's portfolio to highlight stocks
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT 
-            Symbol,
-            SUM(CASE WHEN Side = 'buy' THEN Qty ELSE -Qty END) as CurrentShares
-        FROM 
-            transactions
-        GROUP BY 
-            Symbol
-        HAVING 
-            CurrentShares > 0
-    ''')
-    
-    portfolio_symbols = {row['Symbol']: row['CurrentShares'] for row in cursor.fetchall()}
+    portfolio_symbols = {row['Symbol']: row['CurrentShares'] for row in get_open_positions(conn, order='symbol')}
     conn.close()
     
     # Mark portfolio stocks in the earnings calendar
@@ -3658,6 +3933,7 @@ def check_openai_api_health():
     
     # Try a simple API call to check connectivity
     try:
+        openai_client = get_llm_client('openai')
         start_time = time.time()
         
         # Try to list models as a simple API check
@@ -3799,6 +4075,97 @@ def api_check_openai():
             "error": f"Error checking API health: {str(e)}"
         }), 500
 
+@app.route('/api/admin/cache', methods=['GET'])
+def api_admin_cache():
+    """API endpoint to inspect the in-memory caches"""
+    return jsonify({
+        'caches': cache_stats(),
+        'market_data_flight': market_data_flight.stats(),
+        'split_index': compile_split_index.cache_info()._asdict()
+    })
+
+@app.route('/api/admin/metrics', methods=['GET'])
+def api_admin_metrics():
+    """API endpoint exposing market data provider health (circuit breaker and rate limits)"""
+    return jsonify({
+        'market_data': get_market_data_provider().stats(),
+        'market_data_flight': market_data_flight.stats(),
+        'quote_refresh_pending': len(quote_refresh_pending),
+        'db_pools': pool_stats(),
+        'llm_clients': get_llm_registry().stats(),
+        'llm_response_cache': llm_response_cache.stats(),
+        'llm_flight': llm_flight.stats(),
+        'ai_executor': ai_executor.stats(),
+        'chat_context': chat_context.stats()
+    })
+
+@app.route('/api/admin/cache/flush', methods=['POST'])
+def api_admin_cache_flush():
+    """API endpoint to flush one cache (JSON body {"name": ...}) or all of them"""
+    data = request.get_json(silent=True) or {}
+    name = data.get('name')
+    try:
+        flushed = flush_caches(name)
+    except KeyError:
+        return jsonify({'error': f"Unknown cache: {name}"}), 404
+    if name is None:
+        compile_split_index.cache_clear()
+    logger.info(f"Flushed caches: {flushed}")
+    return jsonify({'flushed': flushed})
+
+@app.route('/api/portfolio/cost-basis', methods=['GET'])
+def api_cost_basis():
+    """API endpoint for lot-based cost basis, realized/unrealized P&L and holding periods"""
+    method = request.args.get('method', DEFAULT_COST_BASIS_METHOD).lower()
+    if method not in COST_BASIS_METHODS:
+        return jsonify({'error': f"Unknown method: {method}. Use one of {', '.join(COST_BASIS_METHODS)}"}), 400
+    symbol = request.args.get('symbol')
+    include_lots = request.args.get('lots', 'false').lower() in ('1', 'true', 'yes')
+    include_closed = request.args.get('closed', 'false').lower() in ('1', 'true', 'yes')
+    
+    conn = get_db_connection()
+    try:
+        book = get_lot_book(conn, get_strict_split_index, method)
+        symbols = [symbol.upper()] if symbol else None
+        # Quotes only for positions still held; realized P&L needs no price
+        held = [position['symbol'] for position in book.report(symbols=symbols, open_only=True)['positions']]
+        price_map = get_stock_prices(held) if held else {}
+        prices = {s: data.get('current_price') for s, data in price_map.items() if data}
+        report = book.report(prices, symbols, include_lots, open_only=not include_closed and not symbol)
+        report['data_version'] = get_data_version(conn)
+    finally:
+        conn.close()
+    
+    if symbol and not report['positions']:
+        return jsonify({'error': f"No transactions found for symbol {symbol.upper()}"}), 404
+    return jsonify(report)
+
+@app.route('/api/portfolio/nav', methods=['GET'])
+def api_portfolio_nav():
+    """API endpoint for the portfolio's daily NAV, cash flows and time-weighted returns"""
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'error': 'start and end must be dates in YYYY-MM-DD format'}), 400
+    if start and end and start > end:
+        return jsonify({'error': 'start must not be after end'}), 400
+    
+    conn = get_db_connection()
+    try:
+        result = dict(get_portfolio_nav(conn, start, end))
+        result['data_version'] = get_data_version(conn)
+    finally:
+        conn.close()
+    return jsonify(result)
+
+@app.route('/api/admin/ingest', methods=['GET'])
+def api_admin_ingest():
+    """API endpoint returning the validation report of the most recent CSV upload"""
+    if last_ingest_report is None:
+        return jsonify({'error': 'No upload has been processed since the server started'}), 404
+    return jsonify(last_ingest_report)
+
 # Add route for favicon
 @app.route('/favicon.ico')
 def favicon():
@@ -3806,8 +4173,8 @@ def favicon():
                                'tradelens-logo.svg', mimetype='image/svg+xml')
 
 if __name__ == '__main__':
-    # Make sure the database exists
-    init_db()
+    # Make sure the database exists, keeping transactions merged from earlier uploads
+    init_db(mode=None)
     
     # Initialize or refresh earnings data
     conn = get_db_connection()
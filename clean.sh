@@ -10,6 +10,10 @@ pkill -f "flask run"
 echo "Removing database..."
 rm -f stock_transactions.db
 
+# Remove transactions snapshots, which belong to the removed database
+echo "Removing transactions snapshots..."
+rm -rf "${TRANSACTIONS_SNAPSHOT_DIR:-snapshots}"
+
 # Remove Python cache files
 echo "Removing Python cache files..."
 find . -type d -name "__pycache__" -exec rm -r {} +
@@ -1,38 +1,21 @@
 import sqlite3
-import csv
-from datetime import datetime
-import uuid
 
-def safe_float(value):
-    """Safely convert a value to float, handling null values and invalid formats"""
-    if not value or str(value).lower() == 'null':
-        return None
-    try:
-        return float(value)
-    except (ValueError, TypeError):
-        return None
+from utils.data_version import init_data_versions
+from utils.ingest import ingest_csv
+from utils.positions import init_positions
+from utils.schema import create_transactions_table, migrate
 
 def init_db():
     # Connect to SQLite database (creates it if it doesn't exist)
     conn = sqlite3.connect('stock_transactions.db')
     cursor = conn.cursor()
     
-    # Create transactions table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS transactions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        Date DATE,
-        Time TEXT,
-        Symbol TEXT,
-        Name TEXT,
-        Type TEXT,
-        Side TEXT,
-        AveragePrice REAL,
-        Qty REAL,
-        State TEXT,
-        Fees REAL
-    )
-    ''')
+    # Convert an existing transactions table to the canonical schema in place,
+    # or create it (typed columns, Timestamp and indexes) for a new database
+    migrate(conn)
+    create_transactions_table(conn)
+    init_positions(conn)
+    init_data_versions(conn)
     
     # Create thesis_jobs table if it doesn't exist
     cursor.execute('''
@@ -97,33 +80,8 @@ def init_db():
     cursor.execute('SELECT COUNT(*) FROM transactions')
     if cursor.fetchone()[0] == 0:
         try:
-            with open('stock_orders.csv', 'r') as file:
-                csv_reader = csv.DictReader(file)
-                for row in csv_reader:
-                    try:
-                        # Convert date string to SQLite date format
-                        date_obj = datetime.strptime(row['Date'], '%m/%d/%Y')
-                        date_str = date_obj.strftime('%Y-%m-%d')
-                        
-                        cursor.execute('''
-                        INSERT INTO transactions (Date, Time, Symbol, Name, Type, Side, AveragePrice, Qty, State, Fees)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (
-                            date_str,
-                            row['Time'],
-                            row['Symbol'],
-                            row['Name'],
-                            row['Type'],
-                            row['Side'],
-                            safe_float(row['AveragePrice']),
-                            safe_float(row['Qty']),
-                            row['State'],
-                            safe_float(row['Fees'])
-                        ))
-                    except Exception as e:
-                        print(f"Error processing row: {row}")
-                        print(f"Error: {e}")
-                        continue
+            report = ingest_csv(conn, 'stock_orders.csv')
+            print(report.summary())
         except FileNotFoundError:
             print("No CSV file found. Created empty database.")
     else:
@@ -296,93 +296,167 @@ document.addEventListener('DOMContentLoaded', function() {
         // Get current stock symbol if available
         currentStock = document.getElementById('current-stock')?.value || null;
         
-        // Set a timeout for the API call
-        const timeoutPromise = new Promise((_, reject) => {
-            setTimeout(() => reject(new Error('Request timeout')), 60000); // 60 seconds timeout
-        });
+        // Abort the stream if no data arrives for 60 seconds
+        const idleTimeoutMs = 60000;
         
-        // Create the fetch promise
-        const fetchPromise = fetch('/api/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                message: message,
-                stock: currentStock
-            }),
-        });
-        
-        // Race between fetch and timeout with retry functionality
+        // Retry functionality for network errors
         let retryCount = 0;
         const maxRetries = 2;
         
-        function attemptFetch() {
-            // Race between fetch and timeout
-            Promise.race([fetchPromise, timeoutPromise])
+        function formatResponse(text) {
+            if (typeof marked !== 'undefined') {
+                // Parse markdown using marked library
+                return marked.parse(text);
+            }
+            // Fallback to basic formatting if marked isn't available
+            return text
+                .replace(/\n\n/g, '<br><br>')
+                .replace(/\n/g, '<br>')
+                .replace(/(https?:\/\/[^\s]+)/g, '<a href="$1" target="_blank">$1</a>');
+        }
+        
+        // POST to the streaming endpoint and render tokens as they arrive over Server-Sent Events
+        function streamResponse() {
+            const controller = new AbortController();
+            let idleTimer = null;
+            let timedOut = false;
+            let messageContent = null;
+            let text = '';
+            let meta = null;
+            
+            const resetIdleTimer = () => {
+                clearTimeout(idleTimer);
+                idleTimer = setTimeout(() => {
+                    timedOut = true;
+                    controller.abort();
+                }, idleTimeoutMs);
+            };
+            
+            const handleEvent = (event, data) => {
+                if (event === 'token') {
+                    if (!messageContent) {
+                        // Replace the typing indicator with the message on the first token
+                        if (typingIndicator.parentNode) {
+                            chatBotMessages.removeChild(typingIndicator);
+                        }
+                        const messageElement = document.createElement('div');
+                        messageElement.classList.add('chat-bot-message', 'bot');
+                        messageContent = document.createElement('div');
+                        messageContent.classList.add('chat-bot-message-content');
+                        messageElement.appendChild(messageContent);
+                        chatBotMessages.appendChild(messageElement);
+                    }
+                    text += data.text;
+                    messageContent.innerHTML = formatResponse(text);
+                    chatBotMessages.scrollTop = chatBotMessages.scrollHeight;
+                } else if (event === 'done') {
+                    meta = data;
+                } else if (event === 'error') {
+                    throw new Error(`Server error: ${data.error}`);
+                }
+            };
+            
+            resetIdleTimer();
+            return fetch('/api/chat/stream', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream',
+                },
+                body: JSON.stringify({
+                    message: message,
+                    stock: currentStock
+                }),
+                signal: controller.signal,
+            })
                 .then(response => {
+                    if (response.status === 429 || response.status === 503) {
+                        // The server turned the request away because it is at capacity
+                        const busyError = new Error('Server busy');
+                        busyError.retryAfter = parseInt(response.headers.get('Retry-After'), 10) || null;
+                        throw busyError;
+                    }
                     if (!response.ok) {
                         // Handle HTTP error responses (400-599)
                         let errorMessage = `Server error: ${response.status}`;
                         console.error(errorMessage);
                         throw new Error(errorMessage);
                     }
-                    return response.json();
-                })
-                .then(data => {
-                    // Remove typing indicator
-                    chatBotMessages.removeChild(typingIndicator);
                     
-                    // Check if error was returned from server
-                    if (data.error) {
-                        throw new Error(`Server error: ${data.error}`);
-                    }
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = '';
                     
-                    // Add response to chat
-                    if (data.response) {
-                        // Check if marked library is available
-                        let formattedResponse;
-                        if (typeof marked !== 'undefined') {
-                            // Parse markdown using marked library
-                            formattedResponse = marked.parse(data.response);
-                        } else {
-                            // Fallback to basic formatting if marked isn't available
-                            formattedResponse = data.response
-                                .replace(/\n\n/g, '<br><br>')
-                                .replace(/\n/g, '<br>')
-                                .replace(/(https?:\/\/[^\s]+)/g, '<a href="$1" target="_blank">$1</a>');
+                    const read = () => reader.read().then(({ done, value }) => {
+                        resetIdleTimer();
+                        if (done) {
+                            return;
                         }
+                        buffer += decoder.decode(value, { stream: true });
                         
-                        // Create formatted response element
-                        const messageElement = document.createElement('div');
-                        messageElement.classList.add('chat-bot-message', 'bot');
-                        
-                        const messageContent = document.createElement('div');
-                        messageContent.classList.add('chat-bot-message-content');
-                        messageContent.innerHTML = formattedResponse;
-                        
-                        // Add model info if available
-                        if (data.model || data.provider) {
-                            const modelInfoElement = document.createElement('div');
-                            modelInfoElement.classList.add('model-info');
-                            
-                            let modelText = '';
-                            if (data.provider) {
-                                modelText += data.provider;
+                        // Frames are separated by a blank line
+                        let boundary;
+                        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                            const frame = buffer.slice(0, boundary);
+                            buffer = buffer.slice(boundary + 2);
+                            let event = 'message';
+                            let data = '';
+                            frame.split('\n').forEach(line => {
+                                if (line.startsWith('event:')) {
+                                    event = line.slice(6).trim();
+                                } else if (line.startsWith('data:')) {
+                                    data += line.slice(5).trim();
+                                }
+                            });
+                            if (data) {
+                                handleEvent(event, JSON.parse(data));
                             }
-                            if (data.model) {
-                                if (modelText) modelText += ' - ';
-                                modelText += data.model;
-                            }
-                            
-                            modelInfoElement.textContent = modelText;
-                            messageContent.appendChild(modelInfoElement);
                         }
-                        
-                        messageElement.appendChild(messageContent);
-                        chatBotMessages.appendChild(messageElement);
-                    } else {
+                        return read();
+                    });
+                    return read();
+                })
+                .then(() => ({ text, meta, messageContent }))
+                .catch(error => {
+                    if (timedOut) {
+                        error = new Error('Request timeout');
+                    }
+                    // Part of the answer is on screen already; don't retry it
+                    error.partial = messageContent !== null;
+                    throw error;
+                })
+                .finally(() => clearTimeout(idleTimer));
+        }
+        
+        function attemptFetch() {
+            streamResponse()
+                .then(({ text, meta, messageContent }) => {
+                    // Remove typing indicator
+                    if (typingIndicator.parentNode) {
+                        chatBotMessages.removeChild(typingIndicator);
+                    }
+                    
+                    if (!messageContent || !text) {
                         addMessage('bot', 'Sorry, I couldn\'t process your request.');
+                    } else if (meta && (meta.model || meta.provider)) {
+                        // Add model info from the final metadata frame
+                        const modelInfoElement = document.createElement('div');
+                        modelInfoElement.classList.add('model-info');
+                        
+                        let modelText = '';
+                        if (meta.provider) {
+                            modelText += meta.provider;
+                        }
+                        if (meta.model) {
+                            if (modelText) modelText += ' - ';
+                            modelText += meta.model;
+                        }
+                        if (meta.cached) {
+                            modelText += ' (cached)';
+                        }
+                        
+                        modelInfoElement.textContent = modelText;
+                        messageContent.appendChild(modelInfoElement);
                     }
                     
                     // Scroll to bottom
@@ -397,7 +471,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     console.error('Error sending message to API:', error);
                     
                     // Check if we should retry
-                    if (retryCount < maxRetries && 
+                    if (retryCount < maxRetries && !error.partial &&
                         (error.message.includes('Failed to fetch') || 
                          error.message.includes('NetworkError') || 
                          error.message.includes('ERR_EMPTY_RESPONSE'))) {
@@ -442,6 +516,12 @@ document.addEventListener('DOMContentLoaded', function() {
                         
                         // Add retry button for network errors
                         errorText += '<div class="retry-container"><button class="retry-button">Retry</button></div>';
+                    } else if (error.message === 'Server busy') {
+                        errorText += 'The assistant is handling too many requests right now. ';
+                        errorText += error.retryAfter ? `Please try again in ${error.retryAfter} seconds.` : 'Please try again in a moment.';
+                        
+                        // Add retry button so the user can try again once the server has capacity
+                        errorText += '<div class="retry-container"><button class="retry-button">Retry</button></div>';
                     } else if (error.message.includes('Server error')) {
                         errorText += 'The server encountered an issue processing your request. Please try a different question or try again later.';
                         
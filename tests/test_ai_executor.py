@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+from utils.ai_executor import AIExecutor, SaturatedError
+
+
+@pytest.fixture
+def executor():
+    executor = AIExecutor(max_workers=4, max_queue=0, provider_limits={'perplexity': 2, 'openai': 1})
+    yield executor
+    executor._pool.shutdown(wait=True)
+
+
+def test_fallback_call_counts_against_its_provider(executor):
+    holding = threading.Event()
+    finish = threading.Event()
+
+    def fall_back():
+        with executor.provider_slot('openai'):
+            holding.set()
+            finish.wait(5)
+
+    first = executor.submit(fall_back, provider='perplexity')
+    assert holding.wait(5)
+    # The only OpenAI slot is taken by the first request's fallback call
+    assert executor.stats()['providers']['openai']['active'] == 1
+    with pytest.raises(SaturatedError):
+        executor.acquire('openai')
+    second = executor.submit(fall_back, provider='perplexity')
+    with pytest.raises(SaturatedError):
+        second.result(5)
+
+    finish.set()
+    first.result(5)
+    assert executor.stats()['providers']['openai']['active'] == 0
+    assert executor.stats()['fallback_calls'] == 1
+
+
+def test_calls_to_the_admitted_provider_take_no_extra_slot(executor):
+    executor.acquire('openai')
+    try:
+        with executor.admitted('openai'):
+            with executor.provider_slot('openai'):
+                assert executor.stats()['providers']['openai']['active'] == 1
+    finally:
+        executor.release('openai')
+    # Outside an admitted request (e.g. background jobs) calls are not limited
+    with executor.provider_slot('openai'):
+        assert executor.stats()['providers']['openai']['active'] == 0
@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+from utils.cost_basis import LotBook
+from utils.data_version import bump_symbol_versions, init_data_versions
+from utils.resilience import ProviderUnavailableError
+from utils.split_index import SplitIndex
+
+SPLIT = SplitIndex([('2024-06-10', 10.0)])
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    init_data_versions(conn)
+    conn.execute('CREATE TABLE positions (symbol TEXT PRIMARY KEY)')
+    conn.execute('CREATE TABLE transactions (Id TEXT, Timestamp TEXT, Symbol TEXT, Side TEXT, '
+                 'Qty REAL, AveragePrice REAL, Fees REAL)')
+    conn.execute("INSERT INTO positions VALUES ('NVDA')")
+    conn.execute("INSERT INTO transactions VALUES ('1', '2024-01-02 10:00:00', 'NVDA', 'buy', 10, 500, 0)")
+    bump_symbol_versions(conn, ['NVDA'])
+    return conn
+
+
+class FlakySplits:
+    """Split lookup that fails until `failures` runs out."""
+
+    def __init__(self, failures: int) -> None:
+        self.failures = failures
+
+    def __call__(self, symbol: str) -> SplitIndex:
+        if self.failures:
+            self.failures -= 1
+            raise ProviderUnavailableError(f"Stock splits for {symbol} unavailable")
+        return SPLIT
+
+
+def test_failed_split_lookup_is_not_cached_unadjusted(conn):
+    book = LotBook('fifo')
+    lookup = FlakySplits(failures=1)
+
+    assert book.refresh(conn, lookup, max_workers=1) == 0
+    report = book.report()
+    assert report['positions'] == []
+    assert report['degraded'] == ['NVDA']
+
+    # Nothing changed in the database, but the symbol is retried
+    assert book.refresh(conn, lookup, max_workers=1) == 1
+    report = book.report()
+    assert report['degraded'] == []
+    assert report['positions'][0]['shares'] == pytest.approx(100.0)
+    assert report['positions'][0]['average_cost'] == pytest.approx(50.0)
+
+
+def test_failed_split_lookup_keeps_existing_ledger(conn):
+    book = LotBook('fifo')
+    book.refresh(conn, lambda symbol: SPLIT, max_workers=1)
+
+    conn.execute("INSERT INTO transactions VALUES ('2', '2024-07-01 10:00:00', 'NVDA', 'sell', 40, 60, 0)")
+    bump_symbol_versions(conn, ['NVDA'])
+    assert book.refresh(conn, FlakySplits(failures=1), max_workers=1) == 0
+    assert book.report()['positions'][0]['shares'] == pytest.approx(100.0)
+    assert book.report()['degraded'] == ['NVDA']
+
+    assert book.refresh(conn, lambda symbol: SPLIT, max_workers=1) == 1
+    position = book.report()['positions'][0]
+    assert position['shares'] == pytest.approx(60.0)
+    assert position['realized_pnl'] == pytest.approx(400.0)
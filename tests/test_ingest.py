@@ -0,0 +1,71 @@
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from utils.data_version import get_data_version, get_database_generation, init_data_versions
+from utils.ingest import (APPEND, KEEP_SNAPSHOTS, ingest_csv, load_transactions_snapshot, snapshot_cache,
+                          write_snapshot)
+from utils.positions import init_positions
+from utils.schema import create_transactions_table, migrate
+
+CSV_HEADER = 'Date,Time,Symbol,Name,Side,Qty,AveragePrice,Fees\n'
+
+
+def new_database(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    migrate(conn)
+    create_transactions_table(conn)
+    init_positions(conn)
+    init_data_versions(conn)
+    conn.commit()
+    return conn
+
+
+def write_csv(path, *rows):
+    with open(path, 'w') as f:
+        f.write(CSV_HEADER + ''.join(f'{row}\n' for row in rows))
+    return str(path)
+
+
+@pytest.fixture
+def snapshot_dir(tmp_path):
+    return str(tmp_path / 'snapshots')
+
+
+def test_recreated_database_does_not_read_old_snapshots(tmp_path, snapshot_dir):
+    conn = new_database(str(tmp_path / 'old.db'))
+    ingest_csv(conn, write_csv(tmp_path / 'old.csv', '01/02/2024,10:00:00,OLD,Old Co,buy,1,10,0'),
+               snapshot_dir=snapshot_dir)
+    assert list(load_transactions_snapshot(conn, snapshot_dir)['Symbol']) == ['OLD']
+    conn.close()
+
+    # Same data version numbers, different database
+    conn = new_database(str(tmp_path / 'new.db'))
+    ingest_csv(conn, write_csv(tmp_path / 'new.csv', '02/01/2024,10:00:00,NEW,New Co,buy,2,20,0'),
+               snapshot_dir=snapshot_dir)
+    assert list(load_transactions_snapshot(conn, snapshot_dir)['Symbol']) == ['NEW']
+
+    for day in range(2, 2 + KEEP_SNAPSHOTS):
+        ingest_csv(conn, write_csv(tmp_path / f'delta{day}.csv', f'02/0{day}/2024,10:00:00,NEW,New Co,buy,1,20,0'),
+                   mode=APPEND, snapshot_dir=snapshot_dir)
+        # Pruning keeps the files just written, not the old database's higher versions
+        assert len(load_transactions_snapshot(conn, snapshot_dir)) == day
+    assert len(os.listdir(snapshot_dir)) == KEEP_SNAPSHOTS
+
+
+def test_append_rebuilds_a_snapshot_that_does_not_match_the_table(tmp_path, snapshot_dir):
+    conn = new_database(str(tmp_path / 'db'))
+    ingest_csv(conn, write_csv(tmp_path / 'full.csv', '01/02/2024,10:00:00,AAPL,Apple,buy,1,10,0'),
+               snapshot_dir=snapshot_dir)
+    frame = load_transactions_snapshot(conn, snapshot_dir)
+    stray = frame.assign(Id='stray', Symbol='OLD')
+    write_snapshot(pd.concat([frame, stray]), get_database_generation(conn), get_data_version(conn), snapshot_dir)
+    snapshot_cache.clear()
+
+    ingest_csv(conn, write_csv(tmp_path / 'delta.csv', '01/03/2024,10:00:00,AAPL,Apple,buy,1,11,0'),
+               mode=APPEND, snapshot_dir=snapshot_dir)
+
+    assert list(load_transactions_snapshot(conn, snapshot_dir)['Symbol']) == ['AAPL', 'AAPL']
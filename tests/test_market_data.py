@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils import market_data
+from utils.market_data import GuardedProvider, MarketDataProvider, endpoint_concurrency, is_transient_error
+from utils.resilience import CircuitBreaker, RateLimitedError
+
+
+class HealthyProvider(MarketDataProvider):
+    name = 'healthy'
+
+    def info(self, symbol):
+        return {'symbol': symbol, 'regularMarketPrice': 1.0}
+
+
+@pytest.fixture
+def fast_budget(monkeypatch):
+    """A small info budget so bursts hit the rate limit quickly."""
+    monkeypatch.setitem(market_data.PROVIDER_BUDGETS, 'info', (40.0, 5))
+    monkeypatch.setattr(market_data, 'RATE_LIMIT_MAX_WAIT', 0.1)
+    return GuardedProvider(HealthyProvider(), {'info': (40.0, 5)})
+
+
+def call_info(provider, symbol):
+    try:
+        provider.info(symbol)
+        return 'ok'
+    except RateLimitedError:
+        return 'rate_limited'
+
+
+def test_rate_limited_error_is_not_transient():
+    assert not is_transient_error(RateLimitedError("healthy info rate limit exceeded"))
+    assert is_transient_error(RuntimeError("429 Too Many Requests"))
+
+
+def test_burst_against_healthy_provider_never_opens_breaker(fast_budget):
+    # More workers than the budget sustains: some calls are refused locally
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda i: call_info(fast_budget, f"S{i}"), range(60)))
+
+    assert 'rate_limited' in results
+    stats = fast_budget.breaker.stats()
+    assert stats['state'] == CircuitBreaker.CLOSED
+    assert stats['total_failures'] == 0
+    assert stats['short_circuited'] == 0
+
+
+def test_pool_sized_to_budget_is_never_refused(fast_budget):
+    with ThreadPoolExecutor(max_workers=endpoint_concurrency('info')) as executor:
+        results = list(executor.map(lambda i: call_info(fast_budget, f"S{i}"), range(60)))
+
+    assert results == ['ok'] * 60
+    assert fast_budget.breaker.stats()['total_failures'] == 0
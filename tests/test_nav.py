@@ -0,0 +1,85 @@
+import sqlite3
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.market_data import SPLIT_CLOSE, adjust_for_dividends
+from utils.nav import build_nav
+from utils.price_store import get_daily_bars, init_price_store
+from utils.resilience import ProviderUnavailableError
+from utils.split_index import SplitIndex
+
+DAYS = pd.bdate_range('2024-01-02', '2024-01-12')
+
+
+def raw_bars():
+    """Flat $100 split-adjusted closes for a stock that paid a $2 dividend on 2024-01-08."""
+    close = np.full(len(DAYS), 100.0)
+    # Yahoo's Adj Close scales everything before the ex-date by (1 - 2/100)
+    adj_close = np.where(DAYS < pd.Timestamp('2024-01-08'), 98.0, 100.0)
+    return pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close,
+                         'Adj Close': adj_close, 'Volume': 1000.0}, index=DAYS)
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    init_price_store(conn)
+    return conn
+
+
+def test_adjust_for_dividends_keeps_split_only_close():
+    bars = adjust_for_dividends(raw_bars())
+
+    assert bars.loc['2024-01-03', 'Close'] == pytest.approx(98.0)
+    assert bars.loc['2024-01-03', SPLIT_CLOSE] == pytest.approx(100.0)
+    assert bars.loc['2024-01-10', 'Close'] == pytest.approx(100.0)
+
+
+def test_nav_of_dividend_payer_has_no_phantom_returns(conn):
+    get_daily_bars(conn, 'DIV', DAYS[0].date(), date(2024, 1, 13),
+                   lambda symbol, start, end: adjust_for_dividends(raw_bars()))
+    transactions = pd.DataFrame({
+        'Symbol': ['DIV', 'DIV'],
+        'Date': pd.to_datetime(['2024-01-03', '2024-01-10']),
+        'Side': ['buy', 'sell'],
+        'Qty': [10.0, 4.0],
+        'AveragePrice': [100.0, 100.0],
+        'Fees': [0.0, 0.0],
+    })
+
+    nav = build_nav(conn, transactions, lambda symbol: SplitIndex([]),
+                    end=date(2024, 1, 12))
+
+    # Bought and sold at the close of a flat stock: no gain or loss on any day
+    assert nav['daily_return'] == pytest.approx([0.0] * len(nav['dates']))
+    assert nav['summary']['twr'] == pytest.approx(0.0)
+    assert nav['summary']['pnl'] == pytest.approx(0.0)
+    assert nav['nav'][-1] == pytest.approx(600.0)
+
+
+def test_nav_leaves_out_symbols_whose_splits_are_unavailable(conn):
+    get_daily_bars(conn, 'DIV', DAYS[0].date(), date(2024, 1, 13),
+                   lambda symbol, start, end: adjust_for_dividends(raw_bars()))
+    transactions = pd.DataFrame({
+        'Symbol': ['DIV', 'SPL'],
+        'Date': pd.to_datetime(['2024-01-03', '2024-01-03']),
+        'Side': ['buy', 'buy'],
+        'Qty': [10.0, 1.0],
+        'AveragePrice': [100.0, 400.0],
+        'Fees': [0.0, 0.0],
+    })
+
+    def split_index_for(symbol):
+        if symbol == 'SPL':
+            raise ProviderUnavailableError('Stock splits for SPL unavailable')
+        return SplitIndex([])
+
+    nav = build_nav(conn, transactions, split_index_for, end=date(2024, 1, 12), max_workers=2)
+
+    assert nav['degraded'] == ['SPL']
+    assert nav['summary']['symbols'] == 1
+    assert nav['nav'][-1] == pytest.approx(1000.0)
@@ -0,0 +1,70 @@
+import sqlite3
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.market_data import adjust_for_dividends
+from utils.price_store import get_daily_bars, init_price_store, read_close_matrix
+
+DAYS = pd.bdate_range('2024-01-02', '2024-01-19')
+EX_DATE = pd.Timestamp('2024-01-16')
+
+
+def raw_bars(dividend_known):
+    """Flat $100 closes; a $2 dividend goes ex on 2024-01-16 once the provider knows of it."""
+    close = np.full(len(DAYS), 100.0)
+    dividends = np.where(DAYS == EX_DATE, 2.0, 0.0) if dividend_known else np.zeros(len(DAYS))
+    adj_close = np.where(DAYS < EX_DATE, 98.0, 100.0) if dividend_known else close
+    return pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close,
+                         'Adj Close': adj_close, 'Volume': 1000.0, 'Dividends': dividends}, index=DAYS)
+
+
+class Fetcher:
+    def __init__(self):
+        self.dividend_known = False
+        self.empty = False
+        self.calls = []
+
+    def __call__(self, symbol, start, end):
+        self.calls.append((start, end))
+        if self.empty:
+            return pd.DataFrame()
+        raw = raw_bars(self.dividend_known)
+        return adjust_for_dividends(raw[(raw.index >= pd.Timestamp(start)) & (raw.index < pd.Timestamp(end))])
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    init_price_store(conn)
+    return conn
+
+
+def test_new_dividend_rescales_bars_stored_before_it(conn):
+    fetch = Fetcher()
+    get_daily_bars(conn, 'DIV', date(2024, 1, 2), date(2024, 1, 9), fetch)
+
+    fetch.dividend_known = True
+    bars = get_daily_bars(conn, 'DIV', date(2024, 1, 2), date(2024, 1, 20), fetch)
+
+    # No seam where the segments meet: every bar before the ex-date carries the new factor
+    assert bars.loc[bars.index < EX_DATE, 'Close'].tolist() == pytest.approx([98.0] * 10)
+    assert bars.loc[bars.index >= EX_DATE, 'Close'].tolist() == pytest.approx([100.0] * 4)
+    # Holdings are still valued at split-only closes
+    closes = read_close_matrix(conn, {'DIV': (date(2024, 1, 2), date(2024, 1, 20))})
+    assert closes['DIV'].tolist() == pytest.approx([100.0] * len(DAYS))
+
+
+def test_empty_answer_does_not_mark_the_window_covered(conn):
+    fetch = Fetcher()
+    get_daily_bars(conn, 'DIV', date(2024, 1, 2), date(2024, 1, 9), fetch)
+
+    fetch.empty = True
+    assert len(get_daily_bars(conn, 'DIV', date(2024, 1, 2), date(2024, 1, 20), fetch)) == 5
+
+    fetch.empty = False
+    assert len(get_daily_bars(conn, 'DIV', date(2024, 1, 2), date(2024, 1, 20), fetch)) == len(DAYS)
+    # The tail was asked for again, starting from the last stored bar
+    assert fetch.calls[-1][0] == date(2024, 1, 8)
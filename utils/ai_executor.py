@@ -0,0 +1,265 @@
+import os
+import math
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Process-wide limits for AI calls: worker threads, requests waiting for one,
+# and requests in flight per provider
+MAX_WORKERS = int(os.getenv('AI_MAX_WORKERS', '8'))
+MAX_QUEUE = int(os.getenv('AI_MAX_QUEUE', '16'))
+PROVIDER_LIMITS = {
+    'perplexity': int(os.getenv('AI_PERPLEXITY_CONCURRENCY', '6')),
+    'openai': int(os.getenv('AI_OPENAI_CONCURRENCY', '6')),
+}
+
+INITIAL_DURATION = 5.0   # Seconds assumed per request before any has finished
+DURATION_SMOOTHING = 0.2  # Weight of the latest request in the average duration
+
+
+class SaturatedError(RuntimeError):
+    """
+    Raised instead of queueing a request when the pool or a provider is at
+    capacity. `status` is 503 when the whole pool is saturated and 429 when
+    one provider is; `retry_after` is a suggested wait in seconds.
+    """
+
+    def __init__(self, message: str, status: int, retry_after: int) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CancelledTaskError(RuntimeError):
+    """Raised inside a task whose request was cancelled or ran past its deadline."""
+
+
+class CancelToken:
+    """Cancellation flag and optional deadline shared between a request and its task."""
+
+    def __init__(self, timeout: Optional[float] = None) -> None:
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or (self.deadline is not None and time.monotonic() >= self.deadline)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, or None without one."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self) -> None:
+        """Raise CancelledTaskError if the task should stop."""
+        if self.cancelled:
+            raise CancelledTaskError('Request was cancelled or timed out')
+
+
+_local = threading.local()
+
+
+def current_cancel_token() -> Optional[CancelToken]:
+    """The CancelToken of the task running on this thread, if any."""
+    return getattr(_local, 'token', None)
+
+
+class AIExecutor:
+    """
+    Bounded worker pool shared by every AI request in the process.
+
+    Admission is decided up front: a request is rejected with SaturatedError
+    rather than queued when `max_workers + max_queue` requests are already
+    pending, or when its provider has `provider_limits[provider]` requests in
+    flight. A request that falls back to another provider takes a slot of
+    that provider for the call too (see provider_slot()). Each task gets a
+    CancelToken with the request's deadline, so a timed-out request stops at
+    its next check (and provider calls are given only the time that is left)
+    instead of holding a worker.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_queue: int = MAX_QUEUE,
+                 provider_limits: Optional[Dict[str, int]] = None) -> None:
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.provider_limits = dict(PROVIDER_LIMITS if provider_limits is None else provider_limits)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._active: Dict[str, int] = {}
+        self._average_duration = INITIAL_DURATION
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rejected_provider = 0
+        self.fallback_calls = 0
+        self.cancelled_queued = 0
+        self.cancelled_running = 0
+
+    def _retry_after(self) -> int:
+        # Time for the requests ahead to drain through the workers
+        waves = max(1, self._pending - self.max_workers + 1) / self.max_workers
+        return max(1, math.ceil(self._average_duration * max(1.0, waves)))
+
+    def acquire(self, provider: Optional[str] = None) -> None:
+        """
+        Reserve capacity for one request, e.g. a stream served on the request
+        thread. Pair with release().
+
+        Raises:
+            SaturatedError: If the pool or the provider is at capacity
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise SaturatedError('AI request queue is full', 503, self._retry_after())
+            limit = self.provider_limits.get(provider)
+            if limit is not None and self._active.get(provider, 0) >= limit:
+                self.rejected_provider += 1
+                raise SaturatedError(f"Too many concurrent {provider} requests", 429, self._retry_after())
+            self._pending += 1
+            if provider is not None:
+                self._active[provider] = self._active.get(provider, 0) + 1
+            self.submitted += 1
+
+    def release(self, provider: Optional[str] = None, duration: Optional[float] = None) -> None:
+        """Return capacity reserved by acquire(), recording how long the request ran."""
+        with self._lock:
+            self._pending -= 1
+            if provider is not None:
+                self._active[provider] -= 1
+            if duration is not None:
+                self.completed += 1
+                self._average_duration += DURATION_SMOOTHING * (duration - self._average_duration)
+
+    @contextmanager
+    def admitted(self, provider: Optional[str]) -> Iterator[None]:
+        """
+        Mark the current thread as serving a request admitted under
+        `provider` with acquire(), e.g. a stream served on the request thread.
+        Tasks run by submit() are marked automatically.
+        """
+        previous = getattr(_local, 'admission', None)
+        _local.admission = (provider,)
+        try:
+            yield
+        finally:
+            _local.admission = previous
+
+    @contextmanager
+    def provider_slot(self, provider: str) -> Iterator[None]:
+        """
+        Hold a slot of `provider` for one call made by the admitted request on
+        this thread, unless it was admitted under that provider already. Calls
+        outside an admitted request (e.g. background jobs) are not limited.
+
+        Raises:
+            SaturatedError: If the provider is at capacity; the call should be
+                skipped like a failed one
+        """
+        admission = getattr(_local, 'admission', None)
+        if admission is None or admission[0] == provider:
+            yield
+            return
+        with self._lock:
+            limit = self.provider_limits.get(provider)
+            if limit is not None and self._active.get(provider, 0) >= limit:
+                self.rejected_provider += 1
+                raise SaturatedError(f"Too many concurrent {provider} requests", 429, self._retry_after())
+            self._active[provider] = self._active.get(provider, 0) + 1
+            self.fallback_calls += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active[provider] -= 1
+
+    def submit(self, fn: Callable[..., Any], *args: Any, provider: Optional[str] = None,
+               timeout: Optional[float] = None, **kwargs: Any) -> Future:
+        """
+        Run `fn(*args, **kwargs)` on the pool.
+
+        Args:
+            fn: Function to run
+            provider: Provider the request will call, for the per-provider cap
+            timeout: Seconds until the task's CancelToken expires
+
+        Returns:
+            Future with a `cancel_token` attribute; pass it to cancel() on timeout
+
+        Raises:
+            SaturatedError: If the pool or the provider is at capacity
+        """
+        self.acquire(provider)
+        token = CancelToken(timeout)
+        started = []
+
+        def run() -> Any:
+            token.check()
+            started.append(time.monotonic())
+            with self._lock:
+                self._running += 1
+            _local.token = token
+            _local.admission = (provider,)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _local.token = None
+                _local.admission = None
+                with self._lock:
+                    self._running -= 1
+
+        def done(future: Future) -> None:
+            self.release(provider, time.monotonic() - started[0] if started else None)
+
+        try:
+            future = self._pool.submit(run)
+        except Exception:
+            self.release(provider)
+            raise
+        future.cancel_token = token
+        future.add_done_callback(done)
+        return future
+
+    def cancel(self, future: Future) -> None:
+        """Cancel a request: drop it if still queued, otherwise signal its CancelToken."""
+        future.cancel_token.cancel()
+        cancelled = future.cancel()
+        with self._lock:
+            if cancelled:
+                self.cancelled_queued += 1
+            elif not future.done():
+                self.cancelled_running += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'pending': self._pending,
+                'running': self._running,
+                'providers': {provider: {'active': self._active.get(provider, 0), 'limit': limit}
+                              for provider, limit in self.provider_limits.items()},
+                'average_duration': round(self._average_duration, 3),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'rejected_provider': self.rejected_provider,
+                'fallback_calls': self.fallback_calls,
+                'cancelled_queued': self.cancelled_queued,
+                'cancelled_running': self.cancelled_running,
+            }
+
+
+# Process-wide pool shared by the chat endpoints
+ai_executor = AIExecutor()
@@ -0,0 +1,257 @@
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Every BoundedCache registers itself here so it can be inspected and flushed
+_registry: Dict[str, 'BoundedCache'] = {}
+_registry_lock = threading.Lock()
+
+
+def estimate_size(value: Any, _seen: Optional[set] = None) -> int:
+    """
+    Roughly estimate the memory held by a cached value, in bytes.
+
+    Containers are walked recursively; numpy arrays and pandas objects report
+    their buffer sizes. Shared objects are only counted once.
+
+    Args:
+        value: Object to measure
+
+    Returns:
+        Approximate size in bytes
+    """
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+
+    if hasattr(value, 'memory_usage') and hasattr(value, 'index'):
+        # pandas DataFrame/Series
+        usage = value.memory_usage(index=True)
+        return int(usage.sum() if hasattr(usage, 'sum') else usage)
+    if hasattr(value, 'nbytes') and hasattr(value, 'dtype'):
+        # numpy array or scalar
+        return int(value.nbytes) + 96
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, _seen) + estimate_size(v, _seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _seen) for item in value)
+    elif hasattr(value, '__dict__'):
+        size += estimate_size(vars(value), _seen)
+    return size
+
+
+class _Entry:
+    __slots__ = ('value', 'size', 'fresh_until', 'expires_at')
+
+    def __init__(self, value: Any, size: int, fresh_until: Optional[float], expires_at: Optional[float]) -> None:
+        self.value = value
+        self.size = size
+        self.fresh_until = fresh_until
+        self.expires_at = expires_at
+
+
+class BoundedCache:
+    """
+    Thread-safe in-memory cache with LRU eviction, an optional TTL and a
+    max-bytes budget.
+
+    Entries are evicted least-recently-used first whenever the estimated size
+    of the cache exceeds `max_bytes` (or the entry count exceeds
+    `max_entries`). Expired entries are dropped when they are next read.
+    Hit, miss, eviction and expiration counters are kept per cache.
+
+    With `stale_ttl`, entries are kept that much longer after they expire so
+    `get_stale()` can serve them while their source is unavailable.
+    """
+
+    def __init__(self, name: str, max_bytes: int, ttl: Optional[float] = None,
+                 max_entries: Optional[int] = None, stale_ttl: float = 0) -> None:
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._data: 'OrderedDict[Hashable, _Entry]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejected = 0
+        self.stale_hits = 0
+
+        with _registry_lock:
+            _registry[name] = self
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get a cached value and mark it as recently used.
+
+        Args:
+            key: Cache key
+            default: Returned when the key is missing or expired
+
+        Returns:
+            The cached value, or default
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            now = time.time()
+            if entry.expires_at is not None and entry.expires_at <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            if entry.fresh_until is not None and entry.fresh_until <= now:
+                # Past its TTL but kept for get_stale()
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def get_stale(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get a value even if it is past its TTL, as long as it is still within
+        the stale grace period. Used as a fallback when a refresh fails.
+
+        Args:
+            key: Cache key
+            default: Returned when the key is missing or past the grace period
+
+        Returns:
+            The cached value, or default
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry.expires_at is not None and entry.expires_at <= time.time()):
+                return default
+            self.stale_hits += 1
+            return entry.value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Store a value, evicting least-recently-used entries to stay within budget.
+
+        Args:
+            key: Cache key
+            value: Value to cache
+            ttl: Seconds until the entry expires (defaults to the cache's TTL)
+        """
+        size = estimate_size(key) + estimate_size(value)
+        ttl = self.ttl if ttl is None else ttl
+        fresh_until = time.time() + ttl if ttl is not None else None
+        expires_at = fresh_until + self.stale_ttl if fresh_until is not None else None
+
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if size > self.max_bytes:
+                # A single value larger than the whole budget is not cached
+                self.rejected += 1
+                logger.warning(f"Cache {self.name}: value of {size} bytes exceeds budget of {self.max_bytes}")
+                return
+            self._data[key] = _Entry(value, size, fresh_until, expires_at)
+            self._bytes += size
+            while self._data and (self._bytes > self.max_bytes or
+                                  (self.max_entries is not None and len(self._data) > self.max_entries)):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove a key and return its value (or default if it was not cached)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            self._remove(key)
+            return entry.value
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+
+    def purge_expired(self) -> int:
+        """Drop every expired entry and return how many were removed."""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._data.items()
+                       if entry.expires_at is not None and entry.expires_at <= now]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    def clear(self) -> int:
+        """Remove every entry and return how many were removed."""
+        with self._lock:
+            count = len(self._data)
+            self._data.clear()
+            self._bytes = 0
+        return count
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size, budget and counters for this cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'stale_ttl': self.stale_ttl,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'rejected': self.rejected
+            }
+
+
+def cache_stats() -> List[Dict[str, Any]]:
+    """Return stats for every registered cache, sorted by name."""
+    with _registry_lock:
+        caches = sorted(_registry.values(), key=lambda cache: cache.name)
+    return [cache.stats() for cache in caches]
+
+
+def flush_caches(name: Optional[str] = None) -> Dict[str, int]:
+    """
+    Clear one registered cache, or all of them.
+
+    Args:
+        name: Cache name, or None for every cache
+
+    Returns:
+        Dictionary mapping each flushed cache name to the number of entries removed
+
+    Raises:
+        KeyError: If no cache with that name is registered
+    """
+    with _registry_lock:
+        if name is None:
+            caches = list(_registry.values())
+        else:
+            caches = [_registry[name]]
+    return {cache.name: cache.clear() for cache in caches}
@@ -0,0 +1,227 @@
+import logging
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from utils.cache import BoundedCache
+from utils.data_version import get_data_version, get_symbol_version
+from utils.pagination import transaction_summary
+from utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+MEMORY_BUDGET = 4 * 1024 * 1024  # Bytes of snippets kept in memory
+RECENT_PORTFOLIO_TRANSACTIONS = 10
+RECENT_SYMBOL_TRANSACTIONS = 20
+
+RiskAnalyzer = Callable[[Optional[str]], Dict[str, Any]]
+
+
+def format_transaction(row) -> str:
+    """One transaction as a prompt line, e.g. '- 2024-01-02 AAPL BUY 10.0 shares at $150.00'."""
+    price = row['AveragePrice']
+    price_text = f"{price:.2f}" if isinstance(price, (int, float)) else f"{price}"
+    return f"- {row['Date']} {row['Symbol']} {(row['Side'] or '').upper()} {row['Qty']} shares at ${price_text}"
+
+
+class ChatContextBuilder:
+    """
+    Precomputed text snippets describing the portfolio for AI prompts.
+
+    Each snippet is built once from aggregate queries and cached under the
+    data version it was built from: portfolio-wide snippets under the
+    transactions version, per-symbol snippets under that symbol's version,
+    so an upload only rebuilds what it touched. Assembling a prompt then
+    costs a version lookup and a few dictionary reads. Live data such as
+    the current quote is left to the caller.
+    """
+
+    def __init__(self, memory_budget: int = MEMORY_BUDGET) -> None:
+        self._cache = BoundedCache('chat_context', max_bytes=memory_budget)
+        self._flight = SingleFlight()
+        self.builds = 0
+
+    def _get(self, key: Hashable, build: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        snippet = self._cache.get(key)
+        if snippet is None:
+            # Concurrent chat turns after an upload share one build
+            snippet = self._flight.do(key, build)
+            self._cache.set(key, snippet)
+        return snippet
+
+    def _counted(self, build: Callable[[], Dict[str, Any]]) -> Callable[[], Dict[str, Any]]:
+        def run() -> Dict[str, Any]:
+            self.builds += 1
+            return build()
+        return run
+
+    def portfolio(self, conn) -> Dict[str, Any]:
+        """
+        Portfolio-wide snippet.
+
+        Args:
+            conn: Open SQLite connection
+
+        Returns:
+            Dictionary with total_transactions, symbols (most traded first),
+            symbol_lines ('AAPL (12)': symbol and number of trades, same
+            order), data_version, summary (the counts alone) and text
+            (the counts and the ten most traded symbols)
+        """
+        version = get_data_version(conn)
+
+        def build() -> Dict[str, Any]:
+            rows = conn.execute(
+                'SELECT Symbol, COUNT(*) AS trades FROM transactions GROUP BY Symbol ORDER BY trades DESC, Symbol'
+            ).fetchall()
+            symbols = [row['Symbol'] for row in rows]
+            total = sum(row['trades'] for row in rows)
+            summary = f"The user has {total} total stock transactions in {len(symbols)} stocks in their portfolio."
+            return {
+                'total_transactions': total,
+                'symbols': symbols,
+                'symbol_lines': [f"{row['Symbol']} ({row['trades']})" for row in rows],
+                'data_version': version,
+                'summary': summary,
+                'text': f"{summary}\nTheir portfolio includes stocks like: {', '.join(symbols[:10])}",
+            }
+
+        return self._get(('portfolio', version), self._counted(build))
+
+    def symbol(self, conn, symbol: str) -> Dict[str, Any]:
+        """
+        Snippet with the user's history in one symbol: average buy and sell
+        prices, first and most recent trade and share totals.
+
+        Args:
+            conn: Open SQLite connection
+            symbol: Stock symbol
+
+        Returns:
+            Dictionary with symbol, summary (see transaction_summary()),
+            avg_buy_price, avg_sell_price, net_shares, version and text
+        """
+        version = get_symbol_version(conn, symbol)
+
+        def build() -> Dict[str, Any]:
+            summary = transaction_summary(conn, ['Symbol = ?'], [symbol])
+            stats = summary['stats']
+            avg_buy = stats['total_amount_bought'] / stats['total_stocks_bought'] if stats['total_stocks_bought'] > 0 else 0
+            avg_sell = stats['total_amount_sold'] / stats['total_stocks_sold'] if stats['total_stocks_sold'] > 0 else 0
+            net_shares = round(stats['total_stocks_bought'] - stats['total_stocks_sold'], 2)
+            return {
+                'symbol': symbol,
+                'summary': summary,
+                'avg_buy_price': avg_buy,
+                'avg_sell_price': avg_sell,
+                'net_shares': net_shares,
+                'version': version,
+                'text': (f"- User's average buy price: ${avg_buy:.2f}\n"
+                         f"- User's average sell price: ${avg_sell:.2f}\n"
+                         f"- First transaction: {summary['first_date']}\n"
+                         f"- Most recent transaction: {summary['last_date']}\n"
+                         f"- Total shares bought: {stats['total_stocks_bought']}\n"
+                         f"- Total shares sold: {stats['total_stocks_sold']}\n"
+                         f"- Net shares: {net_shares}"),
+            }
+
+        return self._get(('symbol', symbol, version), self._counted(build))
+
+    def recent_transactions(self, conn, symbol: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Snippet listing the latest transactions in one symbol, or across the portfolio.
+
+        Args:
+            conn: Open SQLite connection
+            symbol: Stock symbol, or None for the whole portfolio
+
+        Returns:
+            Dictionary with count, lines (newest first), symbols (one per
+            line), summary (a one-line aggregate) and text; the texts are
+            '' when there are none
+        """
+        version = get_data_version(conn) if symbol is None else get_symbol_version(conn, symbol)
+
+        def build() -> Dict[str, Any]:
+            if symbol is None:
+                rows = conn.execute('SELECT Date, Symbol, Side, Qty, AveragePrice FROM transactions '
+                                    'ORDER BY Timestamp DESC, Id DESC LIMIT ?',
+                                    (RECENT_PORTFOLIO_TRANSACTIONS,)).fetchall()
+            else:
+                rows = conn.execute('SELECT Date, Symbol, Side, Qty, AveragePrice FROM transactions '
+                                    'WHERE Symbol = ? ORDER BY Timestamp DESC, Id DESC LIMIT ?',
+                                    (symbol, RECENT_SYMBOL_TRANSACTIONS)).fetchall()
+            lines = [format_transaction(row) for row in rows]
+            buys = sum(1 for row in rows if (row['Side'] or '').lower() == 'buy')
+            summary = ''
+            if rows:
+                summary = (f"Recent transactions: {len(rows)} between {rows[-1]['Date']} and {rows[0]['Date']} "
+                           f"({buys} buys, {len(rows) - buys} sells) in "
+                           f"{', '.join(sorted({row['Symbol'] for row in rows}))}")
+            return {
+                'count': len(rows),
+                'lines': lines,
+                'symbols': [row['Symbol'] for row in rows],
+                'summary': summary,
+                'text': "Recent transactions:\n" + '\n'.join(lines) if lines else '',
+            }
+
+        return self._get(('recent', symbol, version), self._counted(build))
+
+    def tariff_risk(self, conn, analyze: RiskAnalyzer, current_stock: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Snippet summarizing the portfolio's tariff risk exposure.
+
+        Args:
+            conn: Open SQLite connection
+            analyze: Callable returning the risk analysis for an optional
+                current stock (app.analyze_tariff_risk)
+            current_stock: Stock whose risk profile is included, if held
+
+        Returns:
+            Dictionary with analysis (the analyzer's result), background
+            (general tariff context), exposure (risk counts), lines and
+            symbols (one per high and medium risk holding), profile (the
+            current stock's risk factors, or '') and text (all of it)
+        """
+        version = get_data_version(conn)
+
+        def build() -> Dict[str, Any]:
+            risk_data = analyze(current_stock)
+            context = risk_data['tariff_context']
+            background = "\n".join([
+                "Tariff Risk Context:",
+                f"- Recent Developments: {context['recent_developments']}",
+                f"- Potential Impacts: {context['potential_impacts']}",
+                f"- Most Affected Sectors: {context['sectors_most_affected']}",
+            ])
+            exposure = (f"Portfolio Tariff Risk Exposure: {len(risk_data['high_risk'])} high risk and "
+                        f"{len(risk_data['medium_risk'])} medium risk holdings")
+            holdings = risk_data['high_risk'] + risk_data['medium_risk']
+            lines = [f"- {s['Symbol']} ({s['Name']}): {s['risk_level']} risk" for s in holdings]
+            profile = ''
+            stock_risk = risk_data['current_stock_risk']
+            if current_stock and stock_risk:
+                profile = '\n'.join([f"Risk Profile for {current_stock} ({stock_risk['Name']}):",
+                                     f"- Risk Level: {stock_risk['risk_level'].upper()}", "- Risk Factors:"] +
+                                    [f"  * {factor}" for factor in stock_risk['risk_factors']])
+            text = '\n\n'.join(part for part in (background, '\n'.join([exposure] + lines), profile) if part)
+            return {
+                'analysis': risk_data,
+                'background': background,
+                'exposure': exposure,
+                'lines': lines,
+                'symbols': [s['Symbol'] for s in holdings],
+                'profile': profile,
+                'text': text,
+            }
+
+        return self._get(('tariff_risk', current_stock, version), self._counted(build))
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {'builds': self.builds, 'flight': self._flight.stats()}
+
+
+# Process-wide builder shared by the chat endpoints
+chat_context = ChatContextBuilder()
@@ -0,0 +1,419 @@
+import os
+import heapq
+import logging
+import threading
+from array import array
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from utils.cache import BoundedCache
+from utils.data_version import TRANSACTIONS_REPLACED, get_data_version, get_symbol_version
+from utils.market_data import endpoint_concurrency
+from utils.positions import MIN_OPEN_SHARES
+from utils.split_index import SplitIndex, lookup_split_indexes
+
+logger = logging.getLogger(__name__)
+
+FIFO = 'fifo'        # Sell the oldest lots first
+LIFO = 'lifo'        # Sell the newest lots first
+HIFO = 'hifo'        # Sell the highest-cost lots first
+AVERAGE = 'average'  # Every share carries the average cost of the open shares
+COST_BASIS_METHODS = (FIFO, LIFO, HIFO, AVERAGE)
+
+DEFAULT_METHOD = os.getenv('COST_BASIS_METHOD', FIFO).lower()
+if DEFAULT_METHOD not in COST_BASIS_METHODS:
+    logger.warning(f"Unknown COST_BASIS_METHOD {DEFAULT_METHOD!r}, using {FIFO}")
+    DEFAULT_METHOD = FIFO
+
+LONG_TERM_DAYS = 365  # Lots held longer than this are long term
+
+# Rough per-object sizes for the cache budget (see SymbolLedger.__sizeof__)
+_LEDGER_BYTES = 1024
+_OPEN_LOT_BYTES = 200
+
+# One LotBook per method, updated in place as fills arrive
+lot_books = BoundedCache('lot_books', max_bytes=256 * 1024 * 1024, max_entries=len(COST_BASIS_METHODS))
+
+SplitIndexLookup = Callable[[str], SplitIndex]
+
+
+def _day(timestamp: str) -> int:
+    """Day ordinal (days since 1970-01-01) of a 'YYYY-MM-DD ...' timestamp."""
+    return int(np.datetime64(timestamp[:10], 'D').astype(np.int64))
+
+
+def _iso_day(day: int) -> str:
+    return str(np.datetime64(int(day), 'D'))
+
+
+def _split_key(index: SplitIndex) -> Tuple:
+    return tuple(index.dates.astype(str)), tuple(index.ratios)
+
+
+class SymbolLedger:
+    """
+    Open and closed lots for one symbol under one accounting method, built by
+    replaying its fills in (Timestamp, Id) order.
+
+    Quantities and prices are in today's share units: fills from before a
+    split are adjusted with the symbol's SplitIndex, so lots can be valued at
+    the current quote and sells after a split consume the right share count.
+    """
+
+    __slots__ = ('symbol', 'method', 'split_key', 'shares', 'cost', 'realized', 'unmatched_qty',
+                 'fill_count', 'skipped_fills', 'last_key', '_open', '_seq',
+                 '_closed_qty', '_closed_cost', '_closed_proceeds', '_closed_acquired', '_closed_disposed')
+
+    def __init__(self, symbol: str, method: str, split_key: Tuple = ()) -> None:
+        self.symbol = symbol
+        self.method = method
+        self.split_key = split_key
+        self.shares = 0.0        # Open shares
+        self.cost = 0.0          # Cost basis of the open shares
+        self.realized = 0.0      # Realized P&L of all sells
+        self.unmatched_qty = 0.0  # Shares sold without an open lot to sell from
+        self.fill_count = 0      # Fills replayed, including skipped ones
+        self.skipped_fills = 0   # Fills without a quantity or price
+        self.last_key: Optional[Tuple[str, str]] = None  # (Timestamp, Id) of the last fill replayed
+        # Open lots are [qty, unit_cost, acquired_day, seq]; HIFO keeps a heap of (-unit_cost, seq, lot)
+        self._open: Any = [] if method in (LIFO, HIFO) else deque()
+        self._seq = 0
+        # Closed lot slices, one entry per (sell, lot) pair, as compact arrays
+        self._closed_qty = array('d')
+        self._closed_cost = array('d')
+        self._closed_proceeds = array('d')
+        self._closed_acquired = array('q')
+        self._closed_disposed = array('q')
+
+    def __sizeof__(self) -> int:
+        closed = len(self._closed_qty) * (3 * 8 + 2 * self._closed_acquired.itemsize)
+        return _LEDGER_BYTES + len(self._open) * _OPEN_LOT_BYTES + closed
+
+    def _next_lot(self) -> list:
+        if self.method == LIFO:
+            return self._open[-1]
+        if self.method == HIFO:
+            return self._open[0][2]
+        return self._open[0]
+
+    def _pop_lot(self) -> None:
+        if self.method == LIFO:
+            self._open.pop()
+        elif self.method == HIFO:
+            heapq.heappop(self._open)
+        else:
+            self._open.popleft()
+
+    def open_lots(self) -> List[list]:
+        """Open lots as [qty, unit_cost, acquired_day, seq], oldest first."""
+        lots = [entry[2] for entry in self._open] if self.method == HIFO else list(self._open)
+        return sorted(lots, key=lambda lot: lot[3])
+
+    def buy(self, day: int, qty: float, price: float, fees: float) -> None:
+        cost = qty * price + fees
+        self._seq += 1
+        lot = [qty, cost / qty, day, self._seq]
+        if self.method == HIFO:
+            heapq.heappush(self._open, (-lot[1], lot[3], lot))
+        else:
+            self._open.append(lot)
+        self.shares += qty
+        self.cost += cost
+
+    def sell(self, day: int, qty: float, price: float, fees: float) -> None:
+        proceeds_per_share = price - fees / qty
+        average = self.cost / self.shares if self.method == AVERAGE and self.shares > MIN_OPEN_SHARES else None
+        remaining = qty
+        while remaining > MIN_OPEN_SHARES and self._open:
+            lot = self._next_lot()
+            take = min(lot[0], remaining)
+            basis = take * (lot[1] if average is None else average)
+            proceeds = take * proceeds_per_share
+            self._closed_qty.append(take)
+            self._closed_cost.append(basis)
+            self._closed_proceeds.append(proceeds)
+            self._closed_acquired.append(lot[2])
+            self._closed_disposed.append(day)
+            self.realized += proceeds - basis
+            self.shares -= take
+            self.cost -= basis
+            remaining -= take
+            lot[0] -= take
+            if lot[0] <= MIN_OPEN_SHARES:
+                self._pop_lot()
+        if not self._open:
+            # Drop float residue once every lot is closed
+            self.shares = self.cost = 0.0
+        if remaining > MIN_OPEN_SHARES:
+            self.unmatched_qty += remaining
+
+    def apply(self, rows: List[Tuple], index: SplitIndex) -> None:
+        """
+        Replay fills that come after everything replayed so far.
+
+        Args:
+            rows: (Timestamp, Id, Side, Qty, AveragePrice, Fees) tuples in (Timestamp, Id) order
+            index: The symbol's SplitIndex
+        """
+        if not rows:
+            return
+        days = np.array([row[0][:10] for row in rows], dtype='datetime64[D]')
+        quantities = np.array([np.nan if row[3] is None else row[3] for row in rows], dtype=float)
+        prices = np.array([np.nan if row[4] is None else row[4] for row in rows], dtype=float)
+        if len(index):
+            # adjust() converts to the units before the first split; scale on to today's units
+            prices, quantities = index.adjust(prices, quantities, days)
+            total_ratio = index.prefix[-1]
+            prices, quantities = prices / total_ratio, quantities * total_ratio
+
+        for row, day, qty, price in zip(rows, days.astype(np.int64).tolist(), quantities.tolist(), prices.tolist()):
+            self.fill_count += 1
+            if not qty > 0 or price != price:
+                self.skipped_fills += 1
+                continue
+            fees = row[5] or 0.0
+            if row[2] == 'buy':
+                self.buy(day, qty, price, fees)
+            else:
+                self.sell(day, qty, price, fees)
+        self.last_key = (rows[-1][0], rows[-1][1])
+
+    def summary(self, price: Optional[float] = None, as_of: Optional[int] = None,
+                include_lots: bool = False) -> Dict[str, Any]:
+        """
+        Cost basis, P&L and holding periods for the symbol.
+
+        Args:
+            price: Current price per share, for market value and unrealized P&L
+            as_of: Day ordinal that open holding periods are measured to (default today)
+            include_lots: Also list the open lots
+
+        Returns:
+            Dictionary of figures for the symbol
+        """
+        as_of = _day(str(np.datetime64('today', 'D'))) if as_of is None else as_of
+        shares = self.shares if self.shares > MIN_OPEN_SHARES else 0.0
+
+        held = np.frombuffer(self._closed_disposed, dtype=np.int64) - np.frombuffer(self._closed_acquired, dtype=np.int64) \
+            if len(self._closed_qty) else np.zeros(0, dtype=np.int64)
+        closed_qty = np.frombuffer(self._closed_qty, dtype=float) if len(self._closed_qty) else np.zeros(0)
+        closed_pnl = (np.frombuffer(self._closed_proceeds, dtype=float) - np.frombuffer(self._closed_cost, dtype=float)) \
+            if len(self._closed_qty) else np.zeros(0)
+        long_term = held > LONG_TERM_DAYS
+
+        lots = self.open_lots()
+        open_days = np.array([as_of - lot[2] for lot in lots], dtype=float)
+        open_qty = np.array([lot[0] for lot in lots], dtype=float)
+
+        summary = {
+            'symbol': self.symbol,
+            'method': self.method,
+            'shares': round(shares, 6),
+            'cost_basis': round(self.cost, 2) if shares else 0.0,
+            'average_cost': round(self.cost / shares, 4) if shares else None,
+            'market_price': price,
+            'market_value': None,
+            'unrealized_pnl': None,
+            'unrealized_pnl_percentage': None,
+            'realized_pnl': round(self.realized, 2),
+            'realized_short_term': round(float(closed_pnl[~long_term].sum()), 2),
+            'realized_long_term': round(float(closed_pnl[long_term].sum()), 2),
+            'open_lot_count': len(lots),
+            'closed_lot_count': len(self._closed_qty),
+            'average_holding_days_open': round(float(np.average(open_days, weights=open_qty)), 1) if shares else None,
+            'average_holding_days_closed': round(float(np.average(held, weights=closed_qty)), 1)
+            if closed_qty.sum() > 0 else None,
+            'unmatched_sell_qty': round(self.unmatched_qty, 6),
+            'skipped_fills': self.skipped_fills,
+        }
+        if price is not None:
+            market_value = shares * price
+            unrealized = market_value - (self.cost if shares else 0.0)
+            summary['market_value'] = round(market_value, 2)
+            summary['unrealized_pnl'] = round(unrealized, 2)
+            summary['unrealized_pnl_percentage'] = round(unrealized / self.cost * 100, 2) if shares and self.cost > 0 else None
+        if include_lots:
+            average = self.cost / shares if self.method == AVERAGE and shares else None
+            summary['open_lots'] = [{
+                'acquired': _iso_day(lot[2]),
+                'shares': round(lot[0], 6),
+                'unit_cost': round(lot[1] if average is None else average, 4),
+                'holding_days': int(as_of - lot[2]),
+                'term': 'long' if as_of - lot[2] > LONG_TERM_DAYS else 'short',
+            } for lot in lots]
+        return summary
+
+
+class LotBook:
+    """
+    Lot ledgers for every traded symbol under one accounting method.
+
+    refresh() brings the book up to date with the database: symbols whose
+    data version is unchanged are skipped, fills appended after the last
+    replayed fill are applied on top of the existing lots, and only symbols
+    with back-dated fills or changed splits are replayed from the start.
+    Symbols whose split history can't be fetched are never replayed
+    unadjusted; they stay degraded until a later refresh succeeds.
+    A full replace of the transactions starts the book over.
+    """
+
+    __slots__ = ('method', 'ledgers', 'symbol_versions', 'data_version', 'replaced_version', 'degraded', '_lock')
+
+    def __init__(self, method: str) -> None:
+        if method not in COST_BASIS_METHODS:
+            raise ValueError(f"Unknown cost basis method: {method}")
+        self.method = method
+        self.ledgers: Dict[str, SymbolLedger] = {}
+        self.symbol_versions: Dict[str, int] = {}
+        self.data_version: Optional[int] = None
+        self.replaced_version: Optional[int] = None
+        self.degraded: set = set()  # Symbols whose split lookup failed on the last refresh
+        self._lock = threading.Lock()
+
+    def __sizeof__(self) -> int:
+        return _LEDGER_BYTES + sum(ledger.__sizeof__() for ledger in list(self.ledgers.values()))
+
+    def _fetch_fills(self, conn, symbol: str, after: Optional[Tuple[str, str]] = None) -> List[Tuple]:
+        query = 'SELECT Timestamp, Id, Side, Qty, AveragePrice, Fees FROM transactions WHERE Symbol = ?'
+        params: List[Any] = [symbol]
+        if after is not None:
+            query += ' AND (Timestamp, Id) > (?, ?)'
+            params.extend(after)
+        return [tuple(row) for row in conn.execute(query + ' ORDER BY Timestamp, Id', params)]
+
+    def _replays_cleanly(self, conn, ledger: SymbolLedger) -> bool:
+        """Whether the fills replayed so far are still exactly the fills up to the ledger's last key."""
+        if ledger.last_key is None:
+            return ledger.fill_count == 0
+        count = conn.execute(
+            'SELECT COUNT(*) FROM transactions WHERE Symbol = ? AND (Timestamp, Id) <= (?, ?)',
+            [ledger.symbol, *ledger.last_key]
+        ).fetchone()[0]
+        return count == ledger.fill_count
+
+    def refresh(self, conn, split_index_for: SplitIndexLookup, max_workers: Optional[int] = None) -> int:
+        """
+        Bring the ledgers up to date with the transactions table.
+
+        Split indexes are looked up before the book is locked, so reports are
+        not held up by the network. A symbol whose lookup fails is marked
+        degraded: its existing ledger, if any, is left as it was and it is
+        retried on the next refresh rather than replayed without splits.
+
+        Args:
+            conn: Open SQLite connection
+            split_index_for: Callable returning a symbol's SplitIndex; it
+                should raise if the splits can't be fetched
+            max_workers: Number of concurrent split lookups (default: what the
+                provider's splits budget sustains)
+
+        Returns:
+            Number of symbols whose ledger changed
+        """
+        symbols = [row[0] for row in conn.execute('SELECT symbol FROM positions')]
+        indexes = lookup_split_indexes(symbols, split_index_for, max_workers or endpoint_concurrency('splits'))
+
+        with self._lock:
+            replaced = get_data_version(conn, TRANSACTIONS_REPLACED)
+            if replaced != self.replaced_version:
+                self.ledgers.clear()
+                self.symbol_versions.clear()
+                self.data_version = None
+                self.replaced_version = replaced
+
+            for symbol in set(self.ledgers) - set(symbols):
+                del self.ledgers[symbol]
+                self.symbol_versions.pop(symbol, None)
+
+            data_version = get_data_version(conn)
+            self.degraded = {symbol for symbol in symbols if indexes[symbol] is None}
+            changed = 0
+            for symbol in symbols:
+                index = indexes[symbol]
+                if index is None:
+                    continue
+                split_key = _split_key(index)
+                ledger = self.ledgers.get(symbol)
+                if ledger is not None and ledger.split_key == split_key:
+                    if data_version == self.data_version:
+                        continue
+                    version = get_symbol_version(conn, symbol)
+                    if version == self.symbol_versions.get(symbol):
+                        continue
+                    if self._replays_cleanly(conn, ledger):
+                        ledger.apply(self._fetch_fills(conn, symbol, ledger.last_key), index)
+                        self.symbol_versions[symbol] = version
+                        changed += 1
+                        continue
+
+                version = get_symbol_version(conn, symbol)
+                ledger = SymbolLedger(symbol, self.method, split_key)
+                ledger.apply(self._fetch_fills(conn, symbol), index)
+                self.ledgers[symbol] = ledger
+                self.symbol_versions[symbol] = version
+                changed += 1
+            # Degraded symbols may have fills the book hasn't seen, so the
+            # whole-book shortcut stays off until they catch up
+            self.data_version = None if self.degraded else data_version
+            return changed
+
+    def report(self, prices: Optional[Dict[str, Optional[float]]] = None,
+               symbols: Optional[Iterable[str]] = None, include_lots: bool = False,
+               open_only: bool = False) -> Dict[str, Any]:
+        """
+        Per-symbol and total cost basis, P&L and holding periods.
+
+        Args:
+            prices: Current price per symbol, for market values and unrealized P&L
+            symbols: Symbols to include (default all)
+            include_lots: Also list each symbol's open lots
+            open_only: Only include symbols with shares held
+
+        Returns:
+            Dictionary with method, positions (list of symbol summaries),
+            totals and degraded (symbols whose figures may be out of date or
+            missing because their split history couldn't be fetched)
+        """
+        prices = prices or {}
+        as_of = _day(str(np.datetime64('today', 'D')))
+        with self._lock:
+            names = sorted(self.ledgers) if symbols is None else [s for s in symbols if s in self.ledgers]
+            positions = [self.ledgers[symbol].summary(prices.get(symbol), as_of, include_lots) for symbol in names]
+            degraded = sorted(self.degraded if symbols is None else self.degraded & set(symbols))
+        if open_only:
+            positions = [position for position in positions if position['shares']]
+
+        def total(key: str) -> float:
+            return round(float(sum(position[key] or 0 for position in positions)), 2)
+
+        totals = {key: total(key) for key in ('cost_basis', 'market_value', 'unrealized_pnl', 'realized_pnl',
+                                               'realized_short_term', 'realized_long_term')}
+        return {'method': self.method, 'positions': positions, 'totals': totals, 'degraded': degraded}
+
+
+def get_lot_book(conn, split_index_for: SplitIndexLookup, method: str = DEFAULT_METHOD) -> LotBook:
+    """
+    Get the up-to-date LotBook for an accounting method, creating it on first
+    use and otherwise updating the cached one incrementally.
+
+    Args:
+        conn: Open SQLite connection
+        split_index_for: Callable returning a symbol's SplitIndex, raising
+            if the splits can't be fetched
+        method: One of COST_BASIS_METHODS
+
+    Returns:
+        LotBook (shared between callers; read it through report())
+
+    Raises:
+        ValueError: If the method is unknown
+    """
+    book = lot_books.get(method)
+    if book is None:
+        book = LotBook(method)
+    book.refresh(conn, split_index_for)
+    # Re-store so the cache accounts for the book's new size
+    lot_books.set(method, book)
+    return book
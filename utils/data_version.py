@@ -0,0 +1,95 @@
+import logging
+import secrets
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+TRANSACTIONS = 'transactions'
+# Bumped when the transactions are replaced wholesale rather than appended to,
+# so state maintained incrementally from new fills knows to start over
+TRANSACTIONS_REPLACED = 'transactions.replaced'
+# Random id set once when the table is created. Version counters start over
+# in a recreated database, so files named after a version (such as the
+# transactions snapshots) also carry the generation to tell databases apart
+DATABASE_GENERATION = 'database.generation'
+
+
+def init_data_versions(conn) -> None:
+    """
+    Create the data_versions table if it doesn't exist, together with the
+    database's generation id.
+
+    Args:
+        conn: Open SQLite connection
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS data_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO data_versions (name, version) VALUES (?, ?)',
+                 (DATABASE_GENERATION, secrets.randbits(48)))
+
+
+def bump_data_version(conn, name: str = TRANSACTIONS) -> None:
+    """
+    Record that a dataset changed. Call inside the transaction that changes
+    it, so the new version becomes visible together with the data.
+
+    Args:
+        conn: Open SQLite connection (the caller commits)
+        name: Dataset name
+    """
+    conn.execute('''
+        INSERT INTO data_versions (name, version) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET version = version + 1
+    ''', (name,))
+
+
+def get_data_version(conn, name: str = TRANSACTIONS) -> int:
+    """
+    Get the current version of a dataset, for keying caches of data derived from it.
+
+    Args:
+        conn: Open SQLite connection
+        name: Dataset name
+
+    Returns:
+        Version counter (0 if the dataset never changed)
+    """
+    row = conn.execute('SELECT version FROM data_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def get_database_generation(conn) -> int:
+    """Random id of this database, fixed when it was created (0 if it predates generation ids)."""
+    return get_data_version(conn, DATABASE_GENERATION)
+
+
+def symbol_version_name(symbol: str, name: str = TRANSACTIONS) -> str:
+    """Name of the per-symbol slice of a dataset, e.g. 'transactions:AAPL'."""
+    return f'{name}:{symbol}'
+
+
+def bump_symbol_versions(conn, symbols: Iterable[str], name: str = TRANSACTIONS) -> None:
+    """
+    Record that a dataset changed for some symbols only. Bumps the dataset's
+    own version too, since anything derived from all symbols is affected.
+
+    Args:
+        conn: Open SQLite connection (the caller commits)
+        symbols: Symbols whose rows changed
+        name: Dataset name
+    """
+    bump_data_version(conn, name)
+    for symbol in sorted(set(symbols)):
+        bump_data_version(conn, symbol_version_name(symbol, name))
+
+
+def get_symbol_version(conn, symbol: str, name: str = TRANSACTIONS) -> int:
+    """
+    Get the version of one symbol's slice of a dataset, for keying caches
+    of per-symbol data that should survive changes to other symbols.
+    """
+    return get_data_version(conn, symbol_version_name(symbol, name))
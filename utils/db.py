@@ -0,0 +1,165 @@
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'stock_transactions.db'
+
+# Applied to every new connection. WAL lets readers proceed while a
+# background job is writing; NORMAL sync is safe with WAL and much cheaper.
+PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA mmap_size = 268435456',   # 256 MB memory-mapped reads
+    'PRAGMA cache_size = -16000',     # 16 MB page cache per connection
+    'PRAGMA temp_store = MEMORY',
+]
+
+BUSY_TIMEOUT = 10          # Seconds to wait on a locked database before failing
+CACHED_STATEMENTS = 256    # Prepared statements kept per connection
+MAX_IDLE_PER_THREAD = 2    # Idle connections kept for reuse by each thread
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection whose close() hands it back to its pool instead of
+    closing it. Any transaction left open is rolled back on release, exactly
+    as a real close would discard it.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.checked_out = False
+
+    def close(self) -> None:
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def close_connection(self) -> None:
+        """Really close the underlying connection."""
+        self.pool = None
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Per-thread pool of tuned SQLite connections for one database file.
+
+    Each thread keeps up to `max_idle` idle connections. acquire() reuses one
+    (keeping its prepared-statement cache warm) or opens a new one, so a
+    nested acquire on the same thread still gets its own connection.
+    """
+
+    def __init__(self, path: str = DB_PATH, max_idle: int = MAX_IDLE_PER_THREAD) -> None:
+        self.path = path
+        self.max_idle = max_idle
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def _idle(self) -> List[PooledConnection]:
+        idle = getattr(self._local, 'idle', None)
+        if idle is None:
+            idle = self._local.idle = []
+        return idle
+
+    def _open(self) -> PooledConnection:
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, factory=PooledConnection,
+                               cached_statements=CACHED_STATEMENTS)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.pool = self
+        return conn
+
+    def acquire(self) -> PooledConnection:
+        """Get a connection for the current thread, with row_factory set to sqlite3.Row."""
+        idle = self._idle()
+        if idle:
+            conn = idle.pop()
+            with self._lock:
+                self.reused += 1
+        else:
+            conn = self._open()
+            with self._lock:
+                self.opened += 1
+        conn.row_factory = sqlite3.Row
+        conn.checked_out = True
+        return conn
+
+    def release(self, conn: PooledConnection) -> None:
+        """Return a connection to the current thread's idle list, rolling back any open transaction."""
+        if not conn.checked_out:
+            return
+        conn.checked_out = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning(f"Discarding pooled connection after failed rollback: {e}")
+            self._discard(conn)
+            return
+
+        idle = self._idle()
+        if len(idle) < self.max_idle:
+            idle.append(conn)
+        else:
+            self._discard(conn)
+
+    def _discard(self, conn: PooledConnection) -> None:
+        with self._lock:
+            self.discarded += 1
+        try:
+            conn.close_connection()
+        except sqlite3.Error:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Return connection counters for this pool."""
+        with self._lock:
+            return {
+                'path': self.path,
+                'opened': self.opened,
+                'reused': self.reused,
+                'discarded': self.discarded
+            }
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path: str = DB_PATH) -> ConnectionPool:
+    """Get (or create) the shared pool for a database file."""
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path)
+        return pool
+
+
+def connect(path: str = DB_PATH) -> PooledConnection:
+    """
+    Get a pooled connection to the database. Call close() when done to
+    return it to the pool.
+
+    Args:
+        path: Database file
+
+    Returns:
+        PooledConnection with row_factory set to sqlite3.Row
+    """
+    return get_pool(path).acquire()
+
+
+def pool_stats() -> List[Dict[str, Any]]:
+    """Return stats for every pool."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
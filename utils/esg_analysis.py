@@ -2,13 +2,17 @@ import os
 import json
 import requests
 import logging
-import yfinance as yf
 from datetime import datetime
 import time
 import random
 import pandas as pd
 from typing import Dict, List, Optional, Tuple, Union, Any
 
+from utils.db import connect as db_connect
+from utils.ingest import load_transactions_snapshot
+from utils.market_data import get_market_data_provider
+from utils.ticker_info import get_ticker_info, prefetch_ticker_info
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -37,9 +41,17 @@ def get_esg_grade(score: float) -> str:
             return grade
     return 'F'
 
+def load_transactions() -> pd.DataFrame:
+    """Get all transactions from the snapshot of the latest upload (shared; do not modify)."""
+    conn = db_connect()
+    try:
+        return load_transactions_snapshot(conn)
+    finally:
+        conn.close()
+
 def get_transaction_history(symbol: str) -> pd.DataFrame:
     """
-    Get transaction history for a specific symbol from the transactions CSV.
+    Get transaction history for a specific symbol from the transactions snapshot.
     
     Args:
         symbol: Stock symbol to get transaction history for
@@ -48,7 +60,7 @@ def get_transaction_history(symbol: str) -> pd.DataFrame:
         DataFrame containing transaction history
     """
     try:
-        df = pd.read_csv('stock_orders.csv')
+        df = load_transactions()
         return df[df['Symbol'] == symbol]
     except Exception as e:
         logger.error(f"Error reading transaction history: {e}")
@@ -154,8 +166,8 @@ def calculate_company_adjustment(symbol: str, transaction_history: pd.DataFrame)
         return adjustments
     
     try:
-        # Get basic stock information
-        stock_info = yf.Ticker(symbol).info
+        # Get basic stock information from the shared metadata cache
+        stock_info = get_ticker_info(symbol)
         
         # Calculate metrics that might affect ESG perception
         buy_count = transaction_history[transaction_history['Side'].str.lower() == 'buy'].shape[0]
@@ -183,7 +195,7 @@ def calculate_company_adjustment(symbol: str, transaction_history: pd.DataFrame)
         adjustments['governance'] += stability_factor
         
         # Market cap can influence ESG standards (larger companies tend to have better ESG)
-        market_cap = stock_info.get('marketCap', 0)
+        market_cap = stock_info['market_cap'] or 0
         if market_cap > 100000000000:  # Large cap
             adjustments['environmental'] += 3.0
             adjustments['social'] += 2.5
@@ -220,13 +232,15 @@ def fetch_esg_data_from_api(symbol: str) -> Dict[str, Any]:
     logger.info(f"Calculating ESG data for {symbol}")
     
     try:
-        # Get transaction history from CSV
+        # Get transaction history from the transactions snapshot
         transaction_history = get_transaction_history(symbol)
         
-        # Get stock information from yfinance
-        stock_info = yf.Ticker(symbol).info
-        company_name = stock_info.get('longName', symbol)
-        sector = stock_info.get('sector', '')
+        # Get stock information from the shared metadata cache
+        stock_info = get_ticker_info(symbol)
+        if stock_info['status'] != 'ok':
+            raise ValueError(stock_info['error'])
+        company_name = stock_info['long_name'] or symbol
+        sector = stock_info['sector'] or ''
         
         # Get baseline ESG scores for this sector
         baseline_scores = get_sector_esg_baseline(sector)
@@ -342,15 +356,12 @@ def get_portfolio_esg_summary(clear_cache: bool = True) -> Dict[str, Any]:
         Dictionary containing portfolio ESG summary data
     """
     try:
-        # Load transaction data from CSV
-        transactions_df = pd.read_csv('stock_orders.csv')
+        # Load transaction data from the snapshot (copied, since the columns are rewritten below)
+        transactions_df = load_transactions().copy()
         
         # Calculate current holdings
         transactions_df['Side'] = transactions_df['Side'].str.lower()
-        transactions_df['Qty'] = transactions_df.apply(
-            lambda row: row['Qty'] if row['Side'] == 'buy' else -row['Qty'], 
-            axis=1
-        )
+        transactions_df['Qty'] = transactions_df['Qty'].where(transactions_df['Side'] == 'buy', -transactions_df['Qty'])
         
         # Group by symbol and calculate current quantity
         holdings_df = transactions_df.groupby(['Symbol', 'Name'])['Qty'].sum().reset_index()
@@ -368,6 +379,9 @@ def get_portfolio_esg_summary(clear_cache: bool = True) -> Dict[str, Any]:
         esg_grades_count = {'A+': 0, 'A': 0, 'A-': 0, 'B+': 0, 'B': 0, 'B-': 0, 
                             'C+': 0, 'C': 0, 'C-': 0, 'D+': 0, 'D': 0, 'D-': 0, 'F': 0}
         
+        # Warm the metadata cache for all holdings at once
+        prefetch_ticker_info(holdings_df['Symbol'].tolist())
+        
         # Process each holding
         portfolio_esg_data = []
         for _, holding in holdings_df.iterrows():
@@ -376,8 +390,7 @@ def get_portfolio_esg_summary(clear_cache: bool = True) -> Dict[str, Any]:
             
             try:
                 # Get current price
-                ticker = yf.Ticker(symbol)
-                current_price = ticker.history(period="1d")['Close'].iloc[-1]
+                current_price = get_market_data_provider().history(symbol, period="1d")['Close'].iloc[-1]
                 position_value = qty * current_price
                 total_value += position_value
                 
@@ -0,0 +1,408 @@
+import os
+import glob
+import logging
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from utils.cache import BoundedCache
+from utils.data_version import (TRANSACTIONS_REPLACED, bump_data_version, bump_symbol_versions, get_data_version,
+                                get_database_generation)
+from utils.positions import apply_fills
+from utils.schema import (TRANSACTION_COLUMNS, INSERT_TRANSACTION_SQL, create_transactions_table,
+                          drop_transactions_indexes, fill_hash, transaction_fill)
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow  # noqa: F401
+    SNAPSHOT_FORMAT = 'parquet'
+except ImportError:
+    SNAPSHOT_FORMAT = 'pickle'
+
+CHUNK_SIZE = 50000        # CSV rows parsed and inserted per batch
+MAX_REPORTED_ISSUES = 200  # Row-level problems kept in the report (all are counted)
+KEEP_SNAPSHOTS = 3        # Snapshot files kept on disk per directory
+HASH_LOOKUP_BATCH = 500   # Fill hashes looked up per query in append mode
+
+REPLACE = 'replace'  # The upload is the full history: replace all transactions
+APPEND = 'append'    # The upload is a delta: add fills not already loaded
+INGEST_MODES = (REPLACE, APPEND)
+
+SNAPSHOT_DIR_ENV = 'TRANSACTIONS_SNAPSHOT_DIR'
+DEFAULT_SNAPSHOT_DIR = 'snapshots'
+
+REQUIRED_COLUMNS = ['Date', 'Symbol']
+TEXT_COLUMNS = ['Name', 'Type', 'Side', 'State']
+NUMBER_COLUMNS = ['AveragePrice', 'Qty', 'Fees']
+
+# Loaded snapshots, keyed by file path (files are never rewritten)
+snapshot_cache = BoundedCache('snapshots', max_bytes=256 * 1024 * 1024, max_entries=2)
+
+
+class IngestError(ValueError):
+    """Raised when an upload cannot be ingested at all (e.g. required columns are missing)."""
+
+
+class IngestReport:
+    """
+    Outcome of one CSV ingest: row counts plus the rows that were skipped
+    (errors) or loaded with a value blanked out (warnings).
+    """
+
+    def __init__(self, source: str, mode: str = REPLACE) -> None:
+        self.source = source
+        self.mode = mode
+        self.rows_read = 0
+        self.rows_loaded = 0
+        self.duplicates_skipped = 0
+        self.changed_symbols: List[str] = []
+        self.error_count = 0
+        self.warning_count = 0
+        self.issues: List[Dict[str, Any]] = []
+        self.data_version = None
+        self.snapshot = None
+
+    def add_issues(self, level: str, rows: pd.Index, column: Optional[str],
+                   values: Optional[pd.Series], message: str) -> None:
+        """Count a batch of problem rows and keep details for the first few."""
+        if level == 'error':
+            self.error_count += len(rows)
+        else:
+            self.warning_count += len(rows)
+        room = MAX_REPORTED_ISSUES - len(self.issues)
+        for row in rows[:max(room, 0)]:
+            self.issues.append({
+                'level': level,
+                'row': int(row) + 2,  # 1-based line number, after the header
+                'column': column,
+                'value': None if values is None else values.loc[row],
+                'message': message
+            })
+
+    def summary(self) -> str:
+        """One-line description for flash messages and logs."""
+        text = f"Loaded {self.rows_loaded} of {self.rows_read} rows"
+        if self.duplicates_skipped:
+            text += f"; skipped {self.duplicates_skipped} already loaded"
+        if self.error_count:
+            text += f"; skipped {self.error_count} invalid rows"
+        if self.warning_count:
+            text += f"; blanked {self.warning_count} unparseable values"
+        return text
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'source': self.source,
+            'mode': self.mode,
+            'rows_read': self.rows_read,
+            'rows_loaded': self.rows_loaded,
+            'duplicates_skipped': self.duplicates_skipped,
+            'changed_symbols': self.changed_symbols,
+            'error_count': self.error_count,
+            'warning_count': self.warning_count,
+            'issues': self.issues,
+            'issues_truncated': self.error_count + self.warning_count > len(self.issues),
+            'data_version': self.data_version,
+            'snapshot': self.snapshot,
+            'summary': self.summary()
+        }
+
+
+def _parse_numbers(text: pd.Series):
+    """Vectorized parse_number: returns (floats, mask of unparseable non-blank values)."""
+    cleaned = text.str.strip().str.replace(',', '', regex=False).str.lstrip('$')
+    blank = cleaned.eq('') | cleaned.str.lower().eq('null')
+    values = pd.to_numeric(cleaned.mask(blank), errors='coerce')
+    return values, values.isna() & ~blank
+
+
+def _canonical_chunk(chunk: pd.DataFrame, report: IngestReport) -> pd.DataFrame:
+    """Validate one chunk of CSV text and convert it to the canonical transactions columns."""
+    for column in ['Id', 'Time'] + TEXT_COLUMNS + NUMBER_COLUMNS:
+        if column not in chunk.columns:
+            chunk[column] = ''
+
+    symbols = chunk['Symbol'].str.strip()
+    dates = pd.to_datetime(chunk['Date'].str.strip(), format='%m/%d/%Y', errors='coerce')
+
+    bad_date = dates.isna()
+    report.add_issues('error', chunk.index[bad_date], 'Date', chunk['Date'], 'Invalid date, expected MM/DD/YYYY')
+    no_symbol = symbols.eq('') & ~bad_date
+    report.add_issues('error', chunk.index[no_symbol], 'Symbol', None, 'Missing symbol')
+
+    valid = ~(bad_date | no_symbol)
+    chunk, symbols, dates = chunk[valid], symbols[valid], dates[valid]
+
+    frame = pd.DataFrame(index=chunk.index)
+    ids = chunk['Id'].str.strip()
+    missing_ids = ids.eq('')
+    if missing_ids.any():
+        # Random 128-bit hex ids, the same form migration 1 gives legacy rows without one
+        count = int(missing_ids.sum())
+        random_hex = os.urandom(16 * count).hex()
+        generated = pd.Series([random_hex[i * 32:(i + 1) * 32] for i in range(count)],
+                              index=ids.index[missing_ids])
+        ids = ids.mask(missing_ids, generated)
+    frame['Id'] = ids
+    frame['Date'] = dates.dt.strftime('%Y-%m-%d')
+    times = chunk['Time'].str.strip()
+    frame['Time'] = times.mask(times.eq(''))
+    frame['Timestamp'] = frame['Date'] + ' ' + times.mask(times.eq(''), '00:00:00')
+    frame['Symbol'] = symbols
+    for column in ['Name', 'Type', 'Side', 'State']:
+        frame[column] = chunk[column]
+    for column in NUMBER_COLUMNS:
+        values, invalid = _parse_numbers(chunk[column])
+        report.add_issues('warning', chunk.index[invalid], column, chunk[column], 'Not a number, stored as NULL')
+        frame[column] = values
+    frame['FillHash'] = [
+        fill_hash(*fill) for fill in
+        zip(frame['Date'], frame['Time'].astype(object).where(frame['Time'].notna(), None),
+            frame['Symbol'], frame['Side'], frame['Qty'], frame['AveragePrice'])
+    ]
+    return frame[TRANSACTION_COLUMNS]
+
+
+def _rows(frame: pd.DataFrame) -> List[tuple]:
+    """Convert a canonical frame to row tuples with NaN as NULL."""
+    return list(frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None))
+
+
+def _existing_hash_counts(conn, hashes: List[str]) -> Dict[str, int]:
+    """Count the transactions already stored under each fill hash."""
+    counts = dict.fromkeys(hashes, 0)
+    for start in range(0, len(hashes), HASH_LOOKUP_BATCH):
+        batch = hashes[start:start + HASH_LOOKUP_BATCH]
+        rows = conn.execute(
+            f"SELECT FillHash, COUNT(*) FROM transactions WHERE FillHash IN ({', '.join('?' for _ in batch)}) "
+            "GROUP BY FillHash",
+            batch
+        ).fetchall()
+        counts.update((row[0], row[1]) for row in rows)
+    return counts
+
+
+def _new_fills(conn, frame: pd.DataFrame, file_counts: Dict[str, int],
+               stored_counts: Dict[str, int]) -> pd.Series:
+    """
+    Mask of the rows in a chunk that are not already stored.
+
+    Identical fills are compared as a multiset: the n-th occurrence of a fill
+    in the upload is new only if fewer than n copies were stored before the
+    upload started, so two genuine identical fills are both kept while
+    re-uploading the same file adds nothing.
+    """
+    hashes = frame['FillHash']
+    unseen = [value for value in hashes.unique() if value not in stored_counts]
+    stored_counts.update(_existing_hash_counts(conn, unseen))
+
+    occurrence = hashes.groupby(hashes).cumcount() + 1 + hashes.map(lambda value: file_counts.get(value, 0))
+    for value, count in hashes.value_counts().items():
+        file_counts[value] = file_counts.get(value, 0) + int(count)
+    return occurrence > hashes.map(stored_counts)
+
+
+def ingest_csv(conn, source: str, mode: str = REPLACE, chunksize: int = CHUNK_SIZE,
+               snapshot_dir: Optional[str] = None) -> IngestReport:
+    """
+    Load a broker CSV export into the transactions table.
+
+    In REPLACE mode the file is the full history and replaces the table; in
+    APPEND mode it is a delta and only fills whose content hash (date, time,
+    symbol, side, qty, price) isn't stored yet are added, so overlapping
+    daily exports can be uploaded as they are.
+
+    The file is parsed in chunks with vectorized date and number parsing and
+    inserted with executemany, all in one transaction together with the
+    positions update and data version bumps for the symbols that changed, so
+    readers see either the old or the new data. Uncommitted changes the caller
+    made on conn beforehand are committed or rolled back with it. Afterwards an immutable
+    snapshot of the transactions is written for readers that want a
+    DataFrame (see load_transactions_snapshot).
+
+    Args:
+        conn: Open SQLite connection with the transactions schema in place
+        source: Path to the CSV file
+        mode: REPLACE or APPEND
+        chunksize: Rows parsed and inserted per batch
+        snapshot_dir: Snapshot directory (default TRANSACTIONS_SNAPSHOT_DIR or 'snapshots')
+
+    Returns:
+        IngestReport with counts, changed symbols and row-level problems
+
+    Raises:
+        IngestError: If the file lacks a required column
+        ValueError: If mode is not a known ingest mode
+    """
+    if mode not in INGEST_MODES:
+        raise ValueError(f"Unknown ingest mode: {mode}")
+    report = IngestReport(os.path.basename(source), mode)
+    previous_version = get_data_version(conn)
+    previous_count = conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0] if mode == APPEND else 0
+    changed_symbols = set()
+    frames = []
+    file_counts: Dict[str, int] = {}
+    stored_counts: Dict[str, int] = {}
+    try:
+        if mode == REPLACE:
+            # Every symbol held before may have changed, so all of them are invalidated
+            changed_symbols.update(row[0] for row in conn.execute('SELECT symbol FROM positions'))
+            # Bulk load without indexes and rebuild them once at the end, which is far
+            # cheaper than maintaining them row by row
+            conn.execute('DELETE FROM transactions')
+            conn.execute('DELETE FROM positions')
+            drop_transactions_indexes(conn)
+        reader = pd.read_csv(source, dtype=str, keep_default_na=False, chunksize=chunksize,
+                             skipinitialspace=True)
+        for chunk in reader:
+            chunk.columns = [column.strip() for column in chunk.columns]
+            missing = [column for column in REQUIRED_COLUMNS if column not in chunk.columns]
+            if missing:
+                raise IngestError(f"CSV is missing required column(s): {', '.join(missing)}")
+
+            report.rows_read += len(chunk)
+            frame = _canonical_chunk(chunk, report)
+            if mode == APPEND:
+                new = _new_fills(conn, frame, file_counts, stored_counts)
+                report.duplicates_skipped += int((~new).sum())
+                frame = frame[new]
+            rows = _rows(frame)
+            conn.executemany(INSERT_TRANSACTION_SQL, rows)
+            apply_fills(conn, (transaction_fill(row) for row in rows))
+            report.rows_loaded += len(rows)
+            changed_symbols.update(frame['Symbol'].unique())
+            frames.append(frame)
+
+        create_transactions_table(conn)
+        if mode == REPLACE:
+            bump_data_version(conn, TRANSACTIONS_REPLACED)
+        if changed_symbols or mode == REPLACE:
+            bump_symbol_versions(conn, changed_symbols)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    report.data_version = get_data_version(conn)
+    report.changed_symbols = sorted(changed_symbols)
+    logger.info(f"Ingested {report.source} ({mode}): {report.summary()}")
+    if report.data_version == previous_version:
+        return report
+
+    generation = get_database_generation(conn)
+    if mode == APPEND:
+        # Extend the previous snapshot if it is at hand; otherwise it is rebuilt on first read
+        previous = _read_snapshot(_snapshot_path(generation, previous_version, snapshot_dir))
+        if previous is None:
+            return report
+        if len(previous) != previous_count:
+            # Not the rows the fills were appended to: copying it forward would
+            # carry the mismatch into every later snapshot
+            logger.warning(f"Transactions snapshot v{previous_version} has {len(previous)} rows, "
+                           f"expected {previous_count}; rebuilding it from the database")
+            frames = [_read_transactions(conn)]
+        else:
+            frames.insert(0, previous)
+    snapshot = pd.concat(frames) if frames else pd.DataFrame(columns=TRANSACTION_COLUMNS)
+    snapshot = snapshot.sort_values(['Timestamp', 'Id'], kind='stable').reset_index(drop=True)
+    try:
+        report.snapshot = write_snapshot(snapshot, generation, report.data_version, snapshot_dir)
+    except OSError as e:
+        logger.warning(f"Could not write transactions snapshot: {e}")
+    return report
+
+
+def _snapshot_dir(snapshot_dir: Optional[str] = None) -> str:
+    return snapshot_dir or os.getenv(SNAPSHOT_DIR_ENV) or DEFAULT_SNAPSHOT_DIR
+
+
+def _snapshot_path(generation: int, version: int, snapshot_dir: Optional[str] = None) -> str:
+    extension = 'parquet' if SNAPSHOT_FORMAT == 'parquet' else 'pkl'
+    return os.path.join(_snapshot_dir(snapshot_dir), f'transactions-{generation:012x}-v{version:06d}.{extension}')
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
+def write_snapshot(frame: pd.DataFrame, generation: int, version: int, snapshot_dir: Optional[str] = None) -> str:
+    """
+    Write a columnar snapshot of the transactions for one data version and
+    prune old snapshots. Files are written once and never modified.
+
+    Args:
+        frame: Transactions in the canonical columns
+        generation: The database's generation id (see get_database_generation())
+        version: Data version the frame was read at
+        snapshot_dir: Snapshot directory (default TRANSACTIONS_SNAPSHOT_DIR or 'snapshots')
+
+    Returns:
+        Path of the snapshot file
+    """
+    path = _snapshot_path(generation, version, snapshot_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.tmp'
+    if SNAPSHOT_FORMAT == 'parquet':
+        frame.to_parquet(temp_path, index=False)
+    else:
+        frame.to_pickle(temp_path)
+    os.replace(temp_path, path)
+
+    # Newest files are kept: version numbers restart when the database is recreated
+    pattern = os.path.join(os.path.dirname(path), 'transactions-*')
+    snapshots = [p for p in glob.glob(pattern) if not p.endswith('.tmp')]
+    for old_path in sorted(snapshots, key=lambda p: (_mtime(p), p))[:-KEEP_SNAPSHOTS]:
+        if old_path != path:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+    return path
+
+
+def _read_transactions(conn) -> pd.DataFrame:
+    return pd.read_sql_query(
+        f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM transactions ORDER BY Timestamp, Id", conn
+    )
+
+
+def _read_snapshot(path: str) -> Optional[pd.DataFrame]:
+    """Load a snapshot file through the cache, or None if it doesn't exist."""
+    frame = snapshot_cache.get(path)
+    if frame is None and os.path.exists(path):
+        frame = pd.read_parquet(path) if SNAPSHOT_FORMAT == 'parquet' else pd.read_pickle(path)
+    if frame is not None:
+        snapshot_cache.set(path, frame)
+    return frame
+
+
+def load_transactions_snapshot(conn, snapshot_dir: Optional[str] = None) -> pd.DataFrame:
+    """
+    Get all transactions as a DataFrame from the snapshot for the current
+    database generation and data version, building it from the database if
+    it is missing (e.g. the data was loaded before snapshots existed).
+
+    Args:
+        conn: Open SQLite connection
+        snapshot_dir: Snapshot directory (default TRANSACTIONS_SNAPSHOT_DIR or 'snapshots')
+
+    Returns:
+        DataFrame with the canonical transactions columns. It is shared
+        between callers; work on a copy before modifying it.
+    """
+    version = get_data_version(conn)
+    generation = get_database_generation(conn)
+    path = _snapshot_path(generation, version, snapshot_dir)
+    frame = _read_snapshot(path)
+    if frame is None:
+        frame = _read_transactions(conn)
+        try:
+            write_snapshot(frame, generation, version, snapshot_dir)
+        except OSError as e:
+            logger.warning(f"Could not write transactions snapshot: {e}")
+        snapshot_cache.set(path, frame)
+    return frame
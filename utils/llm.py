@@ -0,0 +1,163 @@
+import os
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import httpx
+from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+# provider -> (API key environment variable, base URL; None for the OpenAI default)
+PROVIDERS = {
+    'openai': ('OPENAI_API_KEY', None),
+    'perplexity': ('PERPLEXITY_API_KEY', 'https://api.perplexity.ai'),
+}
+
+# Connection pool per provider, shared by every request in the process
+MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '20'))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', '10'))
+KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '120'))  # Seconds an idle connection is kept open
+CONNECT_RETRIES = 1  # Transport-level retries of failed connection attempts
+
+# Default timeouts (seconds); the read timeout stays under the chat endpoint's request timeout
+CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', '50'))
+# Deep-research jobs run in the background and can take minutes
+LONG_REQUEST_TIMEOUT = float(os.getenv('LLM_LONG_REQUEST_TIMEOUT', '600'))
+
+# SDK retries with backoff on 408/409/429/5xx and connection errors
+MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '1'))
+
+
+def http2_enabled() -> bool:
+    """HTTP/2 is used when LLM_HTTP2 allows it (default 'auto') and the h2 package is installed."""
+    setting = os.getenv('LLM_HTTP2', 'auto').lower()
+    if setting in ('0', 'false', 'no', 'off'):
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        if setting != 'auto':
+            logger.warning("LLM_HTTP2 is set but the h2 package is not installed; using HTTP/1.1")
+        return False
+    return True
+
+
+def build_timeout(read: float = REQUEST_TIMEOUT) -> httpx.Timeout:
+    return httpx.Timeout(read, connect=CONNECT_TIMEOUT)
+
+
+class LLMClientRegistry:
+    """
+    Long-lived OpenAI-compatible clients, one per provider, each backed by a
+    pooled keep-alive HTTP client so requests reuse warm TLS connections.
+
+    Clients are created on first use and rebuilt if the provider's API key
+    changes. Per-call timeouts and retries are applied with with_options(),
+    which shares the underlying connection pool.
+    """
+
+    def __init__(self) -> None:
+        self._clients: Dict[str, OpenAI] = {}
+        self._keys: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._http2 = http2_enabled()
+        self.created = 0
+        self.requests: Dict[str, int] = {provider: 0 for provider in PROVIDERS}
+
+    def available(self, provider: str) -> bool:
+        """Whether the provider's API key is configured."""
+        return bool(os.getenv(PROVIDERS[provider][0]))
+
+    def _build(self, provider: str, api_key: str) -> OpenAI:
+        _, base_url = PROVIDERS[provider]
+
+        def count_request(request: httpx.Request) -> None:
+            self.requests[provider] += 1
+
+        limits = httpx.Limits(max_connections=MAX_CONNECTIONS,
+                              max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                              keepalive_expiry=KEEPALIVE_EXPIRY)
+        http_client = httpx.Client(
+            timeout=build_timeout(),
+            follow_redirects=True,
+            transport=httpx.HTTPTransport(http2=self._http2, limits=limits, retries=CONNECT_RETRIES),
+            event_hooks={'request': [count_request]},
+        )
+        self.created += 1
+        logger.info(f"Created {provider} LLM client (http2={self._http2}, max_connections={MAX_CONNECTIONS})")
+        return OpenAI(api_key=api_key, base_url=base_url, http_client=http_client,
+                      timeout=build_timeout(), max_retries=MAX_RETRIES)
+
+    def get(self, provider: str, timeout: Optional[float] = None,
+            max_retries: Optional[int] = None) -> Optional[OpenAI]:
+        """
+        Get the shared client for a provider.
+
+        Args:
+            provider: 'openai' or 'perplexity'
+            timeout: Read timeout in seconds for calls made with the returned client
+            max_retries: Retries for calls made with the returned client
+
+        Returns:
+            The client, or None if the provider's API key is not configured
+        """
+        api_key = os.getenv(PROVIDERS[provider][0])
+        if not api_key:
+            return None
+        with self._lock:
+            client = self._clients.get(provider)
+            if client is None or self._keys[provider] != api_key:
+                if client is not None:
+                    client.close()
+                client = self._clients[provider] = self._build(provider, api_key)
+                self._keys[provider] = api_key
+        options: Dict[str, Any] = {}
+        if timeout is not None:
+            options['timeout'] = build_timeout(timeout)
+        if max_retries is not None:
+            options['max_retries'] = max_retries
+        return client.with_options(**options) if options else client
+
+    def close(self) -> None:
+        """Close every client and its connections."""
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            self._keys.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'providers': {provider: {'configured': self.available(provider),
+                                     'client_open': provider in self._clients,
+                                     'requests': self.requests[provider]}
+                          for provider in PROVIDERS},
+            'clients_created': self.created,
+            'http2': self._http2,
+            'max_connections': MAX_CONNECTIONS,
+            'max_keepalive_connections': MAX_KEEPALIVE_CONNECTIONS,
+            'keepalive_expiry': KEEPALIVE_EXPIRY,
+            'request_timeout': REQUEST_TIMEOUT,
+            'max_retries': MAX_RETRIES,
+        }
+
+
+_registry: Optional[LLMClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_llm_registry() -> LLMClientRegistry:
+    """Get the process-wide client registry, creating it on first use."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = LLMClientRegistry()
+        return _registry
+
+
+def get_llm_client(provider: str, timeout: Optional[float] = None,
+                   max_retries: Optional[int] = None) -> Optional[OpenAI]:
+    """Get the shared client for a provider, or None if its API key is not configured."""
+    return get_llm_registry().get(provider, timeout, max_retries)
@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from utils.db import DB_PATH, connect as db_connect
+
+logger = logging.getLogger(__name__)
+
+# Seconds a response is served from the cache, per feature. Canned prompts
+# (backtesting presets, theses) change rarely; chat answers go stale quickly.
+FEATURE_TTLS = {
+    'chat': 900,
+    'strategy_backtesting': 86400,
+    'thesis_validation': 7 * 86400,
+    'earnings_research': 12 * 3600,
+}
+DEFAULT_TTL = 900
+
+MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))  # Stored response text
+CACHE_ENABLED = os.getenv('LLM_CACHE', 'true').lower() not in ('0', 'false', 'no', 'off')
+
+
+def normalize_prompt(text: str) -> str:
+    """Collapse runs of whitespace and drop blank lines, so indentation in prompt templates doesn't change the key."""
+    lines = (' '.join(line.split()) for line in (text or '').splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def response_key(provider: str, model: str, messages: List[Dict[str, str]],
+                 data_version: Optional[int] = None, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Content address of a completion request.
+
+    Args:
+        provider: 'openai' or 'perplexity'
+        model: Model ID sent to the provider
+        messages: Chat messages (role and content)
+        data_version: Data version the prompt was built from, for prompts that embed portfolio data
+        params: Sampling parameters that change the answer (temperature, max_tokens, ...)
+
+    Returns:
+        Hex digest identifying the request
+    """
+    payload = json.dumps([
+        provider, model,
+        [[message['role'], normalize_prompt(message['content'])] for message in messages],
+        data_version, sorted((params or {}).items()),
+    ], default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Persistent cache of LLM completions keyed by response_key(), stored in
+    SQLite with a TTL per feature.
+
+    Stored text is bounded by `max_bytes`: once over budget, expired entries
+    are dropped first, then the least recently used ones.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, max_bytes: int = MAX_BYTES,
+                 ttls: Optional[Dict[str, float]] = None, enabled: bool = CACHE_ENABLED) -> None:
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttls = dict(FEATURE_TTLS if ttls is None else ttls)
+        self.enabled = enabled
+        self._table_ready = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = db_connect(self.db_path)
+        if not self._table_ready:
+            init_llm_cache(conn)
+            self._table_ready = True
+        return conn
+
+    def ttl_for(self, feature: str) -> float:
+        return self.ttls.get(feature, DEFAULT_TTL)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get an unexpired cached response.
+
+        Args:
+            key: response_key() of the request
+
+        Returns:
+            Dictionary with content, provider, model, usage, feature and
+            created_at, or None on a miss
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT feature, provider, model, content, usage, created_at FROM llm_responses '
+                'WHERE key = ? AND expires_at > ?', (key, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute('UPDATE llm_responses SET last_used_at = ?, hits = hits + 1 WHERE key = ?', (now, key))
+                conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return {
+            'feature': row[0],
+            'provider': row[1],
+            'model': row[2],
+            'content': row[3],
+            'usage': json.loads(row[4]) if row[4] else None,
+            'created_at': row[5],
+        }
+
+    def set(self, key: str, feature: str, provider: str, model: str, content: str,
+            usage: Optional[Dict[str, Any]] = None, ttl: Optional[float] = None) -> None:
+        """Store a response for `ttl` seconds (default the feature's TTL)."""
+        if not self.enabled or not content:
+            return
+        now = time.time()
+        ttl = self.ttl_for(feature) if ttl is None else ttl
+        size = len(content.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        conn = self._connect()
+        try:
+            conn.execute('''
+                INSERT OR REPLACE INTO llm_responses
+                (key, feature, provider, model, content, usage, size, created_at, expires_at, last_used_at, hits)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+            ''', (key, feature, provider, model, content, json.dumps(usage) if usage else None,
+                  size, now, now + ttl, now))
+            conn.commit()
+            evicted = self._evict(conn, now)
+        finally:
+            conn.close()
+        with self._lock:
+            self.stores += 1
+            self.evictions += evicted
+
+    def _evict(self, conn, now: float) -> int:
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        evicted = conn.execute('DELETE FROM llm_responses WHERE expires_at <= ?', (now,)).rowcount
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_responses').fetchone()[0]
+        if total > self.max_bytes:
+            # Walk from the least recently used entry until enough bytes are freed
+            over, keys = total - self.max_bytes, []
+            for key, size in conn.execute('SELECT key, size FROM llm_responses ORDER BY last_used_at'):
+                keys.append(key)
+                over -= size
+                if over <= 0:
+                    break
+            conn.executemany('DELETE FROM llm_responses WHERE key = ?', [(key,) for key in keys])
+            evicted += len(keys)
+        conn.commit()
+        if evicted:
+            logger.info(f"Evicted {evicted} cached LLM responses")
+        return evicted
+
+    def invalidate(self, feature: Optional[str] = None) -> int:
+        """Drop cached responses for one feature, or all of them. Returns the number dropped."""
+        conn = self._connect()
+        try:
+            if feature is None:
+                dropped = conn.execute('DELETE FROM llm_responses').rowcount
+            else:
+                dropped = conn.execute('DELETE FROM llm_responses WHERE feature = ?', (feature,)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT feature, COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) '
+                'FROM llm_responses GROUP BY feature'
+            ).fetchall()
+        finally:
+            conn.close()
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': sum(row[1] for row in rows),
+            'bytes': sum(row[2] for row in rows),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'features': {row[0]: {'entries': row[1], 'bytes': row[2], 'hits': row[3],
+                                  'ttl': self.ttl_for(row[0])} for row in rows},
+        }
+
+
+def init_llm_cache(conn) -> None:
+    """
+    Create the llm_responses table if it doesn't exist.
+
+    Args:
+        conn: Open SQLite connection
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS llm_responses (
+        key TEXT PRIMARY KEY,
+        feature TEXT NOT NULL,
+        provider TEXT NOT NULL,
+        model TEXT NOT NULL,
+        content TEXT NOT NULL,
+        usage TEXT,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL,
+        last_used_at REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_responses_last_used ON llm_responses (last_used_at)')
+    conn.commit()
+
+
+# Process-wide cache shared by the chat endpoint and the research jobs
+llm_response_cache = LLMResponseCache()
@@ -0,0 +1,458 @@
+import os
+import json
+import logging
+import threading
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Optional, Union
+
+import pandas as pd
+import yfinance as yf
+from yfinance.exceptions import YFRateLimitError
+
+from utils.resilience import (CircuitBreaker, RateLimitedError, TokenBucket,
+                              call_with_retry, error_matches)
+
+logger = logging.getLogger(__name__)
+
+# Provider selection, read once when the shared provider is first used
+PROVIDER_ENV = 'MARKET_DATA_PROVIDER'        # 'yfinance' (default), 'replay' or 'record'
+FIXTURES_ENV = 'MARKET_DATA_FIXTURES'        # Fixture directory for 'replay' and 'record'
+DEFAULT_FIXTURE_DIR = os.path.join('fixtures', 'market_data')
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+# Close adjusted for splits only, in today's share units: what a fill at that day's
+# price is worth per share, without the dividend adjustment in Close
+SPLIT_CLOSE = 'SplitClose'
+# Cash dividend per share paid on its ex-date, in today's share units
+DIVIDENDS = 'Dividends'
+HISTORY_COLUMNS = PRICE_COLUMNS + [SPLIT_CLOSE, DIVIDENDS]
+
+# Per-endpoint token-bucket budgets for live providers: (tokens per second, burst)
+PROVIDER_BUDGETS = {
+    'history': (5.0, 10),
+    'download': (1.0, 3),
+    'splits': (2.0, 5),
+    'info': (2.0, 5),
+    'calendar': (1.0, 3),
+}
+RATE_LIMIT_MAX_WAIT = 2.0    # Seconds a call may wait for a token before failing fast
+RETRY_ATTEMPTS = 3
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 60   # Seconds before a trial call is let through
+
+# Errors that indicate throttling or an unhealthy provider rather than a bad request
+TRANSIENT_ERRORS = (YFRateLimitError, ConnectionError, TimeoutError)
+TRANSIENT_MARKERS = ('too many requests', 'rate limit', '429', 'timed out', 'timeout',
+                     'connection', '502', '503', '504')
+
+DateLike = Union[str, date, datetime, None]
+
+
+class FixtureNotFoundError(LookupError):
+    """Raised by the replay provider when no fixture was recorded for a request."""
+
+
+class MarketDataProvider:
+    """
+    Source of market data for the app: daily bars, splits, ticker metadata
+    and the earnings calendar.
+
+    History is indexed by a DatetimeIndex. Open/High/Low/Close are adjusted
+    for splits and dividends (as with yfinance's auto_adjust); SplitClose
+    and Dividends, when the provider supplies them, are the close adjusted
+    for splits only and the dividend paid on each ex-date.
+    """
+
+    name = 'base'
+
+    def history(self, symbol: str, start: DateLike = None, end: DateLike = None,
+                period: Optional[str] = None) -> pd.DataFrame:
+        """
+        Get daily bars for [start, end), or for the trailing `period` (e.g. '1d').
+
+        Args:
+            symbol: Stock symbol
+            start: Inclusive start date
+            end: Exclusive end date
+            period: Trailing window used when start is not given
+
+        Returns:
+            DataFrame indexed by date with Open/High/Low/Close/Volume,
+            SplitClose and Dividends columns
+        """
+        raise NotImplementedError
+
+    def splits(self, symbol: str) -> pd.Series:
+        """Get the full split history as a Series of ratios indexed by split date."""
+        raise NotImplementedError
+
+    def info(self, symbol: str) -> Dict[str, Any]:
+        """Get the raw ticker metadata payload (yfinance `.info` field names)."""
+        raise NotImplementedError
+
+    def calendar(self, symbol: str) -> Dict[str, Any]:
+        """Get the upcoming events calendar (yfinance `.calendar` field names)."""
+        raise NotImplementedError
+
+    def download(self, symbols: Iterable[str], period: str = '1d') -> Dict[str, pd.DataFrame]:
+        """
+        Get trailing daily bars for several symbols.
+
+        The default implementation calls history() per symbol; providers
+        with a batch endpoint override it.
+
+        Args:
+            symbols: Stock symbols
+            period: Trailing window, e.g. '1d'
+
+        Returns:
+            Dictionary mapping each symbol with data to its bars
+        """
+        frames = {}
+        for symbol in dict.fromkeys(symbols):
+            try:
+                frames[symbol] = self.history(symbol, period=period)
+            except Exception as e:
+                logger.error(f"Error downloading {symbol} from {self.name}: {e}")
+        return frames
+
+    def stats(self) -> Dict[str, Any]:
+        """Return health metrics for this provider."""
+        return {'provider': self.name}
+
+
+def adjust_for_dividends(raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn unadjusted yfinance bars (auto_adjust=False: split-adjusted OHLC
+    plus 'Adj Close') into the provider's history columns: OHLC scaled by
+    the dividend factor Adj Close / Close, as auto_adjust does, the
+    split-only close kept as SplitClose and the Dividends column passed on.
+    """
+    if raw is None or raw.empty:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+    frame = raw.reindex(columns=PRICE_COLUMNS).copy()
+    frame[SPLIT_CLOSE] = raw['Close']
+    frame[DIVIDENDS] = raw[DIVIDENDS] if DIVIDENDS in raw.columns else 0.0
+    if 'Adj Close' in raw.columns:
+        factor = (raw['Adj Close'] / raw['Close']).where(raw['Close'] != 0, 1.0).fillna(1.0)
+        for column in ('Open', 'High', 'Low', 'Close'):
+            frame[column] = raw[column] * factor
+    return frame
+
+
+class YFinanceProvider(MarketDataProvider):
+    """Live market data from Yahoo Finance via yfinance."""
+
+    name = 'yfinance'
+
+    def history(self, symbol, start=None, end=None, period=None):
+        if start is not None:
+            raw = yf.Ticker(symbol).history(start=start, end=end, auto_adjust=False)
+        else:
+            raw = yf.Ticker(symbol).history(period=period or '1d', auto_adjust=False)
+        return adjust_for_dividends(raw)
+
+    def splits(self, symbol):
+        return yf.Ticker(symbol).splits
+
+    def info(self, symbol):
+        return yf.Ticker(symbol).info
+
+    def calendar(self, symbol):
+        calendar = yf.Ticker(symbol).calendar
+        if isinstance(calendar, pd.DataFrame):
+            # Older yfinance releases return a one-column frame
+            calendar = calendar.iloc[:, 0].to_dict() if not calendar.empty else {}
+        return calendar or {}
+
+    def download(self, symbols, period='1d'):
+        symbols = list(dict.fromkeys(symbols))
+        hist = yf.download(
+            symbols,
+            period=period,
+            group_by='ticker',
+            auto_adjust=True,
+            threads=True,
+            progress=False
+        )
+        if hist is None or hist.empty:
+            return {}
+        if not isinstance(hist.columns, pd.MultiIndex):
+            return {symbols[0]: hist}
+        available = set(hist.columns.get_level_values(0))
+        return {symbol: hist[symbol] for symbol in symbols if symbol in available}
+
+
+class FixtureStore:
+    """
+    On-disk market data fixtures, one directory per symbol:
+
+        <root>/<SYMBOL>/history.csv   daily bars (Date + price columns)
+        <root>/<SYMBOL>/splits.csv    Date, ratio
+        <root>/<SYMBOL>/info.json     raw info payload
+        <root>/<SYMBOL>/calendar.json raw calendar payload
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, symbol: str, filename: str) -> str:
+        return os.path.join(self.root, symbol.upper(), filename)
+
+    def _require(self, symbol: str, filename: str) -> str:
+        path = self._path(symbol, filename)
+        if not os.path.exists(path):
+            raise FixtureNotFoundError(f"No {filename} fixture for {symbol} in {self.root}")
+        return path
+
+    def read_history(self, symbol: str) -> pd.DataFrame:
+        frame = pd.read_csv(self._require(symbol, 'history.csv'), index_col='Date', parse_dates=['Date'])
+        # Fixtures recorded before SplitClose and Dividends existed read them as NaN
+        return frame.reindex(columns=HISTORY_COLUMNS)
+
+    def write_history(self, symbol: str, hist: pd.DataFrame) -> None:
+        """Merge bars into the recorded history, newer values winning."""
+        if hist is None or hist.empty:
+            return
+        frame = hist.reindex(columns=HISTORY_COLUMNS).copy()
+        frame.index = pd.DatetimeIndex(pd.to_datetime(frame.index.strftime('%Y-%m-%d')), name='Date')
+        with self._lock:
+            path = self._path(symbol, 'history.csv')
+            if os.path.exists(path):
+                frame = frame.combine_first(self.read_history(symbol))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            frame.sort_index().to_csv(path, date_format='%Y-%m-%d')
+
+    def read_splits(self, symbol: str) -> pd.Series:
+        frame = pd.read_csv(self._require(symbol, 'splits.csv'), parse_dates=['Date'])
+        return pd.Series(frame['ratio'].values, index=pd.DatetimeIndex(frame['Date'], name='Date'), name='Stock Splits')
+
+    def write_splits(self, symbol: str, splits: pd.Series) -> None:
+        frame = pd.DataFrame({
+            'Date': pd.DatetimeIndex(splits.index).strftime('%Y-%m-%d'),
+            'ratio': list(splits.values)
+        })
+        self._write(symbol, 'splits.csv', lambda path: frame.to_csv(path, index=False))
+
+    def read_json(self, symbol: str, filename: str) -> Dict[str, Any]:
+        with open(self._require(symbol, filename)) as f:
+            return json.load(f)
+
+    def write_json(self, symbol: str, filename: str, payload: Dict[str, Any]) -> None:
+        def dump(path):
+            with open(path, 'w') as f:
+                json.dump(payload, f, indent=2, sort_keys=True, default=str)
+        self._write(symbol, filename, dump)
+
+    def _write(self, symbol: str, filename: str, writer) -> None:
+        path = self._path(symbol, filename)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            writer(path)
+
+
+def _slice_history(frame: pd.DataFrame, start: DateLike, end: DateLike, period: Optional[str]) -> pd.DataFrame:
+    """Cut recorded bars down to the window a live provider would have returned."""
+    if start is not None:
+        mask = frame.index >= pd.Timestamp(start)
+        if end is not None:
+            mask &= frame.index < pd.Timestamp(end)
+        return frame[mask]
+
+    # Trailing periods like '1d'/'5d' replay the last N recorded bars
+    period = period or '1d'
+    if period.endswith('d') and period[:-1].isdigit():
+        return frame.tail(int(period[:-1]))
+    return frame
+
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Serves previously recorded fixtures from disk without touching the network.
+
+    Trailing-period requests replay the most recent recorded bars, so a
+    fixture set recorded once gives reproducible quotes in benchmarks and CI.
+    """
+
+    name = 'replay'
+
+    def __init__(self, fixture_dir: str = DEFAULT_FIXTURE_DIR) -> None:
+        self.store = FixtureStore(fixture_dir)
+
+    def history(self, symbol, start=None, end=None, period=None):
+        return _slice_history(self.store.read_history(symbol), start, end, period)
+
+    def splits(self, symbol):
+        try:
+            return self.store.read_splits(symbol)
+        except FixtureNotFoundError:
+            # Most symbols never split; a missing fixture means none recorded
+            return pd.Series(dtype=float, name='Stock Splits')
+
+    def info(self, symbol):
+        return self.store.read_json(symbol, 'info.json')
+
+    def calendar(self, symbol):
+        try:
+            return self.store.read_json(symbol, 'calendar.json')
+        except FixtureNotFoundError:
+            return {}
+
+
+class RecordingProvider(MarketDataProvider):
+    """
+    Passes every call through to another provider and records the results
+    as fixtures that ReplayProvider can serve later.
+    """
+
+    name = 'record'
+
+    def __init__(self, inner: MarketDataProvider, fixture_dir: str = DEFAULT_FIXTURE_DIR) -> None:
+        self.inner = inner
+        self.store = FixtureStore(fixture_dir)
+
+    def history(self, symbol, start=None, end=None, period=None):
+        hist = self.inner.history(symbol, start=start, end=end, period=period)
+        self.store.write_history(symbol, hist)
+        return hist
+
+    def splits(self, symbol):
+        splits = self.inner.splits(symbol)
+        self.store.write_splits(symbol, splits)
+        return splits
+
+    def info(self, symbol):
+        info = self.inner.info(symbol)
+        self.store.write_json(symbol, 'info.json', info or {})
+        return info
+
+    def calendar(self, symbol):
+        calendar = self.inner.calendar(symbol)
+        self.store.write_json(symbol, 'calendar.json', calendar or {})
+        return calendar
+
+    def download(self, symbols, period='1d'):
+        frames = self.inner.download(symbols, period=period)
+        for symbol, hist in frames.items():
+            self.store.write_history(symbol, hist)
+        return frames
+
+    def stats(self):
+        return dict(self.inner.stats(), provider=self.name)
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """True for throttling, timeout and connection errors worth retrying."""
+    if isinstance(error, RateLimitedError):
+        # Our own token bucket refused the call; the provider was never asked
+        return False
+    return error_matches(error, TRANSIENT_ERRORS, TRANSIENT_MARKERS)
+
+
+def endpoint_concurrency(endpoint: str) -> int:
+    """
+    Worker threads that can share an endpoint's budget without any of them
+    waiting longer than RATE_LIMIT_MAX_WAIT for a token. Size pools that call
+    the provider with this.
+    """
+    rate, _ = PROVIDER_BUDGETS[endpoint]
+    return max(1, int(rate * RATE_LIMIT_MAX_WAIT))
+
+
+class GuardedProvider(MarketDataProvider):
+    """
+    Wraps a live provider with per-endpoint token-bucket rate limits,
+    jittered retry of transient errors and a shared circuit breaker.
+
+    While the breaker is open every call raises ProviderUnavailableError
+    immediately, so callers fall back to cached or stale data instead of
+    waiting on a throttled provider.
+    """
+
+    def __init__(self, inner: MarketDataProvider, budgets: Optional[Dict[str, tuple]] = None) -> None:
+        self.inner = inner
+        self.name = inner.name
+        self.buckets = {endpoint: TokenBucket(rate, capacity)
+                        for endpoint, (rate, capacity) in (budgets or PROVIDER_BUDGETS).items()}
+        self.breaker = CircuitBreaker(inner.name, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+
+    def _call(self, endpoint: str, fn, *args, **kwargs):
+        def throttle():
+            # Local backpressure: raised before the breaker is consulted, so a
+            # busy budget never counts as a provider failure
+            if not self.buckets[endpoint].acquire(RATE_LIMIT_MAX_WAIT):
+                raise RateLimitedError(f"{self.name} {endpoint} rate limit exceeded")
+        return call_with_retry(lambda: fn(*args, **kwargs), is_transient_error, attempts=RETRY_ATTEMPTS,
+                               breaker=self.breaker, throttle=throttle)
+
+    def history(self, symbol, start=None, end=None, period=None):
+        return self._call('history', self.inner.history, symbol, start=start, end=end, period=period)
+
+    def splits(self, symbol):
+        return self._call('splits', self.inner.splits, symbol)
+
+    def info(self, symbol):
+        return self._call('info', self.inner.info, symbol)
+
+    def calendar(self, symbol):
+        return self._call('calendar', self.inner.calendar, symbol)
+
+    def download(self, symbols, period='1d'):
+        return self._call('download', self.inner.download, symbols, period=period)
+
+    def stats(self):
+        return {
+            'provider': self.name,
+            'circuit_breaker': self.breaker.stats(),
+            'rate_limits': {endpoint: bucket.stats() for endpoint, bucket in self.buckets.items()}
+        }
+
+
+def create_provider(name: Optional[str] = None, fixture_dir: Optional[str] = None) -> MarketDataProvider:
+    """
+    Build a provider by name, defaulting to the MARKET_DATA_PROVIDER and
+    MARKET_DATA_FIXTURES environment variables. Live providers are wrapped
+    in a GuardedProvider; replayed fixtures are served unguarded.
+
+    Args:
+        name: 'yfinance', 'replay' or 'record'
+        fixture_dir: Fixture directory for the replay/record providers
+
+    Returns:
+        MarketDataProvider instance
+
+    Raises:
+        ValueError: If the provider name is unknown
+    """
+    name = (name or os.getenv(PROVIDER_ENV) or 'yfinance').lower()
+    fixture_dir = fixture_dir or os.getenv(FIXTURES_ENV) or DEFAULT_FIXTURE_DIR
+    if name == 'yfinance':
+        return GuardedProvider(YFinanceProvider())
+    if name == 'replay':
+        return ReplayProvider(fixture_dir)
+    if name == 'record':
+        return RecordingProvider(GuardedProvider(YFinanceProvider()), fixture_dir)
+    raise ValueError(f"Unknown market data provider: {name}")
+
+
+_provider: Optional[MarketDataProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_market_data_provider() -> MarketDataProvider:
+    """Get the process-wide provider, creating it from the environment on first use."""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = create_provider()
+            logger.info(f"Using market data provider: {_provider.name}")
+        return _provider
+
+
+def set_market_data_provider(provider: MarketDataProvider) -> None:
+    """Replace the process-wide provider, e.g. with a ReplayProvider in benchmarks."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
+
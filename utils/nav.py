@@ -0,0 +1,234 @@
+import logging
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils.market_data import endpoint_concurrency
+from utils.price_store import read_close_matrix
+from utils.split_index import SplitIndex, lookup_split_indexes
+
+logger = logging.getLogger(__name__)
+
+TRADING_DAYS_PER_YEAR = 252
+LOOKBACK_DAYS = 7  # Closes read before a symbol's first fill, to cover weekends and holidays
+
+SplitIndexLookup = Callable[[str], SplitIndex]
+
+
+def price_windows(fills: pd.DataFrame, end: date) -> Dict[str, tuple]:
+    """
+    symbol -> [start, end) dates whose closes are needed: from shortly before
+    the first fill (so a fill on a non-trading day is valued at the previous
+    close) to the end for symbols still held, or to the last fill for closed ones.
+    """
+    grouped = fills.groupby('Symbol', sort=True)
+    held = grouped['Qty'].sum().abs() > 1e-9
+    first, last = grouped['Date'].min(), grouped['Date'].max()
+    stop = end + timedelta(days=1)
+    return {
+        symbol: (pd.Timestamp(first[symbol]).date() - timedelta(days=LOOKBACK_DAYS),
+                 stop if held[symbol] else min(pd.Timestamp(last[symbol]).date() + timedelta(days=1), stop))
+        for symbol in first.index
+    }
+
+
+def prepare_fills(transactions: pd.DataFrame, split_index_for: SplitIndexLookup) -> pd.DataFrame:
+    """
+    Select the fills that move holdings and cash, with quantities and prices
+    split-adjusted to today's share units (the units of the stored
+    split-only closes).
+
+    Args:
+        transactions: Canonical transactions frame (e.g. load_transactions_snapshot())
+        split_index_for: Callable returning a symbol's SplitIndex
+
+    Returns:
+        DataFrame with Symbol, Date (datetime64[D]), Qty (signed, adjusted),
+        Price (adjusted) and Flow (cash in for buys, negative proceeds for sells)
+    """
+    fills = transactions.loc[transactions['Qty'].notna() & transactions['AveragePrice'].notna() &
+                             (transactions['Qty'] > 0),
+                             ['Symbol', 'Date', 'Side', 'Qty', 'AveragePrice', 'Fees']]
+    days = fills['Date'].to_numpy(dtype='datetime64[D]')
+    qty = fills['Qty'].to_numpy(dtype=float)
+    price = fills['AveragePrice'].to_numpy(dtype=float)
+    fees = fills['Fees'].fillna(0).to_numpy(dtype=float)
+    is_buy = (fills['Side'] == 'buy').to_numpy()
+
+    # Cash flows don't depend on share units
+    gross = qty * price
+    flow = np.where(is_buy, gross + fees, -(gross - fees))
+
+    adjusted_qty, adjusted_price = qty.copy(), price.copy()
+    symbols = fills['Symbol'].to_numpy()
+    for symbol, positions in pd.Series(np.arange(len(fills))).groupby(symbols).groups.items():
+        index = split_index_for(symbol)
+        if not len(index):
+            continue
+        rows = np.asarray(positions)
+        p, q = index.adjust(price[rows], qty[rows], days[rows])
+        total_ratio = index.prefix[-1]
+        adjusted_price[rows], adjusted_qty[rows] = p / total_ratio, q * total_ratio
+
+    return pd.DataFrame({
+        'Symbol': symbols,
+        'Date': days,
+        'Qty': np.where(is_buy, adjusted_qty, -adjusted_qty),
+        'Price': adjusted_price,
+        'Flow': flow,
+    })
+
+
+def compute_nav(fills: pd.DataFrame, closes: pd.DataFrame,
+                start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Compute daily portfolio value, cash flows and time-weighted returns.
+
+    Holdings are a dates x symbols matrix of cumulative fills; prices are the
+    stored split-only closes carried forward, falling back to the last fill
+    price where no close is stored yet. Money is assumed to come in for every buy and go
+    out with every sell, so the daily return is
+
+        r_t = (NAV_t + outflow_t) / (NAV_{t-1} + inflow_t) - 1
+
+    which is chained into the time-weighted return.
+
+    Args:
+        fills: Output of prepare_fills()
+        closes: dates x symbols closes (read_close_matrix()); columns may be a subset
+        start: First date reported (default the first fill)
+        end: Last date reported, inclusive (default today)
+
+    Returns:
+        Dictionary with dates, nav, net_flow, invested, pnl, daily_return and
+        twr lists plus a summary
+    """
+    end = np.datetime64(end or date.today(), 'D')
+    fills = fills[fills['Date'].to_numpy(dtype='datetime64[D]') <= end]
+    if fills.empty:
+        return _empty_nav()
+
+    columns, symbols = pd.factorize(fills['Symbol'], sort=True)
+    fill_days = fills['Date'].to_numpy(dtype='datetime64[D]')
+    close_days = closes.index.to_numpy(dtype='datetime64[D]')
+    dates = np.union1d(close_days[(close_days >= fill_days.min()) & (close_days <= end)], np.unique(fill_days))
+    rows = np.searchsorted(dates, fill_days)
+    shape = (len(dates), len(symbols))
+
+    holdings = np.zeros(shape)
+    np.add.at(holdings, (rows, columns), fills['Qty'].to_numpy())
+    holdings = np.cumsum(holdings, axis=0)
+    # Float residue from sells would otherwise value closed positions at dust
+    holdings[np.abs(holdings) < 1e-9] = 0.0
+
+    prices = closes.reindex(columns=symbols).reindex(pd.DatetimeIndex(dates), method='ffill').to_numpy()
+    # Last fill price per (date, symbol) as a fallback mark, carried forward
+    last_fill = pd.DataFrame({'row': rows, 'column': columns, 'price': fills['Price'].to_numpy()}) \
+        .drop_duplicates(['row', 'column'], keep='last')
+    marks = np.full(shape, np.nan)
+    marks[last_fill['row'].to_numpy(), last_fill['column'].to_numpy()] = last_fill['price'].to_numpy()
+    marks = pd.DataFrame(marks).ffill().to_numpy()
+    prices = np.where(np.isnan(prices), marks, prices)
+
+    nav = np.nansum(holdings * prices, axis=1)
+    flows = fills['Flow'].to_numpy()
+    inflow = np.bincount(rows, weights=np.where(flows > 0, flows, 0.0), minlength=len(dates))
+    outflow = np.bincount(rows, weights=np.where(flows < 0, -flows, 0.0), minlength=len(dates))
+
+    previous = np.concatenate(([0.0], nav[:-1]))
+    denominator = previous + inflow
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily = np.where(denominator > 0, (nav + outflow) / denominator - 1.0, 0.0)
+    growth = np.cumprod(1.0 + daily)
+    invested = np.cumsum(inflow - outflow)
+
+    first = 0
+    if start is not None:
+        first = int(np.searchsorted(dates, np.datetime64(start, 'D')))
+        if first >= len(dates):
+            return _empty_nav()
+    # Rebase to the close before the first reported day, so its return is included
+    base = growth[first - 1] if first > 0 else 1.0
+    twr = growth[first:] / base - 1.0
+    daily = daily[first:]
+    nav, invested = nav[first:], invested[first:]
+    net_flow = (inflow - outflow)[first:]
+    dates = dates[first:]
+
+    index = 1.0 + twr
+    drawdown = index / np.maximum.accumulate(index) - 1.0
+    years = (dates[-1] - dates[0]).astype(int) / 365.25
+    summary = {
+        'start': str(dates[0]),
+        'end': str(dates[-1]),
+        'nav': round(float(nav[-1]), 2),
+        'invested': round(float(invested[-1]), 2),
+        'pnl': round(float(nav[-1] - invested[-1]), 2),
+        'twr': round(float(twr[-1]), 6),
+        'annualized_twr': round(float(index[-1] ** (1 / years) - 1), 6) if years >= 1 and index[-1] > 0 else None,
+        'volatility': round(float(np.std(daily[1:]) * np.sqrt(TRADING_DAYS_PER_YEAR)), 6) if len(daily) > 2 else None,
+        'max_drawdown': round(float(drawdown.min()), 6),
+        'symbols': len(symbols),
+    }
+    return {
+        'dates': dates.astype(str).tolist(),
+        'nav': np.round(nav, 2).tolist(),
+        'net_flow': np.round(net_flow, 2).tolist(),
+        'invested': np.round(invested, 2).tolist(),
+        'pnl': np.round(nav - invested, 2).tolist(),
+        'daily_return': np.round(daily, 6).tolist(),
+        'twr': np.round(twr, 6).tolist(),
+        'summary': summary,
+    }
+
+
+def _empty_nav() -> Dict[str, Any]:
+    return {'dates': [], 'nav': [], 'net_flow': [], 'invested': [], 'pnl': [], 'daily_return': [], 'twr': [],
+            'summary': None, 'degraded': []}
+
+
+def build_nav(conn, transactions: pd.DataFrame, split_index_for: SplitIndexLookup,
+              start: Optional[date] = None, end: Optional[date] = None,
+              ensure_prices: Optional[Callable[[Dict[str, tuple]], None]] = None,
+              max_workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Build the portfolio's daily NAV and time-weighted return series from the
+    transactions and the local price store.
+
+    Split indexes are looked up concurrently. A symbol whose lookup fails
+    is left out rather than valued with its fills in pre-split units, and
+    is listed in the result's degraded list.
+
+    Args:
+        conn: Open SQLite connection
+        transactions: Canonical transactions frame (e.g. load_transactions_snapshot())
+        split_index_for: Callable returning a symbol's SplitIndex, raising
+            if the splits can't be fetched
+        start: First date reported (default the first fill)
+        end: Last date reported, inclusive (default today)
+        ensure_prices: Optional callable given symbol -> (start, end) windows,
+            called before reading closes so missing bars can be fetched
+        max_workers: Number of concurrent split lookups (default: what the
+            provider's splits budget sustains)
+
+    Returns:
+        See compute_nav(), plus degraded (symbols left out)
+    """
+    end = end or date.today()
+    symbols = sorted(transactions['Symbol'].dropna().unique())
+    indexes = lookup_split_indexes(symbols, split_index_for, max_workers or endpoint_concurrency('splits'))
+    degraded = [symbol for symbol in symbols if indexes[symbol] is None]
+    if degraded:
+        transactions = transactions[~transactions['Symbol'].isin(degraded)]
+
+    fills = prepare_fills(transactions, indexes.__getitem__)
+    if fills.empty:
+        return dict(_empty_nav(), degraded=degraded)
+
+    windows = price_windows(fills, end)
+    if ensure_prices is not None:
+        ensure_prices(windows)
+    closes = read_close_matrix(conn, windows)
+    return dict(compute_nav(fills, closes, start, end), degraded=degraded)
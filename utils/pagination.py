@@ -0,0 +1,116 @@
+import base64
+import binascii
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Transactions are listed newest first by (Timestamp, Id). Timestamp is Date and
+# Time combined and never NULL, and Id breaks ties between fills in the same second.
+NEWEST_FIRST = 'ORDER BY Timestamp DESC, Id DESC'
+OLDEST_FIRST = 'ORDER BY Timestamp ASC, Id ASC'
+
+
+def encode_cursor(row) -> str:
+    """Encode a transaction's (Timestamp, Id) sort key as an opaque URL-safe token."""
+    raw = f"{row['Timestamp']}|{row['Id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Decode a cursor token back to (Timestamp, Id), or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+    except (binascii.Error, ValueError):
+        return None
+    timestamp, sep, transaction_id = raw.partition('|')
+    return (timestamp, transaction_id) if sep else None
+
+
+def _where(filters: Sequence[str]) -> str:
+    return f"WHERE {' AND '.join(filters)}" if filters else ''
+
+
+def fetch_transaction_page(conn, filters: Sequence[str], params: Sequence[Any], per_page: int,
+                           after: Optional[Tuple[str, str]] = None,
+                           before: Optional[Tuple[str, str]] = None,
+                           last_page_size: Optional[int] = None) -> List:
+    """
+    Fetch one page of transactions, newest first, by seeking on (Timestamp, Id)
+    instead of skipping rows with OFFSET, so every page costs the same.
+
+    Args:
+        conn: Open SQLite connection
+        filters: SQL conditions ANDed together (e.g. 'Symbol = ?')
+        params: Parameters for the filters
+        per_page: Page size
+        after: Sort key of the last row of the previous page (next page)
+        before: Sort key of the first row of the following page (previous page)
+        last_page_size: Fetch the oldest rows instead (last page) with this many rows
+
+    Returns:
+        List of transaction rows, newest first
+    """
+    filters = list(filters)
+    params = list(params)
+    order = NEWEST_FIRST
+    limit = per_page
+    reverse = False
+
+    if after is not None:
+        filters.append('(Timestamp, Id) < (?, ?)')
+        params.extend(after)
+    elif before is not None:
+        filters.append('(Timestamp, Id) > (?, ?)')
+        params.extend(before)
+        order, reverse = OLDEST_FIRST, True
+    elif last_page_size is not None:
+        order, reverse, limit = OLDEST_FIRST, True, last_page_size
+
+    rows = conn.execute(
+        f'SELECT * FROM transactions {_where(filters)} {order} LIMIT ?',
+        params + [limit]
+    ).fetchall()
+    if reverse:
+        rows.reverse()
+    return rows
+
+
+def transaction_summary(conn, filters: Sequence[str], params: Sequence[Any]) -> Dict[str, Any]:
+    """
+    Count and total the matching transactions in one aggregate query.
+
+    Args:
+        conn: Open SQLite connection
+        filters: SQL conditions ANDed together
+        params: Parameters for the filters
+
+    Returns:
+        Dictionary with total, first_date, last_date and stats (shares and
+        amounts bought and sold, rounded for display)
+    """
+    row = conn.execute(f'''
+        SELECT
+            COUNT(*) AS total,
+            MIN(Date) AS first_date,
+            MAX(Date) AS last_date,
+            SUM(CASE WHEN LOWER(Side) = 'buy' THEN Qty END) AS stocks_bought,
+            SUM(CASE WHEN LOWER(Side) = 'sell' THEN Qty END) AS stocks_sold,
+            SUM(CASE WHEN LOWER(Side) = 'buy' THEN Qty * AveragePrice END) AS amount_bought,
+            SUM(CASE WHEN LOWER(Side) = 'sell' THEN Qty * AveragePrice END) AS amount_sold
+        FROM transactions
+        {_where(filters)}
+    ''', list(params)).fetchone()
+    return {
+        'total': row['total'],
+        'first_date': row['first_date'],
+        'last_date': row['last_date'],
+        'stats': {
+            'total_stocks_bought': round(row['stocks_bought'] or 0, 2),
+            'total_stocks_sold': round(row['stocks_sold'] or 0, 2),
+            'total_amount_bought': round(row['amount_bought'] or 0, 2),
+            'total_amount_sold': round(row['amount_sold'] or 0, 2)
+        }
+    }
@@ -0,0 +1,183 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Share counts below this are treated as a closed position (float residue from sells)
+MIN_OPEN_SHARES = 1e-9
+
+POSITIONS_DDL = '''
+CREATE TABLE IF NOT EXISTS positions (
+    symbol TEXT PRIMARY KEY,
+    name TEXT,
+    shares REAL NOT NULL DEFAULT 0,
+    net_cost REAL NOT NULL DEFAULT 0,
+    buy_qty REAL NOT NULL DEFAULT 0,
+    buy_cost REAL NOT NULL DEFAULT 0,
+    last_price REAL,
+    first_trade TEXT,
+    last_trade TEXT,
+    trade_count INTEGER NOT NULL DEFAULT 0
+)
+'''
+
+# Column aliases match the names the pages used with the old GROUP BY query
+POSITION_SELECT = '''
+    SELECT
+        symbol AS Symbol,
+        name AS Name,
+        shares AS CurrentShares,
+        net_cost AS TotalInvestment,
+        buy_cost / NULLIF(buy_qty, 0) AS AverageCost,
+        last_price AS LastPrice,
+        first_trade AS FirstTrade,
+        last_trade AS LastTrade
+    FROM positions
+'''
+
+POSITION_ORDERS = {
+    'value': 'shares * COALESCE(last_price, 0) DESC, symbol',
+    'symbol': 'symbol',
+}
+
+
+def init_positions(conn) -> None:
+    """
+    Create the positions table if it doesn't exist.
+
+    Args:
+        conn: Open SQLite connection
+    """
+    conn.execute(POSITIONS_DDL)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_positions_open ON positions (shares)')
+
+
+def _fill_deltas(fills: Iterable[Sequence]) -> Dict[str, dict]:
+    """
+    Aggregate fills into one delta per symbol.
+
+    Each fill is (symbol, name, side, qty, price, timestamp). Buys add to
+    shares and cost, every other side subtracts, matching the old
+    SUM(CASE WHEN Side = 'buy' ...) aggregation.
+    """
+    deltas: Dict[str, dict] = {}
+    for symbol, name, side, qty, price, timestamp in fills:
+        delta = deltas.get(symbol)
+        if delta is None:
+            delta = deltas[symbol] = {
+                'symbol': symbol, 'name': name, 'shares': 0.0, 'net_cost': 0.0,
+                'buy_qty': 0.0, 'buy_cost': 0.0, 'last_price': None,
+                'first_trade': timestamp, 'last_trade': timestamp,
+                'price_trade': None, 'trade_count': 0
+            }
+        is_buy = side == 'buy'
+        sign = 1 if is_buy else -1
+        delta['trade_count'] += 1
+        if qty is not None:
+            delta['shares'] += sign * qty
+            if price is not None:
+                delta['net_cost'] += sign * qty * price
+                if is_buy:
+                    delta['buy_qty'] += qty
+                    delta['buy_cost'] += qty * price
+        if timestamp < delta['first_trade']:
+            delta['first_trade'] = timestamp
+        if timestamp >= delta['last_trade']:
+            delta['last_trade'] = timestamp
+            delta['name'] = name or delta['name']
+        if price is not None and (delta['price_trade'] is None or timestamp >= delta['price_trade']):
+            delta['price_trade'] = timestamp
+            delta['last_price'] = price
+    return deltas
+
+
+def apply_fills(conn, fills: Iterable[Sequence]) -> int:
+    """
+    Incrementally fold newly ingested fills into the positions table.
+
+    Args:
+        conn: Open SQLite connection (the caller commits)
+        fills: Iterable of (symbol, name, side, qty, price, timestamp) tuples
+
+    Returns:
+        Number of symbols whose position changed
+    """
+    deltas = _fill_deltas(fills)
+    if not deltas:
+        return 0
+    conn.executemany('''
+        INSERT INTO positions (symbol, name, shares, net_cost, buy_qty, buy_cost, last_price,
+                               first_trade, last_trade, trade_count)
+        VALUES (:symbol, :name, :shares, :net_cost, :buy_qty, :buy_cost, :last_price,
+                :first_trade, :last_trade, :trade_count)
+        ON CONFLICT(symbol) DO UPDATE SET
+            name = CASE WHEN excluded.last_trade >= positions.last_trade
+                        THEN COALESCE(excluded.name, positions.name) ELSE positions.name END,
+            shares = positions.shares + excluded.shares,
+            net_cost = positions.net_cost + excluded.net_cost,
+            buy_qty = positions.buy_qty + excluded.buy_qty,
+            buy_cost = positions.buy_cost + excluded.buy_cost,
+            last_price = CASE WHEN excluded.last_price IS NOT NULL AND excluded.last_trade >= positions.last_trade
+                              THEN excluded.last_price ELSE COALESCE(positions.last_price, excluded.last_price) END,
+            first_trade = MIN(positions.first_trade, excluded.first_trade),
+            last_trade = MAX(positions.last_trade, excluded.last_trade),
+            trade_count = positions.trade_count + excluded.trade_count
+    ''', list(deltas.values()))
+    return len(deltas)
+
+
+def rebuild_positions(conn, symbols: Optional[Iterable[str]] = None) -> int:
+    """
+    Recompute positions from the transactions table, for all symbols or only
+    the given ones (e.g. after rows were deleted or edited).
+
+    Args:
+        conn: Open SQLite connection (the caller commits)
+        symbols: Symbols to rebuild, or None for every symbol
+
+    Returns:
+        Number of symbols rebuilt
+    """
+    if symbols is None:
+        conn.execute('DELETE FROM positions')
+        cursor = conn.execute('''
+            SELECT Symbol, Name, Side, Qty, AveragePrice, Timestamp
+            FROM transactions
+            ORDER BY Date, Time
+        ''')
+    else:
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return 0
+        placeholders = ', '.join('?' for _ in symbols)
+        conn.execute(f'DELETE FROM positions WHERE symbol IN ({placeholders})', symbols)
+        cursor = conn.execute(f'''
+            SELECT Symbol, Name, Side, Qty, AveragePrice, Timestamp
+            FROM transactions
+            WHERE Symbol IN ({placeholders})
+            ORDER BY Date, Time
+        ''', symbols)
+    return apply_fills(conn, (tuple(row) for row in cursor))
+
+
+def get_open_positions(conn, order: str = 'value') -> List:
+    """
+    Get every position with shares held.
+
+    Args:
+        conn: Open SQLite connection
+        order: 'value' (shares x last trade price, largest first) or 'symbol'
+
+    Returns:
+        Rows with Symbol, Name, CurrentShares, TotalInvestment, AverageCost,
+        LastPrice, FirstTrade and LastTrade
+    """
+    return conn.execute(
+        f'{POSITION_SELECT} WHERE shares > ? ORDER BY {POSITION_ORDERS[order]}',
+        (MIN_OPEN_SHARES,)
+    ).fetchall()
+
+
+def get_position(conn, symbol: str):
+    """Get the position row for one symbol (open or closed), or None if it was never traded."""
+    return conn.execute(f'{POSITION_SELECT} WHERE symbol = ?', (symbol,)).fetchone()
@@ -0,0 +1,335 @@
+import time
+import logging
+from datetime import datetime, date, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Re-fetch the still-forming bar for today at most this often
+TAIL_REFRESH_SECONDS = 300
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+OHLC_COLUMNS = ['Open', 'High', 'Low', 'Close']
+SPLIT_CLOSE = 'SplitClose'  # See utils.market_data
+DIVIDENDS = 'Dividends'
+
+HistoryFetcher = Callable[[str, date, date], pd.DataFrame]
+
+
+def create_price_tables(conn) -> None:
+    """
+    Create the daily-bar tables if they don't exist, without committing.
+
+    `price_history` holds one row per (symbol, trading day), with prices
+    adjusted for splits only and the dividend paid on that day, if it is an
+    ex-date. Dividend adjustment is applied when bars are read, so bars
+    fetched before and after a new dividend stay consistent. `price_coverage`
+    records the contiguous date window [start_date, end_date) that has been
+    fetched from the provider for each symbol, so that non-trading days are
+    not mistaken for holes.
+
+    Args:
+        conn: Open SQLite connection
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS price_history (
+        symbol TEXT NOT NULL,
+        date TEXT NOT NULL,
+        open REAL,
+        high REAL,
+        low REAL,
+        close REAL,
+        volume REAL,
+        dividend REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (symbol, date)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS price_coverage (
+        symbol TEXT PRIMARY KEY,
+        start_date TEXT NOT NULL,
+        end_date TEXT NOT NULL,
+        last_split TEXT,
+        refreshed_at REAL NOT NULL
+    )
+    ''')
+
+
+def init_price_store(conn) -> None:
+    """
+    Create the daily-bar tables if they don't exist (see create_price_tables()).
+
+    Args:
+        conn: Open SQLite connection
+    """
+    create_price_tables(conn)
+    conn.commit()
+
+
+def _to_date(value) -> date:
+    """Normalize a datetime/date/ISO string to a date."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def _get_coverage(conn, symbol: str) -> Optional[Tuple[date, date, str, float]]:
+    row = conn.execute(
+        'SELECT start_date, end_date, last_split, refreshed_at FROM price_coverage WHERE symbol = ?',
+        (symbol,)
+    ).fetchone()
+    if row is None:
+        return None
+    return _to_date(row[0]), _to_date(row[1]), row[2] or '', row[3]
+
+
+def _missing_ranges(coverage, start: date, end: date, today: date) -> List[Tuple[date, date]]:
+    """
+    Work out which [start, end) windows must come from the provider.
+
+    Coverage is kept contiguous: a request that lies entirely before or after
+    the stored window also fetches the gap between them.
+    """
+    if coverage is None:
+        return [(start, end)]
+
+    cov_start, cov_end, _, refreshed_at = coverage
+    ranges = []
+    if start < cov_start:
+        ranges.append((start, cov_start))
+    if end > cov_end:
+        # Only today's bar is outstanding; re-fetch it on a short timer
+        tail_is_today_only = cov_end >= today
+        if not tail_is_today_only or time.time() - refreshed_at >= TAIL_REFRESH_SECONDS:
+            ranges.append((cov_end, end))
+    return ranges
+
+
+def _store_bars(conn, symbol: str, hist: pd.DataFrame) -> int:
+    if hist is None or hist.empty:
+        return 0
+    dates = hist.index.strftime('%Y-%m-%d')
+    frame = hist.reindex(columns=PRICE_COLUMNS + [SPLIT_CLOSE, DIVIDENDS])
+    # Undo the provider's dividend adjustment; bars without a split-only close
+    # (fixtures recorded before it existed) are stored as they are
+    factor = (frame[SPLIT_CLOSE] / frame['Close']).where(frame[SPLIT_CLOSE].notna() & (frame['Close'] != 0), 1.0)
+    for column in OHLC_COLUMNS:
+        frame[column] = frame[column] * factor
+    frame[DIVIDENDS] = frame[DIVIDENDS].fillna(0.0)
+    rows = [
+        (symbol, d, *(None if pd.isna(v) else float(v) for v in values))
+        for d, values in zip(dates, frame[PRICE_COLUMNS + [DIVIDENDS]].itertuples(index=False, name=None))
+    ]
+    conn.executemany('''
+        INSERT OR REPLACE INTO price_history (symbol, date, open, high, low, close, volume, dividend)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    return len(rows)
+
+
+def invalidate_symbol(conn, symbol: str) -> None:
+    """
+    Drop all stored bars for a symbol, e.g. after a new split changes the
+    provider's adjusted history.
+    """
+    conn.execute('DELETE FROM price_history WHERE symbol = ?', (symbol,))
+    conn.execute('DELETE FROM price_coverage WHERE symbol = ?', (symbol,))
+    conn.commit()
+
+
+def _dividend_factors(conn, symbol: str, dates: np.ndarray) -> np.ndarray:
+    """
+    Dividend adjustment factor for each date: the product of
+    (1 - dividend / previous close) over the stored ex-dates after it, as
+    in the provider's Adj Close, relative to the newest stored bar.
+    """
+    if not len(dates):
+        return np.ones(0)
+    events = conn.execute('''
+        SELECT d.date, d.dividend,
+               (SELECT p.close FROM price_history p
+                WHERE p.symbol = d.symbol AND p.date < d.date ORDER BY p.date DESC LIMIT 1)
+        FROM price_history d
+        WHERE d.symbol = ? AND d.date > ? AND d.dividend > 0
+        ORDER BY d.date
+    ''', (symbol, str(dates[0]))).fetchall()
+    steps = [1 - dividend / close if close and 0 < dividend < close else 1.0 for _, dividend, close in events]
+    if not steps:
+        return np.ones(len(dates))
+    ex_dates = np.array([row[0] for row in events], dtype='datetime64[D]')
+    # after[k]: product of the steps of ex-dates k onwards
+    after = np.append(np.cumprod(np.array(steps)[::-1])[::-1], 1.0)
+    return after[np.searchsorted(ex_dates, dates, side='right')]
+
+
+def read_bars(conn, symbol: str, start_date, end_date) -> pd.DataFrame:
+    """
+    Read stored daily bars for [start_date, end_date) without touching the provider.
+
+    Returns:
+        DataFrame indexed by a DatetimeIndex with Open/High/Low/Close/Volume
+        columns, prices adjusted for splits and dividends
+    """
+    rows = conn.execute('''
+        SELECT date, open, high, low, close, volume
+        FROM price_history
+        WHERE symbol = ? AND date >= ? AND date < ?
+        ORDER BY date
+    ''', (symbol, _to_date(start_date).isoformat(), _to_date(end_date).isoformat())).fetchall()
+
+    frame = pd.DataFrame([tuple(r) for r in rows], columns=['Date'] + PRICE_COLUMNS)
+    frame.index = pd.DatetimeIndex(pd.to_datetime(frame.pop('Date')), name='Date')
+    factors = _dividend_factors(conn, symbol, frame.index.values.astype('datetime64[D]'))
+    for column in OHLC_COLUMNS:
+        frame[column] = frame[column].astype(float) * factors
+    return frame
+
+
+def _anchor_date(conn, symbol: str, fetch_start: date, fetch_end: date, coverage) -> Optional[date]:
+    """Stored bar next to a head or tail gap, re-fetched with it so an empty answer can be told apart."""
+    if coverage is None:
+        return None
+    if fetch_end <= coverage[0]:
+        row = conn.execute('SELECT MIN(date) FROM price_history WHERE symbol = ? AND date >= ?',
+                           (symbol, coverage[0].isoformat())).fetchone()
+    elif fetch_start >= coverage[1]:
+        row = conn.execute('SELECT MAX(date) FROM price_history WHERE symbol = ? AND date < ?',
+                           (symbol, coverage[1].isoformat())).fetchone()
+    else:
+        return None
+    return _to_date(row[0]) if row and row[0] else None
+
+
+def get_daily_bars(conn, symbol: str, start_date, end_date,
+                   fetch_history: HistoryFetcher, last_split: Optional[str] = None) -> pd.DataFrame:
+    """
+    Return daily bars for [start_date, end_date), reading from the local store
+    first and fetching only the missing head/tail from the provider.
+
+    Args:
+        conn: Open SQLite connection
+        symbol: Stock symbol
+        start_date: Inclusive start (date, datetime or YYYY-MM-DD string)
+        end_date: Exclusive end (date, datetime or YYYY-MM-DD string)
+        fetch_history: Callable (symbol, start, end) -> DataFrame used to fill gaps
+        last_split: Date of the most recent known split; if it differs from the
+            one recorded when the bars were stored, the symbol is re-fetched
+            because the provider's split-adjusted history has changed
+
+    Returns:
+        DataFrame indexed by a DatetimeIndex with Open/High/Low/Close/Volume columns
+    """
+    start = _to_date(start_date)
+    end = _to_date(end_date)
+    today = date.today()
+
+    coverage = _get_coverage(conn, symbol)
+    if coverage is not None and last_split is not None and coverage[2] != last_split:
+        logger.info(f"New split detected for {symbol}, discarding stored price history")
+        invalidate_symbol(conn, symbol)
+        coverage = None
+
+    missing = _missing_ranges(coverage, start, end, today)
+    if missing:
+        fetched = 0
+        for fetch_start, fetch_end in missing:
+            # Include a stored bar next to the gap: if the provider returns
+            # nothing at all, not even that bar, it didn't really answer
+            # (throttled), and the gap is left uncovered to be retried
+            anchor = _anchor_date(conn, symbol, fetch_start, fetch_end, coverage)
+            request_start = min(fetch_start, anchor) if anchor else fetch_start
+            request_end = max(fetch_end, anchor + timedelta(days=1)) if anchor else fetch_end
+            try:
+                hist = fetch_history(symbol, request_start, request_end)
+            except Exception as e:
+                logger.error(f"Error filling price history for {symbol} {fetch_start}..{fetch_end}: {e}")
+                continue
+            stored = _store_bars(conn, symbol, hist)
+            if not stored:
+                logger.warning(f"No bars returned for {symbol} {fetch_start}..{fetch_end}; leaving the window uncovered")
+                continue
+            fetched += stored
+
+            # Bars before today are final, so today itself is never marked covered
+            fetch_end = min(fetch_end, today)
+            if coverage is None:
+                coverage = (fetch_start, max(fetch_end, fetch_start), last_split or '', time.time())
+            else:
+                coverage = (min(coverage[0], fetch_start), max(coverage[1], fetch_end),
+                            last_split if last_split is not None else coverage[2], time.time())
+
+        if coverage is not None:
+            conn.execute('''
+                INSERT OR REPLACE INTO price_coverage (symbol, start_date, end_date, last_split, refreshed_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (symbol, coverage[0].isoformat(), coverage[1].isoformat(), coverage[2], coverage[3]))
+        conn.commit()
+        logger.info(f"Price store filled {fetched} bars for {symbol} across {len(missing)} gap(s)")
+
+    return read_bars(conn, symbol, start, end)
+
+
+def uncovered_symbols(conn, windows: Dict[str, Tuple[Any, Any]],
+                      last_splits: Optional[Dict[str, str]] = None) -> List[str]:
+    """
+    Find symbols whose stored bars don't span their [start, end) window, or
+    were stored before the symbol's latest split, without touching the provider.
+    Today's still-forming bar is not required.
+
+    Args:
+        conn: Open SQLite connection
+        windows: symbol -> (start, end) dates
+        last_splits: symbol -> date of the most recent known split ('' if none)
+
+    Returns:
+        Symbols that need get_daily_bars() before their closes can be read
+    """
+    today = date.today()
+    rows = conn.execute('SELECT symbol, start_date, end_date, last_split FROM price_coverage').fetchall()
+    coverage = {row[0]: (_to_date(row[1]), _to_date(row[2]), row[3] or '') for row in rows}
+    missing = []
+    for symbol, (start, end) in windows.items():
+        covered = coverage.get(symbol)
+        start, end = _to_date(start), min(_to_date(end), today)
+        if (covered is None or start < covered[0] or end > covered[1] or
+                (last_splits is not None and covered[2] != last_splits.get(symbol, covered[2]))):
+            missing.append(symbol)
+    return missing
+
+
+def read_close_matrix(conn, windows: Dict[str, Tuple[Any, Any]]) -> pd.DataFrame:
+    """
+    Read stored split-only closes for many symbols at once as a dates x
+    symbols frame. These match fill prices adjusted to today's share units,
+    so holdings can be valued without dividend adjustment skewing returns.
+
+    Args:
+        conn: Open SQLite connection
+        windows: symbol -> [start, end) dates to read; columns follow this order
+
+    Returns:
+        DataFrame indexed by a DatetimeIndex of every date any symbol has a
+        bar for, NaN where a symbol has none
+    """
+    symbols = list(windows)
+    series = []
+    for symbol in symbols:
+        start, end = windows[symbol]
+        rows = conn.execute(
+            'SELECT date, close FROM price_history '
+            'WHERE symbol = ? AND date >= ? AND date < ? AND close IS NOT NULL',
+            (symbol, _to_date(start).isoformat(), _to_date(end).isoformat())
+        ).fetchall()
+        dates, closes = zip(*rows) if rows else ((), ())
+        series.append((np.array(dates, dtype='datetime64[D]'), np.array(closes, dtype=float)))
+
+    all_dates = np.unique(np.concatenate([dates for dates, _ in series])) if series else np.array([], dtype='datetime64[D]')
+    matrix = np.full((len(all_dates), len(symbols)), np.nan)
+    for column, (dates, closes) in enumerate(series):
+        matrix[np.searchsorted(all_dates, dates), column] = closes
+    return pd.DataFrame(matrix, index=pd.DatetimeIndex(all_dates, name='Date'), columns=symbols)
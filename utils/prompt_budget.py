@@ -0,0 +1,196 @@
+import os
+import re
+import math
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Tokens of context allowed in a prompt, per model ID. The question and the
+# answer are not counted.
+DEFAULT_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '1500'))
+MODEL_BUDGETS = {
+    'sonar': 1500,
+    'sonar-pro': 3000,
+    'sonar-reasoning': 2000,
+    'sonar-reasoning-pro': 3000,
+    'sonar-deep-research': 4000,
+    'gpt-3.5-turbo': 1500,
+}
+
+MIN_LINES = 3  # Fewer lines than this and an item's compact form is used instead
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9]*(?:[.\-][A-Za-z0-9]+)*")  # Words and tickers like BRK.B
+
+
+def _parse_budgets(value: str) -> Dict[str, int]:
+    budgets = {}
+    for entry in value.split(','):
+        model, _, tokens = entry.partition('=')
+        if model.strip() and tokens.strip().isdigit():
+            budgets[model.strip()] = int(tokens)
+        elif entry.strip():
+            logger.warning(f"Ignoring invalid PROMPT_TOKEN_BUDGETS entry: {entry!r}")
+    return budgets
+
+
+# e.g. PROMPT_TOKEN_BUDGETS="sonar=2000,gpt-3.5-turbo=1000"
+MODEL_BUDGETS.update(_parse_budgets(os.getenv('PROMPT_TOKEN_BUDGETS', '')))
+
+
+def budget_for(model: Optional[str]) -> int:
+    """Context token budget for a model ID."""
+    return MODEL_BUDGETS.get(model, DEFAULT_BUDGET)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate the number of BPE tokens in text without a tokenizer.
+
+    Words cost one token per four characters and punctuation one token each,
+    which lands within about 10% of the OpenAI tokenizers on prompt text
+    (slightly over for tickers and numbers, which is the safe side).
+    """
+    return sum(math.ceil(len(piece) / 4) for piece in _PIECE_RE.findall(text or ''))
+
+
+def question_terms(question: str) -> set:
+    """Lowercased words of the question, for keyword matching."""
+    return {word.lower() for word in _WORD_RE.findall(question or '')}
+
+
+class ContextItem:
+    """
+    One block of prompt context.
+
+    The block is `header` followed by `lines`; when it doesn't fit the budget,
+    trailing lines are dropped (lines about the current stock or symbols named
+    in the question are kept first), and failing that the `compact` text, an
+    aggregate summary, is used instead.
+
+    Args:
+        name: Identifier reported in the assembly stats
+        header: First line(s) of the block
+        lines: Rows that may be truncated
+        line_symbols: Symbol each line is about, parallel to lines
+        compact: Shorter replacement for the whole block
+        priority: Base relevance; higher items get budget first
+        symbols: Symbols the block is about
+        keywords: Lowercased words that make the block relevant to a question
+        required: Always included, in compact form if necessary
+        joiner: Separator between lines
+    """
+
+    def __init__(self, name: str, header: str = '', lines: Optional[Sequence[str]] = None,
+                 line_symbols: Optional[Sequence[str]] = None, compact: Optional[str] = None,
+                 priority: float = 0.0, symbols: Iterable[str] = (), keywords: Iterable[str] = (),
+                 required: bool = False, joiner: str = '\n') -> None:
+        self.name = name
+        self.header = header
+        self.lines = list(lines or [])
+        self.line_symbols = list(line_symbols) if line_symbols is not None else None
+        self.compact = compact
+        self.priority = priority
+        self.symbols = set(symbols)
+        self.keywords = set(keywords)
+        self.required = required
+        self.joiner = joiner
+
+    def render(self, lines: Optional[Sequence[str]] = None, omitted: int = 0) -> str:
+        lines = self.lines if lines is None else lines
+        body = self.joiner.join(lines)
+        if omitted:
+            body += f"{self.joiner}... and {omitted} more" if body else f"... {omitted} more"
+        if not self.header:
+            return body
+        return f"{self.header}\n{body}" if body else self.header
+
+
+def relevance(item: ContextItem, terms: set, mentioned: set, current_stock: Optional[str]) -> float:
+    """Score an item: base priority, boosted for the current stock, symbols named in the question and keyword hits."""
+    score = item.priority
+    if current_stock and current_stock in item.symbols:
+        score += 2.0
+    score += 1.5 * len(mentioned & item.symbols)
+    score += 0.5 * len(terms & item.keywords)
+    return score
+
+
+def _fit_lines(item: ContextItem, lines: List[str], budget: int) -> Optional[str]:
+    # Longest prefix of the ranked lines that fits, if it keeps at least MIN_LINES
+    used = estimate_tokens(item.header) + 6  # '... and N more'
+    count = 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        used += cost
+        count += 1
+    if count < min(MIN_LINES, len(lines)):
+        return None
+    return item.render(lines[:count], len(lines) - count)
+
+
+def assemble(items: Sequence[ContextItem], budget: int, question: str = '',
+             current_stock: Optional[str] = None, reserved: str = '') -> Dict[str, Any]:
+    """
+    Fit context items into a token budget.
+
+    Required items are placed first, then the rest by relevance to the
+    question and the current stock. Each item goes in whole if it fits,
+    otherwise truncated, otherwise in compact form, otherwise it is dropped.
+    The included blocks keep their original order.
+
+    Args:
+        items: Candidate context blocks
+        budget: Token budget (see budget_for())
+        question: The user's message
+        current_stock: Symbol of the stock page being viewed
+        reserved: Fixed prompt text (instructions) counted against the budget
+
+    Returns:
+        Dictionary with blocks (name -> text), text (blocks joined by blank
+        lines), tokens, budget, forms (name -> 'full', 'truncated' or
+        'compact') and dropped (names)
+    """
+    terms = question_terms(question)
+    mentioned = {term.upper() for term in terms}
+    ranked = sorted(
+        range(len(items)),
+        key=lambda i: (not items[i].required, -relevance(items[i], terms, mentioned, current_stock), i),
+    )
+    remaining = budget - estimate_tokens(reserved)
+    chosen: Dict[int, str] = {}
+    forms: Dict[str, str] = {}
+    dropped: List[str] = []
+    for i in ranked:
+        item = items[i]
+        lines = item.lines
+        if item.line_symbols is not None:
+            # Stable sort: lines about the stock in view or named in the question first
+            focus = mentioned | ({current_stock} if current_stock else set())
+            order = sorted(range(len(lines)), key=lambda j: item.line_symbols[j] not in focus)
+            lines = [lines[j] for j in order]
+        text, form = item.render(lines), 'full'
+        if estimate_tokens(text) > remaining:
+            text, form = _fit_lines(item, lines, remaining) if lines else None, 'truncated'
+        if text is None and item.compact and (item.required or estimate_tokens(item.compact) <= remaining):
+            text, form = item.compact, 'compact'
+        if text is None:
+            dropped.append(item.name)
+            continue
+        chosen[i] = text
+        forms[item.name] = form
+        remaining -= estimate_tokens(text)
+
+    blocks = {items[i].name: chosen[i] for i in sorted(chosen)}
+    text = '\n\n'.join(blocks.values())
+    return {
+        'blocks': blocks,
+        'text': text,
+        'tokens': estimate_tokens(reserved) + estimate_tokens(text),
+        'budget': budget,
+        'forms': forms,
+        'dropped': dropped,
+    }
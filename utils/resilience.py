@@ -0,0 +1,230 @@
+import time
+import random
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderUnavailableError(RuntimeError):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+
+class RateLimitedError(RuntimeError):
+    """Raised when no rate-limit token became available within the allowed wait."""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens are added per second up to
+    `capacity`, and each call consumes one.
+
+    A caller that has to wait reserves its token up front (the balance goes
+    negative), so waiters are served in arrival order at exactly `rate` per
+    second instead of racing for each new token.
+    """
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.throttled = 0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, max_wait: float = 0.0) -> bool:
+        """
+        Take one token, waiting up to max_wait seconds for one to become available.
+
+        Args:
+            max_wait: Longest time to wait, in seconds
+
+        Returns:
+            True if a token was taken, False if the wait would exceed max_wait
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait + 1e-6:
+                self.throttled += 1
+                return False
+            self._tokens -= 1
+            self.granted += 1
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the configured budget, tokens currently available and counters."""
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                'rate': self.rate,
+                'capacity': self.capacity,
+                'available': round(max(0.0, self._tokens), 2),
+                'granted': self.granted,
+                'throttled': self.throttled
+            }
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open circuit breaker.
+
+    After `failure_threshold` consecutive failures the breaker opens and calls
+    are rejected without reaching the provider. Once `reset_timeout` seconds
+    have passed a single trial call is let through (half-open); its success
+    closes the breaker again and its failure re-opens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 60.0) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self.total_failures = 0
+        self.short_circuited = 0
+        self.times_opened = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.time())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        """Return True if a call may go to the provider now."""
+        with self._lock:
+            state = self._current_state(time.time())
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"Circuit {self.name} closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self, error: BaseException) -> None:
+        with self._lock:
+            self._failures += 1
+            self.total_failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.times_opened += 1
+                    logger.warning(f"Circuit {self.name} opened after {self._failures} failures: {self.last_error}")
+                self._state = self.OPEN
+                self._opened_at = time.time()
+                self._trial_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the breaker state and counters."""
+        with self._lock:
+            now = time.time()
+            state = self._current_state(now)
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout': self.reset_timeout,
+                'retry_in': round(max(0.0, self._opened_at + self.reset_timeout - now), 1) if state == self.OPEN else None,
+                'times_opened': self.times_opened,
+                'total_failures': self.total_failures,
+                'short_circuited': self.short_circuited,
+                'last_error': self.last_error
+            }
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """Exponential backoff with full jitter for the given retry attempt (0-based)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def call_with_retry(fn: Callable[[], Any], is_transient: Callable[[BaseException], bool],
+                    attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0,
+                    breaker: Optional[CircuitBreaker] = None,
+                    throttle: Optional[Callable[[], None]] = None) -> Any:
+    """
+    Call `fn`, retrying transient failures with jittered exponential backoff.
+
+    Only transient failures count against the circuit breaker; other errors
+    (e.g. an unknown symbol) are raised straight away.
+
+    Args:
+        fn: Zero-argument callable
+        is_transient: Returns True for errors worth retrying (throttling, timeouts)
+        attempts: Maximum number of calls
+        base_delay: Backoff base in seconds
+        max_delay: Backoff cap in seconds
+        breaker: Optional circuit breaker checked before and updated after each call
+        throttle: Optional callable run before each call, e.g. to take a
+            rate-limit token; its errors are raised as is and never count
+            against the breaker, since they say nothing about the provider
+
+    Returns:
+        The result of fn
+
+    Raises:
+        ProviderUnavailableError: If the breaker is open
+        Exception: An error from throttle, or the last error from fn
+    """
+    for attempt in range(attempts):
+        if throttle is not None:
+            throttle()
+        if breaker is not None and not breaker.allow():
+            raise ProviderUnavailableError(f"{breaker.name} is unavailable (circuit open)")
+        try:
+            result = fn()
+        except Exception as e:
+            if not is_transient(e):
+                if breaker is not None:
+                    # The provider answered, so it is healthy
+                    breaker.record_success()
+                raise
+            if breaker is not None:
+                breaker.record_failure(e)
+            if attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            logger.warning(f"Transient error ({e}); retrying in {delay:.2f}s")
+            time.sleep(delay)
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+
+def error_matches(error: BaseException, types: Tuple[Type[BaseException], ...], markers: Tuple[str, ...]) -> bool:
+    """True if the error is one of `types` or its message contains one of `markers` (case-insensitive)."""
+    if isinstance(error, types):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in markers)
@@ -0,0 +1,258 @@
+import hashlib
+import logging
+import math
+from typing import Any, Callable, List, Optional, Tuple
+
+from utils.data_version import init_data_versions
+from utils.positions import init_positions, rebuild_positions
+from utils.price_store import create_price_tables
+
+logger = logging.getLogger(__name__)
+
+# Canonical transactions table: numeric columns are REAL and Timestamp
+# ('YYYY-MM-DD HH:MM:SS') combines Date and Time for range scans and ordering
+TRANSACTIONS_DDL = '''
+CREATE TABLE IF NOT EXISTS transactions (
+    Id TEXT NOT NULL,
+    Date TEXT NOT NULL,
+    Time TEXT,
+    Timestamp TEXT NOT NULL,
+    Symbol TEXT NOT NULL,
+    Name TEXT,
+    Type TEXT,
+    Side TEXT,
+    AveragePrice REAL,
+    Qty REAL,
+    State TEXT,
+    Fees REAL,
+    FillHash TEXT
+)
+'''
+
+# Keyset pagination seeks on (Timestamp, Id), newest first
+TIMESTAMP_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions (Timestamp, Id)',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_symbol_timestamp ON transactions (Symbol, Timestamp, Id)',
+]
+
+# Append uploads look fills up by content hash to skip ones already loaded
+FILL_HASH_INDEX = 'CREATE INDEX IF NOT EXISTS idx_transactions_fill_hash ON transactions (FillHash)'
+
+TRANSACTIONS_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_transactions_symbol_date ON transactions (Symbol, Date, Time)',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (Date, Time)',
+] + TIMESTAMP_INDEXES + [FILL_HASH_INDEX]
+
+TRANSACTION_COLUMNS = ['Id', 'Date', 'Time', 'Timestamp', 'Symbol', 'Name', 'Type', 'Side',
+                       'AveragePrice', 'Qty', 'State', 'Fees', 'FillHash']
+
+
+def parse_number(value: Any) -> Optional[float]:
+    """Convert a CSV/legacy TEXT value to float, treating '', 'null' and garbage as NULL."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().replace(',', '').lstrip('$')
+    if not text or text.lower() == 'null':
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _hash_number(value: Any) -> str:
+    if value is None:
+        return ''
+    value = float(value)
+    return '' if math.isnan(value) else repr(value)
+
+
+def fill_hash(date: str, time: Optional[str], symbol: str, side: Optional[str],
+              qty: Optional[float], price: Optional[float]) -> str:
+    """
+    Content hash identifying a fill by date, time, symbol, side, quantity and
+    price, used to recognise fills that were already uploaded.
+    """
+    key = '|'.join([date, time or '', symbol.strip().upper(), (side or '').strip().lower(),
+                    _hash_number(qty), _hash_number(price)])
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+
+_FILL_INDEXES = [TRANSACTION_COLUMNS.index(column)
+                 for column in ('Symbol', 'Name', 'Side', 'Qty', 'AveragePrice', 'Timestamp')]
+
+
+def transaction_fill(row: Tuple) -> Tuple:
+    """Project a canonical transactions row onto the (symbol, name, side, qty, price, timestamp) fill used by positions."""
+    return tuple(row[index] for index in _FILL_INDEXES)
+
+
+INSERT_TRANSACTION_SQL = (
+    f"INSERT INTO transactions ({', '.join(TRANSACTION_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in TRANSACTION_COLUMNS)})"
+)
+
+
+def create_transactions_table(conn) -> None:
+    """Create the canonical transactions table and its indexes if they don't exist."""
+    conn.execute(TRANSACTIONS_DDL)
+    for ddl in TRANSACTIONS_INDEXES:
+        conn.execute(ddl)
+
+
+def drop_transactions_indexes(conn) -> None:
+    """Drop the transactions indexes ahead of a bulk load; create_transactions_table() rebuilds them."""
+    names = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'transactions' AND sql IS NOT NULL"
+    ).fetchall()
+    for (name,) in names:
+        conn.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+
+def _table_columns(conn, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})').fetchall()]
+
+
+def _migrate_typed_transactions(conn) -> None:
+    """
+    Version 1: convert the all-TEXT transactions table written by app.init_db
+    (and the REAL/INTEGER-id table from init_db.py) to the canonical schema.
+    """
+    columns = {column.lower() for column in _table_columns(conn, 'transactions')}
+    if not columns:
+        create_transactions_table(conn)
+        return
+    if 'timestamp' in columns:
+        return
+
+    conn.create_function('to_real', 1, parse_number, deterministic=True)
+    conn.execute('ALTER TABLE transactions RENAME TO transactions_legacy')
+    create_transactions_table(conn)
+    time_expr = 'Time' if 'time' in columns else 'NULL'
+    conn.execute(f'''
+        INSERT INTO transactions (Id, Date, Time, Timestamp, Symbol, Name, Type, Side,
+                                  AveragePrice, Qty, State, Fees)
+        SELECT
+            COALESCE(CAST(Id AS TEXT), lower(hex(randomblob(16)))),
+            Date,
+            {time_expr},
+            Date || ' ' || COALESCE({time_expr}, '00:00:00'),
+            Symbol, Name, Type, Side,
+            to_real(AveragePrice),
+            to_real(Qty),
+            State,
+            to_real(Fees)
+        FROM transactions_legacy
+        WHERE Date IS NOT NULL AND Symbol IS NOT NULL
+    ''')
+    skipped = conn.execute(
+        'SELECT COUNT(*) FROM transactions_legacy WHERE Date IS NULL OR Symbol IS NULL'
+    ).fetchone()[0]
+    if skipped:
+        logger.warning(f"Dropped {skipped} legacy transactions without a Date or Symbol")
+    conn.execute('DROP TABLE transactions_legacy')
+
+
+def _migrate_positions(conn) -> None:
+    """Version 2: create the materialized positions table and fill it from existing transactions."""
+    init_positions(conn)
+    rebuild_positions(conn)
+
+
+def _migrate_pagination_indexes(conn) -> None:
+    """Version 3: add the (Timestamp, Id) indexes used for keyset pagination and the data_versions table."""
+    for ddl in TIMESTAMP_INDEXES:
+        conn.execute(ddl)
+    init_data_versions(conn)
+
+
+def _migrate_fill_hashes(conn) -> None:
+    """Version 4: add and backfill the FillHash column used to skip duplicate fills in append uploads."""
+    if 'FillHash' not in _table_columns(conn, 'transactions'):
+        conn.execute('ALTER TABLE transactions ADD COLUMN FillHash TEXT')
+    conn.create_function('fill_hash', 6, fill_hash, deterministic=True)
+    conn.execute('''
+        UPDATE transactions
+        SET FillHash = fill_hash(Date, Time, Symbol, Side, Qty, AveragePrice)
+        WHERE FillHash IS NULL
+    ''')
+    conn.execute(FILL_HASH_INDEX)
+
+
+def _migrate_price_split_close(conn) -> None:
+    """
+    Version 5: add the split-only close to the price store. Stored bars have
+    no value for it, so they are dropped and re-fetched on demand.
+    """
+    columns = _table_columns(conn, 'price_history')
+    if not columns or 'split_close' in columns:
+        return
+    conn.execute('ALTER TABLE price_history ADD COLUMN split_close REAL')
+    conn.execute('DELETE FROM price_history')
+    conn.execute('DELETE FROM price_coverage')
+
+
+def _migrate_database_generation(conn) -> None:
+    """Version 6: give an existing database its generation id (see init_data_versions)."""
+    init_data_versions(conn)
+
+
+def _migrate_price_split_only(conn) -> None:
+    """
+    Version 7: store split-only bars with their dividends and apply the
+    dividend adjustment on read. The store is a cache of provider data, so
+    its tables are recreated empty and bars are re-fetched on demand.
+    """
+    conn.execute('DROP TABLE IF EXISTS price_history')
+    conn.execute('DROP TABLE IF EXISTS price_coverage')
+    create_price_tables(conn)
+
+
+# (version, migration) pairs, applied in order to databases below that version
+MIGRATIONS: List[Tuple[int, Callable]] = [
+    (1, _migrate_typed_transactions),
+    (2, _migrate_positions),
+    (3, _migrate_pagination_indexes),
+    (4, _migrate_fill_hashes),
+    (5, _migrate_price_split_close),
+    (6, _migrate_database_generation),
+    (7, _migrate_price_split_only),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn) -> int:
+    """
+    Bring the database up to SCHEMA_VERSION, tracking progress in PRAGMA user_version.
+
+    Each migration runs in its own transaction together with the version bump,
+    so an interrupted migration is rolled back and retried on the next start.
+
+    Args:
+        conn: Open SQLite connection
+
+    Returns:
+        The schema version after migrating
+    """
+    version = get_schema_version(conn)
+    for target, step in MIGRATIONS:
+        if version >= target:
+            continue
+        conn.execute('BEGIN')
+        try:
+            step(conn)
+            conn.execute(f'PRAGMA user_version = {target}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Migrated database schema from version {version} to {target}")
+        version = target
+    return version
@@ -0,0 +1,130 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DateArray = Union[Sequence[str], np.ndarray]
+
+
+def to_day_array(dates: DateArray) -> np.ndarray:
+    """Convert YYYY-MM-DD strings (or datetime-likes) to a datetime64[D] array of day ordinals."""
+    if isinstance(dates, np.ndarray) and dates.dtype == 'datetime64[D]':
+        return dates
+    return np.asarray(dates, dtype='datetime64[D]')
+
+
+class SplitIndex:
+    """
+    Split history for one symbol, sorted once with dates stored as day
+    ordinals and cumulative ratios precomputed, so that any number of dates
+    can be adjusted with a single binary search.
+    """
+
+    def __init__(self, splits: Iterable[Tuple[str, float]]) -> None:
+        ordered = sorted((str(split_date)[:10], float(ratio)) for split_date, ratio in splits)
+        self.dates = np.array([split_date for split_date, _ in ordered], dtype='datetime64[D]')
+        self.ratios = np.array([ratio for _, ratio in ordered], dtype=float)
+
+        # prefix[k] is the product of the first k splits, suffix[k] of splits k onwards
+        self.prefix = np.concatenate(([1.0], np.cumprod(self.ratios)))
+        self.suffix = np.append(np.cumprod(self.ratios[::-1])[::-1], 1.0)
+
+    def __len__(self) -> int:
+        return len(self.ratios)
+
+    def ratio_before(self, dates: DateArray) -> np.ndarray:
+        """
+        Cumulative ratio of all splits strictly before each date.
+
+        Args:
+            dates: Dates as YYYY-MM-DD strings or a datetime64[D] array
+
+        Returns:
+            Array of ratios, 1.0 where no split precedes the date
+        """
+        return self.prefix[np.searchsorted(self.dates, to_day_array(dates), side='left')]
+
+    def ratio_after(self, dates: DateArray) -> np.ndarray:
+        """
+        Cumulative ratio of all splits strictly after each date.
+
+        Multiplying a split-adjusted price by this ratio gives the price that
+        was actually quoted on that date.
+
+        Args:
+            dates: Dates as YYYY-MM-DD strings or a datetime64[D] array
+
+        Returns:
+            Array of ratios, 1.0 where no split follows the date
+        """
+        return self.suffix[np.searchsorted(self.dates, to_day_array(dates), side='right')]
+
+    def adjust(self, prices: Sequence[float], quantities: Sequence[float],
+               dates: DateArray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Adjust whole arrays of transaction prices and quantities in one pass.
+
+        For transactions after a split the price is multiplied and the
+        quantity divided by the cumulative ratio of the splits before them,
+        matching yfinance's split-adjusted history (see `adjust_for_splits`).
+
+        Args:
+            prices: Transaction prices
+            quantities: Transaction quantities
+            dates: Transaction dates as YYYY-MM-DD strings or a datetime64[D] array
+
+        Returns:
+            Tuple of (adjusted prices, adjusted quantities) arrays
+        """
+        prices = np.asarray(prices, dtype=float)
+        quantities = np.asarray(quantities, dtype=float)
+        if not len(self):
+            return prices, quantities
+        ratios = self.ratio_before(dates)
+        return prices * ratios, quantities / ratios
+
+
+@lru_cache(maxsize=1024)
+def compile_split_index(splits: Tuple[Tuple[str, float], ...]) -> SplitIndex:
+    """
+    Build (or reuse) the SplitIndex for a split list.
+
+    Args:
+        splits: Tuple of (date, ratio) tuples, as returned by get_stock_splits
+
+    Returns:
+        Compiled SplitIndex
+    """
+    return SplitIndex(splits)
+
+
+def lookup_split_indexes(symbols: Sequence[str], split_index_for: Callable[[str], SplitIndex],
+                         max_workers: int) -> Dict[str, Optional[SplitIndex]]:
+    """
+    Look up the SplitIndex of many symbols concurrently.
+
+    Args:
+        symbols: Stock symbols
+        split_index_for: Callable returning a symbol's SplitIndex, raising
+            if the splits can't be fetched
+        max_workers: Number of concurrent lookups (e.g. the provider's splits
+            budget, see utils.market_data.endpoint_concurrency)
+
+    Returns:
+        Dictionary of symbol -> SplitIndex, or None where the lookup failed
+    """
+    def lookup(symbol: str) -> Optional[SplitIndex]:
+        try:
+            return split_index_for(symbol)
+        except Exception as e:
+            logger.warning(f"Split lookup for {symbol} failed: {e}")
+            return None
+
+    if not symbols:
+        return {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(symbols, executor.map(lookup, symbols)))
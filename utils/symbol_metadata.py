@@ -0,0 +1,149 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils.market_data import endpoint_concurrency
+
+logger = logging.getLogger(__name__)
+
+# Categories are refreshed in the background once they are older than this
+METADATA_MAX_AGE = 86400  # 24 hours
+
+CATEGORIES = ('mag7', 'other', 'unlisted')
+# Stored for a symbol whose first lookup failed; get_categorized_symbols() places it with default_category
+UNKNOWN_CATEGORY = 'unknown'
+
+Categorizer = Callable[[str, str], str]
+
+
+def init_symbol_metadata(conn) -> None:
+    """
+    Create the symbol_metadata table if it doesn't exist.
+
+    Args:
+        conn: Open SQLite connection
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS symbol_metadata (
+        symbol TEXT PRIMARY KEY,
+        name TEXT,
+        category TEXT NOT NULL,
+        status TEXT NOT NULL,
+        fetched_at REAL NOT NULL
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_symbol_metadata_category ON symbol_metadata (category, symbol)')
+    conn.commit()
+
+
+def upsert_symbol_metadata(conn, rows: Iterable[Tuple[str, str, str, str]]) -> None:
+    """
+    Insert or replace metadata rows. A failed lookup (status 'error') keeps
+    the symbol's last known category, so an outage doesn't reclassify it.
+
+    Args:
+        conn: Open SQLite connection
+        rows: Iterable of (symbol, name, category, status) tuples
+    """
+    now = time.time()
+    conn.executemany('''
+        INSERT INTO symbol_metadata (symbol, name, category, status, fetched_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (symbol) DO UPDATE SET
+            name = excluded.name,
+            category = CASE WHEN excluded.status = 'ok' THEN excluded.category ELSE symbol_metadata.category END,
+            status = excluded.status,
+            fetched_at = excluded.fetched_at
+    ''', [(symbol, name, category, status, now) for symbol, name, category, status in rows])
+    conn.commit()
+
+
+def refresh_symbol_metadata(conn, stocks: List[Tuple[str, str]], categorize: Categorizer,
+                            max_workers: Optional[int] = None) -> int:
+    """
+    Categorize the given stocks against the provider and persist the results.
+
+    Provider calls run concurrently; the database writes happen on the
+    calling thread in a single transaction.
+
+    Args:
+        conn: Open SQLite connection
+        stocks: List of (symbol, name) tuples
+        categorize: Callable (symbol, name) -> 'mag7' | 'other' | 'unlisted';
+            it raises when the provider can't tell, and the symbol is stored
+            with status 'error' so the next refresh retries it
+        max_workers: Number of concurrent provider lookups (default: what the
+            provider's info budget sustains)
+
+    Returns:
+        Number of symbols refreshed
+    """
+    if not stocks:
+        return 0
+
+    def lookup(stock: Tuple[str, str]) -> Tuple[str, str, str, str]:
+        symbol, name = stock
+        try:
+            return symbol, name, categorize(symbol, name), 'ok'
+        except Exception as e:
+            logger.error(f"Error refreshing metadata for {symbol}: {e}")
+            return symbol, name, UNKNOWN_CATEGORY, 'error'
+
+    with ThreadPoolExecutor(max_workers=max_workers or endpoint_concurrency('info')) as executor:
+        rows = list(executor.map(lookup, stocks))
+
+    upsert_symbol_metadata(conn, rows)
+    logger.info(f"Refreshed symbol metadata for {len(rows)} symbols")
+    return len(rows)
+
+
+def get_stale_symbols(conn, max_age: float = METADATA_MAX_AGE) -> List[Tuple[str, str]]:
+    """
+    Find portfolio symbols whose metadata is missing, failed, or older than max_age.
+
+    Returns:
+        List of (symbol, name) tuples
+    """
+    cutoff = time.time() - max_age
+    rows = conn.execute('''
+        SELECT t.Symbol, MAX(t.Name)
+        FROM transactions t
+        LEFT JOIN symbol_metadata m ON m.symbol = t.Symbol
+        WHERE m.symbol IS NULL OR m.status != 'ok' OR m.fetched_at < ?
+        GROUP BY t.Symbol
+    ''', (cutoff,)).fetchall()
+    return [(row[0], row[1]) for row in rows]
+
+
+def get_categorized_symbols(conn, default_category: Optional[Callable[[str], str]] = None) -> Dict[str, List[Dict[str, str]]]:
+    """
+    Group the portfolio's symbols by category with a single query.
+
+    Symbols that have not been categorized yet are placed using
+    `default_category` (or 'other') until the background refresh catches up.
+
+    Args:
+        conn: Open SQLite connection
+        default_category: Optional callable symbol -> category for uncategorized symbols
+
+    Returns:
+        Dict mapping 'mag7'/'other'/'unlisted' to lists of {'symbol', 'name'} dicts
+    """
+    rows = conn.execute('''
+        SELECT t.Symbol, MAX(t.Name), m.category
+        FROM transactions t
+        LEFT JOIN symbol_metadata m ON m.symbol = t.Symbol
+        GROUP BY t.Symbol
+        ORDER BY t.Symbol
+    ''').fetchall()
+
+    categorized = {category: [] for category in CATEGORIES}
+    for symbol, name, category in rows:
+        if category not in categorized:
+            category = default_category(symbol) if default_category else 'other'
+        categorized[category].append({
+            'symbol': symbol,
+            'name': name
+        })
+    return categorized
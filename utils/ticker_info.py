@@ -0,0 +1,210 @@
+import time
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from utils.cache import BoundedCache
+from utils.db import DB_PATH, connect as db_connect
+from utils.market_data import endpoint_concurrency, get_market_data_provider
+from utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+INFO_TTL = 86400  # 24 hours
+ERROR_TTL = 900   # Retry failed lookups after 15 minutes
+MEMORY_BUDGET = 4 * 1024 * 1024  # Bytes of records kept in memory
+
+# Fields kept from the provider's .info payload, mapped to column names
+INFO_FIELDS = {
+    'longName': 'long_name',
+    'sector': 'sector',
+    'industry': 'industry',
+    'industryDisp': 'industry_disp',
+    'quoteType': 'quote_type',
+    'marketCap': 'market_cap',
+}
+
+# A symbol is considered trading if any of these price fields is present
+PRICE_FIELDS = ['regularMarketPrice', 'currentPrice', 'previousClose', 'open']
+
+InfoFetcher = Callable[[str], Dict[str, Any]]
+
+
+def fetch_provider_info(symbol: str) -> Dict[str, Any]:
+    """Fetch the raw .info payload for a symbol from the market data provider."""
+    return get_market_data_provider().info(symbol)
+
+
+class TickerInfoService:
+    """
+    Shared metadata lookup for sector, industry, quoteType, marketCap and
+    longName, backed by a bounded in-memory LRU and a persistent SQLite table
+    with a TTL.
+
+    Every caller that used to read `yf.Ticker(symbol).info` goes through
+    `get()`, so each symbol's payload is fetched at most once per TTL.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, fetch_info: InfoFetcher = fetch_provider_info,
+                 ttl: float = INFO_TTL, error_ttl: float = ERROR_TTL,
+                 memory_budget: int = MEMORY_BUDGET) -> None:
+        self.db_path = db_path
+        self.fetch_info = fetch_info
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self._memory = BoundedCache('ticker_info', max_bytes=memory_budget, ttl=ttl)
+        self._flight = SingleFlight()
+        self._table_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = db_connect(self.db_path)
+        if not self._table_ready:
+            init_ticker_info(conn)
+            self._table_ready = True
+        return conn
+
+    def _is_fresh(self, record: Dict[str, Any]) -> bool:
+        ttl = self.ttl if record['status'] == 'ok' else self.error_ttl
+        return time.time() - record['fetched_at'] < ttl
+
+    def _load(self, symbol: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM ticker_info WHERE symbol = ?', (symbol,)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+
+    def _save(self, record: Dict[str, Any]) -> None:
+        conn = self._connect()
+        try:
+            conn.execute('''
+                INSERT OR REPLACE INTO ticker_info
+                (symbol, long_name, sector, industry, industry_disp, quote_type, market_cap,
+                 has_price, status, error, fetched_at)
+                VALUES (:symbol, :long_name, :sector, :industry, :industry_disp, :quote_type, :market_cap,
+                        :has_price, :status, :error, :fetched_at)
+            ''', record)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _fetch(self, symbol: str) -> Dict[str, Any]:
+        record = {column: None for column in INFO_FIELDS.values()}
+        record.update(symbol=symbol, has_price=0, status='ok', error=None, fetched_at=time.time())
+        try:
+            info = self.fetch_info(symbol) or {}
+            for field, column in INFO_FIELDS.items():
+                record[column] = info.get(field)
+            record['has_price'] = int(any(info.get(field) is not None for field in PRICE_FIELDS))
+        except Exception as e:
+            logger.error(f"Error fetching ticker info for {symbol}: {e}")
+            record['status'] = 'error'
+            record['error'] = str(e)
+        return record
+
+    def get(self, symbol: str) -> Dict[str, Any]:
+        """
+        Get cached metadata for a symbol, fetching it from the provider if it
+        is missing or older than the TTL.
+
+        Args:
+            symbol: Stock symbol
+
+        Returns:
+            Dictionary with long_name, sector, industry, industry_disp,
+            quote_type, market_cap, has_price, status, error and fetched_at
+        """
+        record = self._memory.get(symbol)
+        if record is not None and self._is_fresh(record):
+            return record
+
+        # Concurrent lookups for the same symbol share one load/fetch
+        return self._flight.do(symbol, self._refresh, symbol)
+
+    def _refresh(self, symbol: str) -> Dict[str, Any]:
+        record = self._load(symbol)
+        if record is None or not self._is_fresh(record):
+            fetched = self._fetch(symbol)
+            if fetched['status'] == 'ok' or record is None or record['status'] != 'ok':
+                record = fetched
+                self._save(record)
+            # Otherwise keep serving the last good record while the provider is failing
+
+        self._memory.set(symbol, record)
+        return record
+
+    def prefetch(self, symbols: Iterable[str], max_workers: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Warm the cache for many symbols at once, fetching missing or stale
+        entries concurrently.
+
+        Args:
+            symbols: Stock symbols
+            max_workers: Number of concurrent provider lookups (default: what the
+                provider's info budget sustains)
+
+        Returns:
+            Dictionary mapping each symbol to its metadata record
+        """
+        unique = list(dict.fromkeys(symbols))
+        if not unique:
+            return {}
+        with ThreadPoolExecutor(max_workers=max_workers or endpoint_concurrency('info')) as executor:
+            return dict(zip(unique, executor.map(self.get, unique)))
+
+    def invalidate(self, symbol: Optional[str] = None) -> None:
+        """Drop cached metadata for one symbol, or for all symbols."""
+        if symbol is None:
+            self._memory.clear()
+        else:
+            self._memory.pop(symbol)
+        conn = self._connect()
+        try:
+            if symbol is None:
+                conn.execute('DELETE FROM ticker_info')
+            else:
+                conn.execute('DELETE FROM ticker_info WHERE symbol = ?', (symbol,))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def init_ticker_info(conn) -> None:
+    """
+    Create the ticker_info table if it doesn't exist.
+
+    Args:
+        conn: Open SQLite connection
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS ticker_info (
+        symbol TEXT PRIMARY KEY,
+        long_name TEXT,
+        sector TEXT,
+        industry TEXT,
+        industry_disp TEXT,
+        quote_type TEXT,
+        market_cap REAL,
+        has_price INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL,
+        error TEXT,
+        fetched_at REAL NOT NULL
+    )
+    ''')
+    conn.commit()
+
+
+# Process-wide service shared by app.py and the ESG analysis module
+ticker_info_service = TickerInfoService()
+
+
+def get_ticker_info(symbol: str) -> Dict[str, Any]:
+    """Get cached metadata for a symbol from the shared service."""
+    return ticker_info_service.get(symbol)
+
+
+def prefetch_ticker_info(symbols: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Warm the shared metadata cache for many symbols at once."""
+    return ticker_info_service.prefetch(symbols)